@@ -134,6 +134,44 @@ def parse_input():
                         default=False,
                         action="store_true")
     
+    parser.add_argument("--playback_rate_range",
+                        help="draw a random playback rate in [low, high] for every training sample, scaling its heart rate",
+                        type=float,
+                        nargs=2,
+                        default=None)
+
+    parser.add_argument("--interpolate_playback",
+                        help="blend neighbouring frames at fractional playback positions",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--quality_filter",
+                        help="only sample windows whose frames pass the default quality thresholds",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--watch_catalog",
+                        help="train on the trials appended to the --csv (or --catalog) while training, picked up "
+                             "every epoch; pass the csv ingest_trials.py writes to, e.g --csv subject_data.csv",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--frame_store",
+                        help="read the trials from their frame stores (see scripts/pack_frames.py) when they have one",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--train_shards",
+                        help="stream the training windows from this directory of record shards (see scripts/write_shards.py)",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--catalog",
+                        help="sqlite dataset catalog (see scripts/build_catalog.py) to split the trials from and "
+                             "draw the training windows of, in place of the partition csv",
+                        type=str,
+                        default=None)
+
     parser.add_argument("--greyscale_on",
                         help="convert images to greyscale at runtime",
                         default=False,
@@ -184,6 +222,7 @@ def summarize_arguments(args):
     print(formatter % ("csv", args.csv))
     
     print(formatter % ("ignore_augmented", str(args.ignore_augmented)))
+    print(formatter % ("playback_rate_range", str(args.playback_rate_range)))
     formatter = "[%s] %r"
 
     print(formatter % ("train", args.train))
@@ -339,6 +378,10 @@ def validate_arguments(args):
    
     epochs = args.epochs
 
+    if args.watch_catalog and args.train_shards is not None:
+        raise ArgumentError("--watch_catalog can't pick up new trials from --train_shards, " +
+                            "write them to the shards and restart instead")
+
     # if --test was provided only
     if args.test and not args.train:
         # if no input directory specified, exit for bad input
@@ -370,6 +413,7 @@ def validate_arguments(args):
     
     assert os.path.exists(args.csv), "%s not found" % args.csv
     assert os.path.exists(args.partition_csv), "%s not found" % args.partition_csv
+    assert args.catalog is None or os.path.exists(args.catalog), "%s not found" % args.catalog
  
     return regular, augmented, args.csv, args.partition_csv, batch_size, epochs, args.train, args.load, args.test, input_dir, output_dir, args.greyscale_on 
 
@@ -395,7 +439,11 @@ if __name__ == "__main__":
                         vertical_flip=args.vertical_flip,
                         horizontal_flip=args.horizontal_flip,
                         batch_size=batch_size,
-                        greyscale_on=greyscale_on)
+                        greyscale_on=greyscale_on,
+                        playback_rate_range=args.playback_rate_range,
+                        interpolate_playback=args.interpolate_playback,
+                        quality_thresholds={} if args.quality_filter else None,
+                        frame_store=args.frame_store)
 
     input_shape = None
     x, y = args.dimensions
@@ -424,7 +472,10 @@ if __name__ == "__main__":
                     steps_per_epoch=args.steps_per_epoch,
                     cyclic_lr=cyclic_lr,
                     alt_opt_flow=args.alt_opt_flow,
-                    opt_flow=args.opt_flow)
+                    opt_flow=args.opt_flow,
+                    train_shards=args.train_shards,
+                    watch_catalog=args.watch_catalog,
+                    catalog=args.catalog)
 
     print("starting ... ")
     start = time.time()
@@ -0,0 +1,153 @@
+"""
+Speed augmentation on already extracted (or resized) frames instead of
+videos: each selected trial is resampled in frame space for every speed
+factor of augment_speed2.py, with the same labels and subject naming, and
+only the final frames are written. Replaces augment_speed2.py followed by
+a second extraction and resizing pass over the augmented videos.
+"""
+
+import os
+import argparse
+import pandas as pd
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+import we_panic_utils.basic_utils.video_core.augment as aug
+from we_panic_utils.basic_utils.cache import StageCache
+from we_panic_utils.basic_utils.catalog import Catalog
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Augment the selected trials by resampling their frames")
+    parser.add_argument("frame_dir",
+                        help="directory of extracted trials, $(subject)/Trial$(N)_frames",
+                        type=str)
+
+    parser.add_argument("master_csv",
+                        help="the csv containing all of the subject data",
+                        type=str)
+
+    parser.add_argument("selected",
+                        help="csv of selected subjects",
+                        type=str)
+
+    parser.add_argument("output_dir",
+                        help="directory to write the augmented trials to",
+                        type=str)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension to resize to (0 keeps the resolution of the frames)",
+                        type=int,
+                        default=0)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension to resize to (0 keeps the resolution of the frames)",
+                        type=int,
+                        default=0)
+
+    parser.add_argument("--blend",
+                        help="linearly blend neighbouring frames instead of taking the nearest",
+                        action="store_true")
+
+    parser.add_argument("--max_duration",
+                        help="the longest an augmented trial may be, in seconds",
+                        type=int,
+                        default=30)
+
+    parser.add_argument("--processes",
+                        help="number of trials to augment at once, defaults to the number of cores",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--cache_dir",
+                        help="reuse the augmentations of unchanged trials from this stage cache",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--cache_size",
+                        help="evict least recently used cache entries beyond this many GB",
+                        type=float,
+                        default=None)
+
+    parser.add_argument("--db",
+                        help="also upsert the augmented trials and their lineage into this sqlite dataset catalog",
+                        type=str,
+                        default=None)
+
+    return parser
+
+
+def augment(origin, target, change, width, height, blend, max_duration):
+    # a finished trial has its sidecar written last
+    if os.path.exists(vc.metadata_path(target)):
+        return 0
+
+    return len(aug.resample_frame_dir(origin, target, change, width=width, height=height, blend=blend,
+                                      max_duration=max_duration, writers=1, suppress=True))
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not os.path.isdir(args.frame_dir):
+        raise FileNotFoundError("[frame_dir] -- %s not found" % args.frame_dir)
+
+    width, height = (args.xdim, args.ydim) if args.xdim > 0 and args.ydim > 0 else (None, None)
+
+    selected_df = pd.read_csv(args.selected)
+    data = base.csv2data(args.master_csv)[0]
+
+    cache, keys, cached = None, {}, []
+    if args.cache_dir:
+        cache = StageCache(args.cache_dir, max_bytes=args.cache_size * 2**30 if args.cache_size else None)
+
+    jobs, rows = [], {}
+    with open("aug_log.txt", "w") as aug_log:
+        for subj, trial, change, row in aug.plan_augmentations(selected_df, data, aug_log=aug_log):
+            origin = os.path.join(args.frame_dir, "S%04d" % subj, "Trial%d_frames" % trial)
+            if not os.path.isdir(origin):
+                raise FileNotFoundError("[frame_dir] -- %s not found" % origin)
+
+            target = os.path.join(args.output_dir, "S%s" % row[0], "Trial%d_frames" % trial)
+            rows[target] = (row, trial)
+            if cache is not None:
+                params = {"factor": change, "width": width, "height": height, "blend": args.blend,
+                          "max_duration": args.max_duration}
+                key = cache.plan("augment_frames", [origin, vc.metadata_path(origin)], params,
+                                 [target, vc.metadata_path(target)])
+                if key is None:
+                    cached.append(target)
+                    continue
+                keys[target] = key
+
+            jobs.append((origin, target, change, width, height, args.blend, args.max_duration))
+
+        num_frames, finished = 0, set()
+        for job, result, error in base.parallel_map(augment, jobs, processes=args.processes, name="augment_frames"):
+            if error is not None:
+                log_str = "Failed resampling {} by a factor of {}:\n{}".format(job[0], job[2], error)
+                print(log_str)
+                aug_log.write(log_str + '\n')
+                continue
+
+            num_frames += result
+            finished.add(job[1])
+            if cache is not None:
+                cache.store(keys[job[1]], [job[1], vc.metadata_path(job[1])], stage="augment_frames")
+
+    if cache is not None:
+        cache.save()
+
+    finished.update(cached)
+    done = [rows[target] for target in rows if target in finished]
+    aug.write_augmented_csvs(args.master_csv, args.selected, done)
+
+    if args.db:
+        # the labels of an augmented trial sit in the columns of its trial in the master csv row
+        trial_rows = [[row[0], trial, target, row[2 * trial - 1], row[2 * trial]]
+                      for target, (row, trial) in rows.items() if target in finished]
+        with Catalog(args.db) as catalog:
+            catalog.upsert_trial_rows(trial_rows)
+            catalog.upsert_subjects(aug.catalog_lineage(row[0] for row in trial_rows))
+
+    print("[augment_frames] wrote %d frames for %d augmented trials, %d failed" % (num_frames, len(done), len(rows) - len(done)))
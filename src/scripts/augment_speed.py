@@ -22,7 +22,7 @@ if __name__ == "__main__":
         speed_changes = [round(x*0.1, 1) for x in range(5, 21) if x != 10]
 
         selected_df = pd.read_csv(selected)
-        data = base.csv2data(master_csv)[0]
+        data = dict((row[0], row) for row in base.csv2data(master_csv)[0] if row)
 
         filtered = sorted(zip(list(selected_df["Subject"]), list(selected_df["Trial"])), key=lambda x: x[1])
          
@@ -30,7 +30,7 @@ if __name__ == "__main__":
             master_writer = csv.writer(master)
             master_writer.writerow([])
             for subj, trial in filtered:
-                subj_row = data[subj-1]
+                subj_row = data[str(subj)]
                 heart_rate, resp_rate = 0, 0
                 if trial == 1:
                     heart_rate, resp_rate = float(subj_row[1]), float(subj_row[2])
@@ -1,75 +1,128 @@
-import csv
-import subprocess
+"""
+Augment the selected trials by changing the speed of their videos by
+each of the augment.SPEED_CHANGES factors, scaling the heart rate labels to match.
+
+The transcodes run concurrently (--jobs), outputs that already exist and
+decode are skipped, and the master and selects csvs are rewritten
+atomically once every job has finished.
+"""
+
 import os
-import sys
+import argparse
 import pandas as pd
-import string
 
 import we_panic_utils.basic_utils.basics as base
 import we_panic_utils.basic_utils.video_core as vc
+import we_panic_utils.basic_utils.video_core.augment as aug
+from we_panic_utils.basic_utils.cache import StageCache
 
-UPPER_THRESHOLD = 235
-LOWER_THRESHOLD = 25
 
-if __name__ == "__main__":
+def parse_input():
+    parser = argparse.ArgumentParser("Augment the selected trials by changing their speed")
+    parser.add_argument("data_dir",
+                        help="video file directory, augmented videos are written here too",
+                        type=str)
+
+    parser.add_argument("master_csv",
+                        help="the csv containing all of the subject data",
+                        type=str)
+
+    parser.add_argument("selected",
+                        help="csv of selected subjects",
+                        type=str)
+
+    parser.add_argument("--jobs", "-j",
+                        help="number of videos to transcode at once, defaults to the number of cores",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--cache_dir",
+                        help="reuse the augmentations of unchanged videos from this stage cache",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--cache_size",
+                        help="evict least recently used cache entries beyond this many GB",
+                        type=float,
+                        default=None)
+
+    return parser
+
+
+def valid_output(target, origin):
+    """
+    whether target is a finished augmentation of origin: newer than
+    origin and decodable with at least one frame
+    """
+    if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(origin):
+        return False
+
     try:
-        data_dir = sys.argv[1]
-        master_csv = sys.argv[2]
-        selected = sys.argv[3]
-    except:
-        print("\tUsage: <data_dir> <master_csv> <selected_subjects.csv>")
-    else:       
-        #gives a list of values between 0.5 and 2 without 1
-        #speed_changes = [round(x*0.1, 1) for x in range(5, 21) if x != 10]
-        speed_changes = [0.5, 0.6, 0.7, 0.8, 0.9, 1.2, 1.4, 1.6, 1.8, 2.0]
-        mapping = {key : letter for key, letter in zip(speed_changes, string.ascii_lowercase)}
-        
-        selected_df = pd.read_csv(selected)
-        data = base.csv2data(master_csv)[0]
-
-        filtered = sorted(zip(list(selected_df["Subject"]), list(selected_df["Trial"])), key=lambda x: x[1])
-         
-        with open("aug_log.txt", "w") as aug_log, open(master_csv, 'a') as master:     
-            master_writer = csv.writer(master)
-            master_writer.writerow([])
-            for subj, trial in filtered:
-                subj_row = data[subj-1]
-                heart_rate, resp_rate = 0, 0
-                hr_index, rr_index = -1, -1
-                if trial == 1:
-                    heart_rate, resp_rate = float(subj_row[1]), float(subj_row[2])
-                    hr_index = 1
-                    rr_index = 2
-                elif trial == 2:
-                    heart_rate, resp_rate = float(subj_row[3]), float(subj_row[4])
-                    hr_index = 3
-                    rr_index = 4
-
-                subj_origin = os.path.join(data_dir, "S%04d" % subj, "Trial%d.MOV" % trial)
-                assert os.path.exists(subj_origin)
-                
-                for change in speed_changes:
-                    if heart_rate * (1/change) > UPPER_THRESHOLD or heart_rate * (1/change) < LOWER_THRESHOLD:
-                        log_str = "Not changing the speed of subject {} trial {} by factor of {}: resulting" \
-                                " heart rate would have been {}".format(subj, trial, change, heart_rate * (1/change))
-                        print(log_str)
-                        aug_log.write(log_str + '\n')
-                    else:
-                        """     s   hr1  rr1  hr2  rr2   """
-                        """     |    |    |    |    |    """ 
-                        row = ["",  "",  "",  "",  ""]
-                        
-                        new_subj = "%s%d%02d" % (mapping[change], trial,  subj)
-                        new_subj_path = "S%s" % new_subj
-                        subj_target = os.path.join(data_dir, new_subj_path, "Trial%d.MOV" % trial)
-                        base.check_exists_create_if_not(os.path.join(data_dir, new_subj_path))
-                        row[0] = new_subj
-                        
-                        row[hr_index] = round(heart_rate * (1/change), 1)
-                        row[rr_index] = (heart_rate * (1/change)) / 4
-                        selected_df.loc[len(selected_df)] = [new_subj, trial]
-
-                        vc.change_speed(subj_origin, subj_target, change)
-                        master_writer.writerow(row) 
-            
-            selected_df.to_csv(selected, encoding='utf-8', index=False)
+        return vc.video_info(target, persist=False)["frame_count"] > 0
+    except Exception:
+        return False
+
+
+def augment(origin, target, change):
+    if valid_output(target, origin):
+        return False
+
+    vc.change_speed(origin, target, change)
+    return True
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+    data_dir, master_csv, selected = args.data_dir, args.master_csv, args.selected
+
+    selected_df = pd.read_csv(selected)
+    data = base.csv2data(master_csv)[0]
+
+    cache, keys = None, {}
+    if args.cache_dir:
+        cache = StageCache(args.cache_dir, max_bytes=args.cache_size * 2**30 if args.cache_size else None)
+
+    jobs, rows, cached = [], {}, []
+    with open("aug_log.txt", "w") as aug_log:
+        for subj, trial, change, row in aug.plan_augmentations(selected_df, data, aug_log=aug_log):
+            subj_origin = os.path.join(data_dir, "S%04d" % subj, "Trial%d.MOV" % trial)
+            assert os.path.exists(subj_origin)
+
+            new_subj_path = "S%s" % row[0]
+            subj_target = os.path.join(data_dir, new_subj_path, "Trial%d.MOV" % trial)
+            base.check_exists_create_if_not(os.path.join(data_dir, new_subj_path), suppress=True)
+
+            rows[subj_target] = (row, trial)
+            if cache is not None:
+                key = cache.plan("augment", [subj_origin], {"factor": change, "max_duration": 30}, [subj_target])
+                if key is None:
+                    cached.append(subj_target)
+                    continue
+                keys[subj_target] = key
+
+            jobs.append((subj_origin, subj_target, change))
+
+        # the transcodes spend their time in ffmpeg, so threads are enough
+        made, skipped, finished = 0, 0, set()
+        for job, result, error in base.parallel_map(augment, jobs, processes=args.jobs, threads=True, name="augment_speed2"):
+            if error is not None:
+                log_str = "Failed changing the speed of {} by a factor of {}:\n{}".format(job[0], job[2], error)
+                print(log_str)
+                aug_log.write(log_str + '\n')
+                continue
+
+            made, skipped = made + result, skipped + (not result)
+            finished.add(job[1])
+            if cache is not None:
+                cache.store(keys[job[1]], [job[1]], stage="augment")
+
+    if cache is not None:
+        cache.save()
+
+    # keep the planning order in the csvs
+    finished.update(cached)
+    skipped += len(cached)
+    done = [rows[subj_target] for subj_target in rows if subj_target in finished]
+    aug.write_augmented_csvs(master_csv, selected, done)
+
+    print("[augment_speed2] made %d videos, %d already existed, %d failed" % (made, skipped, len(rows) - len(done)))
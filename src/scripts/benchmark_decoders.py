@@ -0,0 +1,56 @@
+"""
+Time the video decoder backends of video_core against each other
+on the same video, optionally resizing to training resolution.
+"""
+
+import time
+import argparse
+
+import we_panic_utils.basic_utils.video_core as vc
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("benchmark the video decoder backends")
+    parser.add_argument("movie_file",
+                        help="video file to decode",
+                        type=str)
+
+    parser.add_argument("--repeat", "-r",
+                        help="number of times to decode the video with each backend",
+                        type=int,
+                        default=3)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension to resize to (0 to keep full resolution)",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension to resize to (0 to keep full resolution)",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--clip",
+                        help="seconds to clip off of each end of the video",
+                        type=int,
+                        default=2)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    size = (args.xdim, args.ydim) if args.xdim > 0 and args.ydim > 0 else None
+
+    for decoder in sorted(vc.DECODERS):
+        timings = []
+        frames = 0
+        for _ in range(args.repeat):
+            start = time.time()
+            frames = sum(1 for _ in vc.decode_video(args.movie_file, decoder=decoder, size=size, clip=args.clip))
+            timings.append(time.time() - start)
+
+        best = min(timings)
+        print("[%s] %d frames, best of %d: %.2fs (%.1f frames/s)"
+              % (decoder, frames, args.repeat, best, frames / best if best > 0 else 0.))
@@ -0,0 +1,135 @@
+"""
+Compare the size and the window read throughput of the ways a trial's
+frames can be stored: the PNG tree, the raw memory mapped frame store and
+the compressed frame archive (with and without temporal delta encoding).
+
+    python benchmark_frame_stores.py rsz32/ --trials 5 --windows 200
+
+The stores and archives are packed into a scratch directory, nothing is
+written next to the frames. Reads are timed on a warm page cache.
+"""
+
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import cv2
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.frame_store as fs
+from we_panic_utils.basic_utils.video_core.partitions import trial_frame_names
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("benchmark the frame storage formats")
+    parser.add_argument("frame_dir",
+                        help="directory of $(subject)/Trial$(N)_frames trials, e.g rsz32/",
+                        type=str)
+
+    parser.add_argument("--trials", "-t",
+                        help="the number of trials to benchmark on",
+                        type=int,
+                        default=5)
+
+    parser.add_argument("--windows", "-w",
+                        help="the number of random windows to read from each trial",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--length", "-l",
+                        help="the length of a window, in frames",
+                        type=int,
+                        default=60)
+
+    parser.add_argument("--chunk_size",
+                        help="frames compressed together in the archives",
+                        type=int,
+                        default=32)
+
+    return parser
+
+
+def trial_dirs(frame_dir, limit):
+    found = []
+    for subject in sorted(os.listdir(frame_dir), key=base.natural_key):
+        subject_dir = os.path.join(frame_dir, subject)
+        if not os.path.isdir(subject_dir):
+            continue
+        for trial in sorted(os.listdir(subject_dir), key=base.natural_key):
+            trial_dir = os.path.join(subject_dir, trial)
+            if trial.endswith("_frames") and os.path.isdir(trial_dir) and trial_frame_names(trial_dir)[0]:
+                found.append(trial_dir)
+                if len(found) == limit:
+                    return found
+    return found
+
+
+def read_png_window(trial_dir, frames, start, length):
+    return np.stack([cv2.cvtColor(cv2.imread(os.path.join(trial_dir, f)), cv2.COLOR_BGR2RGB)
+                     for f in frames[start:start + length]])
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    trials = trial_dirs(args.frame_dir, args.trials)
+    if not trials:
+        raise FileNotFoundError("no trials with frames in %s" % args.frame_dir)
+
+    scratch = tempfile.mkdtemp(prefix="benchmark_frame_stores")
+    codecs = sorted(c.decode("ascii") for c in fs.archive.CODECS)
+    formats = ["png", "memmap"] + ["%s%s" % (codec, delta) for codec in codecs for delta in ("", "+delta")]
+    sizes = dict((name, 0) for name in formats)
+    timings = dict((name, 0.) for name in formats)
+    frames_read = 0
+
+    try:
+        for t, trial_dir in enumerate(trials):
+            frames, _ = trial_frame_names(trial_dir)
+            sizes["png"] += sum(os.path.getsize(os.path.join(trial_dir, f)) for f in frames)
+
+            readers = {"png": lambda start: read_png_window(trial_dir, frames, start, args.length)}
+
+            path = os.path.join(scratch, "%d.frames" % t)
+            fs.pack_frames(trial_dir, output_path=path)
+            sizes["memmap"] += os.path.getsize(path)
+            store = fs.FrameStore(path)
+            # copy the window so the memmap's pages are actually read
+            readers["memmap"] = lambda start, store=store: np.array(store.window(start, args.length))
+
+            for codec in codecs:
+                for delta in (False, True):
+                    name = "%s%s" % (codec, "+delta" if delta else "")
+                    path = os.path.join(scratch, "%d.%s.archive" % (t, name))
+                    fs.pack_archive(trial_dir, output_path=path, chunk_size=args.chunk_size, codec=codec, delta=delta)
+                    sizes[name] += os.path.getsize(path)
+                    readers[name] = lambda start, archive=fs.FrameArchive(path): archive.window(start, args.length)
+
+            if len(frames) < args.length:
+                continue
+
+            starts = [random.randint(0, len(frames) - args.length) for _ in range(args.windows)]
+            reference = [store.window(start, args.length) for start in starts[:3]]
+            for name in formats:
+                for start, expected in zip(starts, reference):
+                    assert np.array_equal(readers[name](start), expected), "%s read the wrong frames" % name
+
+                begin = time.time()
+                for start in starts:
+                    readers[name](start)
+                timings[name] += time.time() - begin
+
+            frames_read += args.windows * args.length
+
+    finally:
+        shutil.rmtree(scratch)
+
+    print("[benchmark_frame_stores] %d trials, %d random windows of %d frames each"
+          % (len(trials), args.windows, args.length))
+    for name in formats:
+        rate = frames_read / timings[name] if timings[name] > 0 else 0.
+        print("[%-12s] %8.1f MB (%5.2fx png), %9.0f frames/s"
+              % (name, sizes[name] / 2.**20, sizes[name] / float(sizes["png"]), rate))
@@ -0,0 +1,185 @@
+"""
+Build (or update) the sqlite dataset catalog from the csvs and frame trees
+the preprocessing stages leave behind, for the trees built before the stages
+wrote to the catalog themselves (see --db of build_dataset.py,
+ingest_trials.py, augment_frames.py, partition_trials.py and
+catalog_partitions.py):
+
+    python build_catalog.py dataset.db --master DeepLearningClassData.csv \\
+        --trials subject_data.csv subject_data_augmented.csv \\
+        --frames rsz32/ rsz32_augmented/ --partitions partitions_cons.csv
+
+    python run_model.py ... --catalog dataset.db
+
+Everything is upserted, so running it again only updates what changed.
+The lineage of the augmented subjects is read from their names.
+"""
+
+import os
+import argparse
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.catalog import Catalog
+
+EXCLUDE = [".DS_Store", "._.DS_Store"]
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Build the sqlite dataset catalog")
+    parser.add_argument("db",
+                        help="the catalog, created if it does not exist",
+                        type=str)
+
+    parser.add_argument("--master",
+                        help="master csvs of Subject, HR1, RR1, HR2, RR2 rows, e.g DeepLearningClassData.csv",
+                        type=str,
+                        nargs="+",
+                        default=[])
+
+    parser.add_argument("--trials",
+                        help="csvs of Subject, Trial, [Path,] Heart Rate, Respiratory Rate rows, e.g subject_data.csv",
+                        type=str,
+                        nargs="+",
+                        default=[])
+
+    parser.add_argument("--frames",
+                        help="directories of S$(subject)/Trial$(N)_frames trials, their partitions are cataloged too",
+                        type=str,
+                        nargs="+",
+                        default=[])
+
+    parser.add_argument("--kind",
+                        help="the kind of storage location the --frames trials are cataloged as",
+                        type=str,
+                        default="frames")
+
+    parser.add_argument("--partitions",
+                        help="partition record csvs written by catalog_partitions.py --index",
+                        type=str,
+                        nargs="+",
+                        default=[])
+
+    return parser
+
+
+def master_trials(master_csv):
+    """
+    the trials of the rows of a master csv, skipping the trials without labels
+    """
+    data, _ = base.csv2data(master_csv)
+    for row in data:
+        if not row or not row[0]:
+            continue
+        for trial in (1, 2):
+            labels = row[2 * trial - 1:2 * trial + 1]
+            if len(labels) == 2 and labels[0] != "":
+                yield {"subject": row[0], "trial": trial,
+                       "heart_rate": float(labels[0]), "resp_rate": float(labels[1])}
+
+
+def csv_trials(trials_csv):
+    """
+    the trials and, when the csv has a Path column, the frame locations of a trial csv
+    """
+    data, header = base.csv2data(trials_csv)
+    columns = dict((name.lower(), i) for i, name in enumerate(header))
+    trials, locations = [], []
+    for row in data:
+        if not row:
+            continue
+        subject, trial = row[columns["subject"]], int(row[columns["trial"]])
+        trials.append({"subject": subject, "trial": trial,
+                       "heart_rate": float(row[columns["heart rate"]]),
+                       "resp_rate": float(row[columns["respiratory rate"]])})
+        if "path" in columns and row[columns["path"]]:
+            locations.append({"subject": subject, "trial": trial, "kind": "frames", "path": row[columns["path"]]})
+
+    return trials, locations
+
+
+def scan_frames(frame_dir, kind):
+    """
+    the trials, storage locations and partition windows of a frame tree
+    """
+    trials, locations, windows = [], [], []
+    for subject_dir in sorted(os.listdir(frame_dir), key=base.natural_key):
+        subject_path = os.path.join(frame_dir, subject_dir)
+        if subject_dir in EXCLUDE or not subject_dir.startswith("S") or not os.path.isdir(subject_path):
+            continue
+        subject = subject_dir[1:].lstrip("0") if subject_dir[1:].isdigit() else subject_dir[1:]
+
+        for trial_dir in sorted(os.listdir(subject_path), key=base.natural_key):
+            trial_path = os.path.join(subject_path, trial_dir)
+            if not trial_dir.endswith("_frames") or not os.path.isdir(trial_path):
+                continue
+            trial = int(trial_dir.split("_")[0][len("Trial"):])
+            path = os.path.abspath(trial_path)
+
+            locations.append({"subject": subject, "trial": trial, "kind": kind, "path": path})
+            for store, extension in (("store", ".frames"), ("archive", ".archive")):
+                if os.path.exists(path + extension):
+                    locations.append({"subject": subject, "trial": trial, "kind": store, "path": path + extension})
+
+            metadata = vc.read_trial_metadata(trial_path)
+            if metadata is not None:
+                trials.append({"subject": subject, "trial": trial, "fps": metadata.get("fps"),
+                               "frame_count": metadata.get("frame_count", len(metadata.get("frames", [])))})
+
+            partitions = vc.trial_partitions(trial_path)
+            if partitions:
+                windows.append((subject, trial, [{"partition": p, "path": os.path.abspath(pth)}
+                                                 for p, pth in partitions]))
+
+    return trials, locations, windows
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    catalog = Catalog(args.db)
+
+    for master_csv in args.master:
+        count = catalog.upsert_trials(master_trials(master_csv))
+        print("[build_catalog] %d trials from %s" % (count, master_csv))
+
+    for trials_csv in args.trials:
+        trials, locations = csv_trials(trials_csv)
+        catalog.upsert_trials(trials)
+        catalog.upsert_locations(locations)
+        print("[build_catalog] %d trials from %s" % (len(trials), trials_csv))
+
+    for frame_dir in args.frames:
+        if not os.path.isdir(frame_dir):
+            raise FileNotFoundError("[frames] -- %s not found" % frame_dir)
+
+        trials, locations, windows = scan_frames(frame_dir, args.kind)
+        # the labels come from the csvs, here only the trials and their frame rate and length
+        catalog.upsert_trials({"subject": l["subject"], "trial": l["trial"]} for l in locations if l["kind"] == args.kind)
+        catalog.upsert_trials(trials)
+        catalog.upsert_locations(locations)
+        for subject, trial, rows in windows:
+            catalog.replace_windows(subject, trial, rows)
+        print("[build_catalog] %d trial locations and %d partitioned trials in %s"
+              % (len(locations), len(windows), frame_dir))
+
+    for partition_csv in args.partitions:
+        by_trial = {}
+        for record in vc.read_partition_records(partition_csv):
+            if not record.get("path"):
+                continue
+            key = (record["subject"], int(record["trial"]))
+            by_trial.setdefault(key, []).append({"partition": int(record["partition"]), "path": record["path"],
+                                                 "start": int(record["start"]), "length": int(record["length"]),
+                                                 "stride": int(record["stride"])})
+        for (subject, trial), rows in by_trial.items():
+            catalog.replace_windows(subject, trial, rows)
+        print("[build_catalog] %d windows of %d trials from %s"
+              % (sum(len(rows) for rows in by_trial.values()), len(by_trial), partition_csv))
+
+    # the augmented subjects carry their lineage in their names, see augment.augmented_subject
+    catalog.upsert_subjects(vc.catalog_lineage(set(row["subject"] for row in catalog.trials())))
+
+    print("[build_catalog] %s: %d trials (%d augmented), %d windows"
+          % (args.db, len(catalog.trials()), len(catalog.trials(augmented=True)), len(catalog.windows())))
+    catalog.close()
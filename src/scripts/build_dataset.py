@@ -0,0 +1,181 @@
+"""
+Build the training frames of the selected trials as a resumable dependency
+graph: one task per trial for the proxy, the streamed (decoded, trimmed and
+resized) frames and each frame-space speed augmentation. Finished tasks are
+checkpointed in a manifest, so an interrupted build resumes where it stopped
+instead of treating a half written directory as done, and the real and the
+augmented branches run concurrently. Replaces the chain of scripts of
+generate_dataset; run_setups still builds the full resolution frames/ and
+the resized rsz/ trials, with the augmented subjects appended to
+NextStartingPoint.csv, that run_model.py reads by default.
+"""
+
+import os
+import argparse
+import pandas as pd
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+import we_panic_utils.basic_utils.video_core.augment as aug
+from we_panic_utils.basic_utils.build import BuildGraph
+from we_panic_utils.basic_utils.catalog import Catalog
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Build the frames of the selected trials")
+    parser.add_argument("selects",
+                        help="csv of selected subjects",
+                        type=str)
+
+    parser.add_argument("data_csv",
+                        help="the csv containing all of the subject data",
+                        type=str)
+
+    parser.add_argument("movie_directory",
+                        help="video file directory",
+                        type=str)
+
+    parser.add_argument("output_directory",
+                        help="the directory to write the frames of the real trials to, "
+                             "the augmented trials go to $(output_directory)_augmented",
+                        type=str)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension of the frames",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension of the frames",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--clip",
+                        help="seconds to clip off of each end of the videos",
+                        type=int,
+                        default=2)
+
+    parser.add_argument("--proxy_directory",
+                        help="transcode the videos to proxies of the frame size here first, in a "
+                             "$(xdim)x$(ydim) subdirectory (none to decode the originals)",
+                        type=str,
+                        default="proxies/")
+
+    parser.add_argument("--augment",
+                        help="also build the frame-space speed augmentations",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--workers", "-w",
+                        help="the number of tasks to run at once",
+                        type=int,
+                        default=os.cpu_count())
+
+    parser.add_argument("--threads",
+                        help="run the tasks in threads instead of processes",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--manifest",
+                        help="the build manifest, defaults to $(output_directory).manifest.json",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--db",
+                        help="also upsert the built trials into this sqlite dataset catalog",
+                        type=str,
+                        default=None)
+
+    return parser
+
+
+def trial_labels(metadf, subject, trial):
+    data = metadf[metadf['SUBJECT'] == str(subject)]
+    subj, t1_hrate, t1_resprate, t2_hrate, t2_resprate = [list(data[col])[0] for col in metadf.columns]
+
+    if trial == 1:
+        return float(t1_hrate), float(t1_resprate)
+    return float(t2_hrate), float(t2_resprate)
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not os.path.exists(args.selects):
+        raise FileNotFoundError("[selects] -- %s not found" % args.selects)
+
+    if not os.path.exists(args.data_csv):
+        raise FileNotFoundError("[data_csv] -- %s not found" % args.data_csv)
+
+    if not os.path.isdir(args.movie_directory):
+        raise FileNotFoundError("[movie_dir] -- %s not found" % args.movie_directory)
+
+    output_directory = args.output_directory.rstrip("/")
+    augmented_directory = output_directory + "_augmented"
+    proxies = args.proxy_directory.lower() != "none"
+
+    graph = BuildGraph(args.manifest or output_directory + ".manifest.json",
+                       workers=args.workers, processes=not args.threads)
+
+    selects_df = pd.read_csv(args.selects, dtype={'Subject': str})
+    metadf = pd.read_csv(args.data_csv, dtype={'SUBJECT': str})
+
+    rows, augmented_rows = [], []
+    for index, row in selects_df.iterrows():
+        subject, trial = row['Subject'], int(row['Trial'])
+        if not subject.isdigit():
+            continue
+
+        fmt_dir = 'S' + subject.zfill(4)
+        name = "%s/Trial%d" % (fmt_dir, trial)
+        movie = vc.trial_video_path(args.movie_directory, fmt_dir, trial)
+        heart_rate, resp_rate = trial_labels(metadf, subject, trial)
+
+        deps = []
+        if proxies:
+            # proxies of every frame size live side by side, so one never stands in for another
+            proxy_directory = os.path.join(args.proxy_directory, "%dx%d" % (args.xdim, args.ydim))
+            proxy = os.path.join(proxy_directory, fmt_dir, "Trial%d%s" % (trial, vc.PROXY_CODECS["mjpeg"][1]))
+            deps = [graph.add("proxy:" + name, vc.make_proxy, args=(movie, proxy_directory),
+                              kwargs={"width": args.xdim, "height": args.ydim, "suppress": True}, outputs=[proxy])]
+            movie = proxy
+
+        trial_dir = os.path.join(output_directory, fmt_dir, "Trial%d_frames" % trial)
+        frames = graph.add("frames:" + name, vc.stream_video_file, args=(movie, output_directory),
+                           kwargs={"width": args.xdim, "height": args.ydim, "clip": args.clip, "suppress": True},
+                           deps=deps, outputs=[trial_dir, vc.metadata_path(trial_dir)])
+        rows.append((frames, [subject, trial, trial_dir, heart_rate, resp_rate]))
+
+        if not args.augment:
+            continue
+
+        for change in aug.SPEED_CHANGES:
+            labels = aug.augmented_labels(heart_rate, change)
+            if labels is None:
+                continue
+
+            new_subj = aug.augmented_subject(int(subject), trial, change)
+            augmented_dir = os.path.join(augmented_directory, "S%s" % new_subj, "Trial%d_frames" % trial)
+            task = graph.add("augment:%s/%s" % (name, str(change)), aug.resample_frame_dir,
+                             args=(trial_dir, augmented_dir, change), kwargs={"suppress": True},
+                             deps=[frames], outputs=[augmented_dir, vc.metadata_path(augmented_dir)])
+            augmented_rows.append((task, [new_subj, trial, augmented_dir, labels[0], labels[1]]))
+
+    done, skipped, failed = graph.run()
+
+    # catalog the trials that are built, leaving out the ones that failed
+    failed = set(failed)
+    header = ["Subject", "Trial", "Path", "Heart Rate", "Respiratory Rate"]
+    base.write_csv_atomic("subject_data.csv", [row for task, row in rows if task not in failed], header=header)
+    if args.augment:
+        base.write_csv_atomic("subject_data_augmented.csv",
+                              [row for task, row in augmented_rows if task not in failed], header=header)
+
+    if args.db:
+        built = [row for task, row in rows + augmented_rows if task not in failed]
+        with Catalog(args.db) as catalog:
+            catalog.upsert_trial_rows(built)
+            catalog.upsert_subjects(aug.catalog_lineage(row[0] for row in built))
+        print("[*] cataloged %d trials in %s" % (len(built), args.db))
+
+    print("[*] %d tasks ran, %d were up to date, %d failed" % (len(done), len(skipped), len(failed)))
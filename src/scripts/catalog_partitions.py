@@ -2,23 +2,90 @@
 Catalog partitions in a .csv of the form:
 
 SUBJECT     TRIAL       PARTITION       HEART RATE      RESPIRATORY RATE
+
+With --index the partitions are not read from a partitioned directory but
+computed as index records over the unpartitioned frame directory, and the
+PATH, START, LENGTH and STRIDE of each record are cataloged as well.
+
+With --db catalog.db the trials and their partitions (directories or index
+records) are upserted into the sqlite dataset catalog too.
 """
 
-import re
 import os
 import sys
 import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.catalog import Catalog
 
-numbers = re.compile(r'(\d+)')
-def numericalSort(value):
-    parts = numbers.split(value)
-    parts[1::2] = map(int, parts[1::2])
-    return parts
+numericalSort = base.natural_key
 
 def usage():
-    print("[usage]: python %s <partition-dir> <master_csv>" % sys.argv[0])
+    print("[usage]: python %s <partition-dir> <master_csv> [--db catalog.db]" % sys.argv[0])
+    print("         python %s <frame-dir> <master_csv> [--db catalog.db] --index [num_seconds] [overlap]" % sys.argv[0])
     sys.exit();
 
+def labels(row, TRIAL):
+    if int(TRIAL) == 1:
+        HEART_RATE, RESPIRATORY_RATE = row[1:3]
+    else:
+        HEART_RATE, RESPIRATORY_RATE = row[3:]
+
+    HEART_RATE_CLASS = "HIGH" if int(HEART_RATE) >= 100 else "LOW"
+    return HEART_RATE, RESPIRATORY_RATE, HEART_RATE_CLASS
+
+def pop_option(name):
+    """
+    remove --name value from sys.argv and return the value, None if it is not there
+    """
+    if name not in sys.argv[:-1]:
+        return None
+    index = sys.argv.index(name)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
+def upsert_windows(catalog, windows):
+    """
+    replace the windows of every trial in windows, a dict of
+    (subject, trial) -> (heart rate, respiratory rate, window rows)
+    """
+    catalog.upsert_trials({"subject": subject, "trial": int(trial), "heart_rate": float(hr), "resp_rate": float(rr)}
+                          for (subject, trial), (hr, rr, _) in windows.items())
+    for (subject, trial), (_, _, rows) in windows.items():
+        catalog.replace_windows(subject, int(trial), rows)
+
+def catalog_index(dir_, mat, num_seconds=2, overlap=0., catalog=None):
+    exclude = [".DS_Store","._.DS_Store"]
+    records, rows, windows = [], [], {}
+
+    for child in sorted(os.listdir(dir_)):
+        pth = os.path.join(dir_, child)
+        if not os.path.isdir(pth) or child in exclude:
+            continue
+
+        for grandchild in sorted(os.listdir(pth), key=numericalSort):
+            fullpth = os.path.join(pth, grandchild)
+            if grandchild in exclude or not os.path.isdir(fullpth):
+                continue
+
+            SUBJECT = str(int(child[1:]))
+            TRIAL   = grandchild.split("_")[0][-1]
+            label   = labels(mat[SUBJECT], TRIAL)
+            trial_windows = windows.setdefault((SUBJECT, TRIAL), (label[0], label[1], []))[2]
+
+            for PARTITION, record in enumerate(vc.partition_records(fullpth, num_seconds=num_seconds, overlap=overlap)):
+                records.append(record)
+                rows.append([SUBJECT, TRIAL, str(PARTITION)] + list(label))
+                trial_windows.append(dict(record, partition=PARTITION, path=os.path.abspath(record["path"])))
+
+    header = ["SUBJECT","TRIAL","PARTITION","HEART RATE","RESPIRATORY RATE","HEART RATE CLASS"]
+    vc.write_partition_records(records, "partitions_cons.csv", extra_header=header, extra_rows=rows)
+    if catalog is not None:
+        upsert_windows(catalog, windows)
+
+    hrhigh = sum(1 for row in rows if row[-1] == "HIGH")
+    return hrhigh, len(rows) - hrhigh
+
 def parse_input():
     try:
         dir_ = sys.argv[1]
@@ -34,16 +101,29 @@ def parse_input():
         usage()
 
 if __name__ == "__main__":
+    db = pop_option("--db")
+    catalog = Catalog(db) if db else None
     dir_, csv_ = parse_input()
     hrhigh = 0
     hrlow = 0
     mat, header = base.csv2data(csv_)
+    # the rows are not in subject order once augmentations have been appended
+    mat = dict((row[0], row) for row in mat if row)
+
+    if "--index" in sys.argv:
+        options = sys.argv[sys.argv.index("--index") + 1:]
+        num_seconds = int(options[0]) if len(options) > 0 else 2
+        overlap = float(options[1]) if len(options) > 1 else 0.
+        hrhigh, hrlow = catalog_index(dir_, mat, num_seconds=num_seconds, overlap=overlap, catalog=catalog)
+        print("done! %d samples with high heart rate, %d samples with low heart rate" % (hrhigh,hrlow))
+        sys.exit()
     
     csv_ = open(csv_, "r")
     #print(header)
     output_csv = open("partitions_cons.csv","w")
     
     exclude = [".DS_Store","._.DS_Store"]
+    windows = {}
     
     header = ["SUBJECT","TRIAL","PARTITION","HEART RATE","RESPIRATORY RATE","HEART RATE CLASS"] 
     csvh = base.CSV_Helper(csv_, output_csv, header=header)
@@ -56,13 +136,15 @@ if __name__ == "__main__":
             
             # gives TrialN_frames
             for grandchild in sorted(os.listdir(pth), key=numericalSort):
-                if grandchild not in exclude:
+                fullpth = os.path.join(pth, grandchild)
+                
+                # skip the metadata sidecars sitting next to the trial directories
+                if grandchild not in exclude and os.path.isdir(fullpth):
                     
-                    fullpth = os.path.join(pth, grandchild)
                     
                     # gives partition namees
                     for greatgc in sorted(os.listdir(fullpth), key=numericalSort):
-                        if greatgc not in exclude:
+                        if greatgc not in exclude and greatgc.isdigit():
                             
                             # write to output_csv the follwoing
                             # SUBJECT
@@ -74,7 +156,7 @@ if __name__ == "__main__":
                             SUBJECT = str(int(child[1:]))
                             TRIAL   = grandchild.split("_")[0][-1]
                             PARTITION = str(int(greatgc))
-                            row = mat[int(SUBJECT)-1]
+                            row = mat[SUBJECT]
                             
                             HEART_RATE, RESPIRATORY_RATE = "", ""
                             HEART_RATE_CLASS = "LOW"
@@ -91,7 +173,11 @@ if __name__ == "__main__":
                                 hrlow+=1
 
                             csvh.csv_writer.writerow([SUBJECT, TRIAL, PARTITION, HEART_RATE, RESPIRATORY_RATE,HEART_RATE_CLASS])
+                            windows.setdefault((SUBJECT, TRIAL), (HEART_RATE, RESPIRATORY_RATE, []))[2].append(
+                                {"partition": int(PARTITION), "path": os.path.abspath(os.path.join(fullpth, greatgc))})
                             #print([SUBJECT, TRIAL, PARTITION])
     csvh.release()
+    if catalog is not None:
+        upsert_windows(catalog, windows)
 
     print("done! %d samples with high heart rate, %d samples with low heart rate" % (hrhigh,hrlow))
@@ -1,14 +1,28 @@
 """
 Consolidate the data to one directory of subdirs
 where the subdir name reflects the subject_trial_partition
+
+The frames are hard linked into the consolidated directory (symlinked
+when the two are on different filesystems), so consolidating costs no
+disk space; --copy copies them like before. With --manifest nothing is
+created at all: <consolidated_out> is a csv mapping each slug to its
+partition directory, which consolidated_to_csv.py and the loaders
+resolve directly.
+
+With --index, nothing is copied: <directory> is the unpartitioned
+frame directory and a csv of partition records (slug, trial path,
+start, length, stride) over each trial's frames is written instead.
 """
 
 import os
 import sys
 import shutil
+import we_panic_utils.basic_utils.video_core as vc
 
 def usage():
-    print("[usage] %s <directory> <consolidated_out_dir>" % sys.argv[0])
+    print("[usage] %s <directory> <consolidated_out_dir> [--copy]" % sys.argv[0])
+    print("        %s <directory> <manifest_csv> --manifest" % sys.argv[0])
+    print("        %s <frame_dir> <records_csv> --index [num_seconds] [overlap]" % sys.argv[0])
     sys.exit()
 
 def parse_input(): 
@@ -24,10 +38,33 @@ def parse_input():
     except IndexError:
         usage()
 
-if __name__ == '__main__':
-    #pass
-    dir_, out_dir_ = parse_input()
-    os.makedirs(out_dir_)
+def consolidate_index(dir_, csv_out, num_seconds=2, overlap=0.):
+    exclude = [".DS_Store","._.DS_Store"]
+    records, slugs = [], []
+
+    for child in sorted(os.listdir(dir_)):
+        pth = os.path.join(dir_, child)
+        if not os.path.isdir(pth) or child in exclude:
+            continue
+
+        for grandchild in sorted(os.listdir(pth)):
+            fullpth = os.path.join(pth, grandchild)
+            if grandchild in exclude or not os.path.isdir(fullpth):
+                continue
+
+            TRIAL = grandchild.split("_")[0][-1]
+            for PARTITION, record in enumerate(vc.partition_records(fullpth, num_seconds=num_seconds, overlap=overlap)):
+                records.append(record)
+                slugs.append(["%s_t%s_p%d" % (child, TRIAL, PARTITION)])
+
+    vc.write_partition_records(records, csv_out, extra_header=["SLUG"], extra_rows=slugs)
+    print("[consolidate_index] wrote %d partition records to %s" % (len(records), csv_out))
+
+def partition_dirs(dir_):
+    """
+    yield (slug, partition directory) for every partition of every
+    $(subject)/Trial$(N)_frames trial in dir_
+    """
     exclude = [".DS_Store","._.DS_Store"]
      
     for child in sorted(os.listdir(dir_)):
@@ -36,34 +73,64 @@ if __name__ == '__main__':
             
             # gives TrialN_frames
             for grandchild in sorted(os.listdir(pth)):
-                if grandchild not in exclude:
-                    
-                    fullpth = os.path.join(pth, grandchild)
+                fullpth = os.path.join(pth, grandchild)
+                
+                # skip the metadata sidecars sitting next to the trial directories
+                if grandchild not in exclude and os.path.isdir(fullpth):
                     
                     # gives partition namees
                     for greatgc in sorted(os.listdir(fullpth)):
-                        if greatgc not in exclude:
+                        if greatgc not in exclude and os.path.isdir(os.path.join(fullpth, greatgc)):
                  
                             SUBJECT = child
                             TRIAL   = grandchild.split("_")[0][-1]
                             PARTITION = greatgc
 
-                            slug = "%s_t%s_p%s" % (SUBJECT, TRIAL, PARTITION)
-                            
-                            subdir = os.path.join(out_dir_,slug)
-                         
-                            os.makedirs(subdir)
-                            
-                            partpth = os.path.join(fullpth,greatgc)
-                            contents = os.listdir(partpth)
-                        
-                            for f in contents:
-                                cpath = os.path.join(partpth,f)
-                                
-                                sys.stdout.write("\r" + cpath)
-                                sys.stdout.flush()
-
-                                shutil.copy2(cpath,subdir)
+                            yield "%s_t%s_p%s" % (SUBJECT, TRIAL, PARTITION), os.path.join(fullpth, greatgc)
+
+def link(src, dst):
+    """
+    hard link src to dst, falling back to a symlink when a hard link
+    is not possible (e.g the two are on different filesystems)
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+if __name__ == '__main__':
+    #pass
+    dir_, out_dir_ = parse_input()
+
+    if "--index" in sys.argv:
+        options = sys.argv[sys.argv.index("--index") + 1:]
+        num_seconds = int(options[0]) if len(options) > 0 else 2
+        overlap = float(options[1]) if len(options) > 1 else 0.
+        consolidate_index(dir_, out_dir_, num_seconds=num_seconds, overlap=overlap)
+        sys.exit()
+
+    if "--manifest" in sys.argv:
+        slugs = list(partition_dirs(dir_))
+        vc.write_slug_manifest(slugs, out_dir_)
+        print("[consolidate_data] wrote %d slugs to %s" % (len(slugs), out_dir_))
+        sys.exit()
+
+    place = shutil.copy2 if "--copy" in sys.argv else link
+    os.makedirs(out_dir_)
+
+    for slug, partpth in partition_dirs(dir_):
+        subdir = os.path.join(out_dir_,slug)
+        os.makedirs(subdir)
+        
+        contents = os.listdir(partpth)
+    
+        for f in contents:
+            cpath = os.path.join(partpth,f)
+            
+            sys.stdout.write("\r" + cpath)
+            sys.stdout.flush()
+
+            place(cpath, os.path.join(subdir, f))
 
 
     print("done!")
@@ -1,13 +1,18 @@
 """
 Convert the input csv to one that mirrors the dir/subdir
 format in consolidated data directory
+
+Given the manifest written by consolidate_data.py --manifest, a PATH
+column with each sample's partition directory is added, so the loaders
+read the partitions in place instead of from a consolidated directory.
 """
 
 import sys, os
 import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
 
 def usage():
-    print("[usage]: python %s <partition-csv> <consolidated_csv>" % sys.argv[0])
+    print("[usage]: python %s <partition-csv> <consolidated_csv> [manifest_csv]" % sys.argv[0])
     sys.exit()
  
 def parse_input():
@@ -26,6 +31,7 @@ def parse_input():
 
 if __name__ == "__main__":
     csv_, csv_out = parse_input()
+    manifest = vc.read_slug_manifest(sys.argv[3]) if len(sys.argv) > 3 else None
     
 
     mat, header = base.csv2data(csv_)
@@ -33,6 +39,8 @@ if __name__ == "__main__":
     output_csv = open(csv_out,"w")
     
     header = ["SAMPLE","HEART RATE","RESPIRATORY RATE","HEART RATE CLASS"] 
+    if manifest is not None:
+        header.append("PATH")
     csvh = base.CSV_Helper(csv_, output_csv, header=header)
     #header = ["SUBJECT","TRIAL","PARTITION","HEART RATE","RESPIRATORY RATE","HEART RATE CLASS"]
     for row in mat:
@@ -42,6 +50,12 @@ if __name__ == "__main__":
         newr = [fmt_slug]
         newr.extend(row[3:])
 
+        if manifest is not None:
+            if fmt_slug not in manifest:
+                print("[consolidated_to_csv] %s is not in the manifest, skipping" % fmt_slug)
+                continue
+            newr.append(manifest[fmt_slug])
+
         csvh.csv_writer.writerow(newr)
     
     csvh.release()
@@ -6,11 +6,13 @@ and extracting the frames from the subjects listed in that csv
 
 import sys
 import os
+import traceback
 import pandas as pd
 import argparse
 
 import we_panic_utils.basic_utils.basics as base
 import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.cache import StageCache
 
 
 def usage(with_help=True):
@@ -47,6 +49,48 @@ def parse_input():
                         help="the directory to save the frame directories",
                         type=str)
 
+    parser.add_argument("--processes", "-p",
+                        help="number of videos to extract at once (0 for one per core)",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--segments",
+                        help="decode each video in this many keyframe aligned pieces at once "
+                             "(only used when extracting one video at a time)",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--maxtasksperchild",
+                        help="videos a worker extracts before it is replaced (bounds worker memory)",
+                        type=int,
+                        default=1)
+
+    parser.add_argument("--writers",
+                        help="threads encoding and writing frames while decoding continues",
+                        type=int,
+                        default=2)
+
+    parser.add_argument("--png_compression",
+                        help="PNG compression level of the frames (0-9)",
+                        type=int,
+                        default=3)
+
+    parser.add_argument("--decoder",
+                        help="the video decoder backend",
+                        type=str,
+                        choices=["opencv", "ffmpeg"],
+                        default="opencv")
+
+    parser.add_argument("--cache_dir",
+                        help="reuse the frames of unchanged videos from this stage cache",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--cache_size",
+                        help="evict least recently used cache entries beyond this many GB",
+                        type=float,
+                        default=None)
+
     return parser
 
 
@@ -76,22 +120,21 @@ if __name__ == "__main__":
     selects_df = pd.read_csv(selects)
     metadf = pd.read_csv(metadata)
 
-    frame_df = pd.DataFrame(columns=["Subject", "Trial", "Path", "Heart Rate", "Respiratory Rate"])
-
-    fmt_file = "Trial%d.MOV"
-    
     imgs_captured = []
     
     columns = metadf.columns
     
-    i = 0
+    rows = []
+    targets = []
+
+    cache, pending = None, {}
+    cache_params = {"clip": 2, "fps": 30, "decoder": args.decoder}
+    if args.cache_dir:
+        cache = StageCache(args.cache_dir, max_bytes=args.cache_size * 2**30 if args.cache_size else None)
     for index, row in selects_df.iterrows(): 
         subject, trial = row['Subject'], int(row['Trial'])
         fmt_dir = 'S' + subject.zfill(4)
-        target_dir = os.path.join(movie_dir, fmt_dir)
-        target_file = fmt_file % trial
-
-        target = os.path.join(target_dir, target_file)
+        target = vc.trial_video_path(movie_dir, fmt_dir, trial)
         
         data = metadf[metadf['SUBJECT'] == str(subject)]
         
@@ -103,13 +146,65 @@ if __name__ == "__main__":
         else:
             r = [subject, trial, os.path.join(output_directory, str(subject), str(trial)), t2_hrate, t2_resprate]
         
-        frame_df.loc[i] = r
-        if not os.path.exists(target.replace(movie_dir, output_directory).split('.')[0]+'_frames'):
-            imgs = vc.video_file_to_frames(target, output_dir=output_directory, suppress=False)
-            print("-" * 78)
-            imgs_captured.extend(imgs)
+        rows.append((target, r))
+        if cache is not None:
+            # the cache decides from the video's content whether existing frames are still valid
+            frame_dir = os.path.join(output_directory, vc.video_file_exists(target)[2] + "_frames")
+            outputs = [frame_dir, vc.metadata_path(frame_dir)]
+            key = cache.plan("extract", [target], cache_params, outputs)
+            if key is not None:
+                targets.append(target)
+                pending[target] = (key, outputs)
+        elif not os.path.exists(target.replace(movie_dir, output_directory).split('.')[0]+'_frames'):
+            targets.append(target)
         else:
             print("{} already exists, skipping".format(target.replace(movie_dir, output_directory)))
-        i += 1
+
+    succeeded, failures = [], {}
+    if args.processes == 1:
+        for target in targets:
+            # like video_files_to_frames, a bad video is reported instead of aborting the batch;
+            # video_file_to_frames removes its partial frames
+            try:
+                imgs = vc.video_file_to_frames(target, output_dir=output_directory, suppress=False,
+                                               segments=args.segments, decoder=args.decoder,
+                                               writers=args.writers, png_compression=args.png_compression)
+            except Exception:
+                failures[target] = traceback.format_exc()
+                print("\n[extract_frames]-- FAILED %s\n%s" % (target, failures[target]))
+                continue
+            print("-" * 78)
+            imgs_captured.extend(imgs)
+            succeeded.append(target)
+
+    else:
+        processes = args.processes if args.processes > 0 else None
+        captured, failures = vc.video_files_to_frames(targets, output_directory,
+                                                      processes=processes,
+                                                      maxtasksperchild=args.maxtasksperchild,
+                                                      decoder=args.decoder,
+                                                      writers=args.writers,
+                                                      png_compression=args.png_compression)
+        for imgs in captured.values():
+            imgs_captured.extend(imgs)
+        succeeded.extend(captured)
+
+    if failures:
+        print("[!] %d of %d videos failed to extract:" % (len(failures), len(targets)))
+        for target in failures:
+            print("\t%s" % target)
+
+    if cache is not None:
+        for target in succeeded:
+            key, outputs = pending[target]
+            cache.store(key, outputs, stage="extract")
+        cache.save()
+
+    # the failed trials have no frames, leave them out
+    rows = [r for target, r in rows if target not in failures]
+    frame_df = pd.DataFrame(rows, columns=["Subject", "Trial", "Path", "Heart Rate", "Respiratory Rate"])
     frame_df.to_csv("subject_data.csv", index=False)
-    print("[*] Extracted %d images from %d different video files" % (len(imgs_captured), i + 1))
+    print("[*] Extracted %d images from %d different video files" % (len(imgs_captured), len(rows)))
+
+    if failures:
+        sys.exit(1)
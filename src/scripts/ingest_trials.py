@@ -0,0 +1,246 @@
+"""
+Watch the movie directory for new subject videos and preprocess them as they
+arrive, instead of re-running the whole generate_dataset chain by hand:
+
+    python ingest_trials.py movie_data/ DeepLearningClassData.csv frames/ --catalog subject_data.csv
+
+Every --poll seconds the movie directory is scanned for $(subject)/Trial$(N)
+videos. A video is ingested once its size and modification time have stayed
+the same for a whole poll (so half copied files are left alone) and it is new
+or changed since it was last ingested: its frames are streamed into the output
+directory and its row is added to (or replaced in) the catalog csv, which is
+rewritten atomically. A training job run with --watch_catalog and the catalog
+csv as its --csv picks the new rows up at its next epoch boundary.
+
+What has been ingested is recorded in a state file next to the output
+directory, so a restarted daemon only processes what changed while it was down.
+Everything happens on local directories, --once does a single pass and exits.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import argparse
+import pandas as pd
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.catalog import Catalog
+
+HEADER = ["Subject", "Trial", "Path", "Heart Rate", "Respiratory Rate"]
+TRIAL_VIDEO = re.compile(r"^Trial(\d+)\.\w+$")
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Preprocess subject videos as they arrive in the movie directory")
+    parser.add_argument("movie_directory",
+                        help="the directory new $(subject)/Trial$(N) videos arrive in",
+                        type=str)
+
+    parser.add_argument("data_csv",
+                        help="the csv containing all of the subject data, reread every poll",
+                        type=str)
+
+    parser.add_argument("output_directory",
+                        help="the directory to write the frames to",
+                        type=str)
+
+    parser.add_argument("--catalog",
+                        help="the catalog csv the ingested trials are added to",
+                        type=str,
+                        default="subject_data.csv")
+
+    parser.add_argument("--state",
+                        help="the ingestion state, defaults to $(output_directory).ingest.json",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--poll",
+                        help="seconds between scans of the movie directory",
+                        type=float,
+                        default=30)
+
+    parser.add_argument("--once",
+                        help="ingest what is there and exit instead of polling",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension of the frames",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension of the frames",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--clip",
+                        help="seconds to clip off of each end of the videos",
+                        type=int,
+                        default=2)
+
+    parser.add_argument("--processes", "-p",
+                        help="the number of videos to preprocess at once, defaults to the number of cores",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--db",
+                        help="also upsert the ingested trials into this sqlite dataset catalog",
+                        type=str,
+                        default=None)
+
+    return parser
+
+
+def scan(movie_directory):
+    """
+    the (size, mtime) of every $(subject)/Trial$(N) video in movie_directory,
+    keyed by (subject directory, trial)
+    """
+    videos = {}
+    for subject_dir in sorted(os.listdir(movie_directory), key=base.natural_key):
+        path = os.path.join(movie_directory, subject_dir)
+        if not subject_dir.startswith("S") or not subject_dir[1:].isdigit() or not os.path.isdir(path):
+            continue
+
+        for name in os.listdir(path):
+            match = TRIAL_VIDEO.match(name)
+            if match is None or os.path.splitext(name)[1].lower() not in vc.VIDEO_EXTENSIONS:
+                continue
+
+            stat = os.stat(os.path.join(path, name))
+            videos[(subject_dir, int(match.group(1)))] = (os.path.join(path, name), [stat.st_size, stat.st_mtime])
+
+    return videos
+
+
+def trial_labels(data_csv, subject, trial):
+    """
+    (heart rate, respiratory rate) of the trial, or None if it has no labels yet
+    """
+    metadf = pd.read_csv(data_csv, dtype={'SUBJECT': str})
+    data = metadf[metadf['SUBJECT'] == str(subject)]
+    if len(data) == 0:
+        return None
+
+    subj, t1_hrate, t1_resprate, t2_hrate, t2_resprate = [list(data[col])[0] for col in metadf.columns]
+    labels = (t1_hrate, t1_resprate) if trial == 1 else (t2_hrate, t2_resprate)
+    if any(pd.isnull(label) or str(label).strip() == "" for label in labels):
+        return None
+
+    return float(labels[0]), float(labels[1])
+
+
+def ingest(movie, output_directory, trial_dir, width, height, clip):
+    # a changed video replaces every frame of the previous version
+    if os.path.isdir(trial_dir):
+        shutil.rmtree(trial_dir)
+
+    return len(vc.stream_video_file(movie, output_directory, width=width, height=height, clip=clip, suppress=True))
+
+
+def update_catalog(catalog, rows):
+    """
+    add rows to the catalog, replacing the rows of the same subject and trial,
+    and write it atomically so a training job never reads half of it
+    """
+    existing = []
+    if os.path.exists(catalog):
+        existing, header = base.csv2data(catalog)
+        if header != HEADER:
+            raise ValueError("[ingest_trials] %s has columns %s, expected %s" % (catalog, str(header), str(HEADER)))
+
+    replaced = set((str(row[0]), str(row[1])) for row in rows)
+    kept = [row for row in existing if row and (row[0], row[1]) not in replaced]
+    base.write_csv_atomic(catalog, kept + rows, header=HEADER)
+
+
+def save_state(state_path, state):
+    temp = "%s.%d.tmp" % (state_path, os.getpid())
+    with open(temp, "w") as state_file:
+        json.dump(state, state_file, indent=1)
+    os.replace(temp, state_path)
+
+
+def poll(args, state, previous):
+    """
+    ingest the settled videos that are new or changed since they were last ingested
+
+    returns:
+        the scan of this poll, the next poll's previous
+    """
+    videos = scan(args.movie_directory)
+
+    jobs, pending = [], {}
+    for (subject_dir, trial), (movie, signature) in videos.items():
+        name = "%s/Trial%d" % (subject_dir, trial)
+        if state.get(name, {}).get("signature") == signature:
+            continue
+
+        # still being copied, or not seen for a whole poll yet
+        if previous.get((subject_dir, trial), (None, None))[1] != signature and not args.once:
+            continue
+
+        subject = str(int(subject_dir[1:]))
+        labels = trial_labels(args.data_csv, subject, trial)
+        if labels is None:
+            if state.get(name, {}).get("status") != "unlabeled":
+                print("[ingest_trials] %s has no labels in %s yet, waiting" % (name, args.data_csv))
+                state[name] = {"signature": None, "status": "unlabeled"}
+            continue
+
+        trial_dir = os.path.join(args.output_directory, subject_dir, "Trial%d_frames" % trial)
+        jobs.append((movie, args.output_directory, trial_dir, args.xdim, args.ydim, args.clip))
+        pending[movie] = (name, signature, [subject, trial, trial_dir, labels[0], labels[1]])
+
+    rows = []
+    for job, result, error in base.parallel_map(ingest, jobs, processes=args.processes, name="ingest_trials"):
+        name, signature, row = pending[job[0]]
+        if error is not None:
+            print("[ingest_trials] failed ingesting %s:\n%s" % (name, error))
+            # no signature, so it is retried at the next poll rather than only once the video changes
+            state[name] = {"signature": None, "status": "failed"}
+            continue
+
+        rows.append(row)
+        state[name] = {"signature": signature, "status": "done", "frames": result}
+
+    if rows:
+        update_catalog(args.catalog, sorted(rows, key=lambda row: (int(row[0]), row[1])))
+        print("[ingest_trials] added %d trials to %s" % (len(rows), args.catalog))
+        if args.db:
+            with Catalog(args.db) as catalog:
+                catalog.upsert_trial_rows(rows)
+
+    if jobs or rows:
+        save_state(args.state, state)
+
+    return videos
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not os.path.isdir(args.movie_directory):
+        raise FileNotFoundError("[movie_dir] -- %s not found" % args.movie_directory)
+
+    if not os.path.exists(args.data_csv):
+        raise FileNotFoundError("[data_csv] -- %s not found" % args.data_csv)
+
+    base.check_exists_create_if_not(args.output_directory)
+    args.state = args.state or args.output_directory.rstrip("/") + ".ingest.json"
+
+    state = {}
+    if os.path.exists(args.state):
+        with open(args.state) as state_file:
+            state = json.load(state_file)
+
+    previous = {}
+    while True:
+        previous = poll(args, state, previous)
+        if args.once:
+            break
+        time.sleep(args.poll)
@@ -1,18 +1,65 @@
-from we_panic_utils.basic_utils.video_core import write_optical_flow
+from we_panic_utils.basic_utils.video_core import write_optical_flow, metadata_path
+from we_panic_utils.basic_utils.cache import StageCache
+import argparse
+import glob
 import os
 import sys
 
 
-path = 'rsz32/'
+def parse_input():
+    parser = argparse.ArgumentParser("write the optical flow of every trial")
+    parser.add_argument("path",
+                        help="directory of resized trials, $(subject)/Trial$(N)_frames",
+                        type=str,
+                        nargs="?",
+                        default="rsz32/")
+
+    parser.add_argument("--cache_dir",
+                        help="reuse flows of unchanged trials from this stage cache",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--cache_size",
+                        help="evict least recently used cache entries beyond this many GB",
+                        type=float,
+                        default=None)
+
+    return parser
+
+
+args = parse_input().parse_args()
+cache = None
+if args.cache_dir:
+    cache = StageCache(args.cache_dir, max_bytes=args.cache_size * 2**30 if args.cache_size else None)
+
+path = args.path
 subjects = os.listdir(path)
 subjects = [os.path.join(path, subject) for subject in subjects]
+subjects = [subject for subject in subjects if os.path.isdir(subject)]
 
 for subject in subjects:
     print("\n-=-=-=-=-=-=-=--- %s  ---=-=-=-=-=-=-=-=-" % subject)
     trials = os.listdir(subject)
     trials = [os.path.join(subject, trial) for trial in trials]
+    trials = [trial for trial in trials if os.path.isdir(trial)]
     for trial in trials:
         pth = trial
-        write_optical_flow(pth, 2)
+        try:
+            if cache is None:
+                write_optical_flow(pth, 2)
+                continue
 
+            # the flows live inside the trial directory, so only the frames themselves and
+            # the trial's sidecar (their order) are inputs; the flows are indexed in sidecars
+            # of their own, which are outputs too
+            frames = sorted(f for f in glob.glob(pth + "/*") if not os.path.isdir(f) and not f.endswith(".json"))
+            flow_dirs = [os.path.join(pth, "flow_h"), os.path.join(pth, "flow_v")]
+            outputs = flow_dirs + [metadata_path(flow_dir) for flow_dir in flow_dirs]
+            inputs = frames + [metadata_path(pth)]
+            cache.run("flow", inputs, {"width": 2}, outputs, write_optical_flow, pth, 2)
+        except Exception:
+            # already reported, move on to the next trial as before
+            continue
 
+if cache is not None:
+    cache.save()
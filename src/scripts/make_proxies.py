@@ -0,0 +1,95 @@
+"""
+Transcode the videos of the subjects listed in a csv into small, all-intra,
+audio free proxies. Point extract_frames.py, stream_trials.py and the
+augmentation scripts at the proxy directory instead of the original movies.
+"""
+
+import os
+import argparse
+import pandas as pd
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Make low resolution proxies of video files")
+    parser.add_argument("selects",
+                        help="csv of selected subjects",
+                        type=str)
+
+    parser.add_argument("movie_directory",
+                        help="video file directory",
+                        type=str)
+
+    parser.add_argument("proxy_directory",
+                        help="the directory to save the proxies",
+                        type=str)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension of the proxies",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension of the proxies",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--codec",
+                        help="the intra-frame codec of the proxies",
+                        type=str,
+                        choices=sorted(vc.PROXY_CODECS),
+                        default="mjpeg")
+
+    parser.add_argument("--fps",
+                        help="resample the proxies to this frame rate (default keeps the original)",
+                        type=float,
+                        default=None)
+
+    parser.add_argument("--processes", "-p",
+                        help="number of ffmpeg processes to run at once (0 for one per core)",
+                        type=int,
+                        default=0)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not os.path.exists(args.selects):
+        raise FileNotFoundError("[selects] -- %s not found" % args.selects)
+
+    if not os.path.isdir(args.movie_directory):
+        raise FileNotFoundError("[movie_dir] -- %s not found" % args.movie_directory)
+
+    base.check_exists_create_if_not(args.proxy_directory)
+
+    selects_df = pd.read_csv(args.selects, dtype={'Subject': str})
+    ext = vc.PROXY_CODECS[args.codec][1]
+
+    jobs = []
+    for index, row in selects_df.iterrows():
+        fmt_dir = 'S' + row['Subject'].zfill(4)
+        trial = int(row['Trial'])
+        
+        proxy = os.path.join(args.proxy_directory, fmt_dir, "Trial%d%s" % (trial, ext))
+        if os.path.exists(proxy):
+            print("{} already exists, skipping".format(proxy))
+            continue
+
+        target = vc.trial_video_path(args.movie_directory, fmt_dir, trial)
+        jobs.append((target, args.proxy_directory, args.xdim, args.ydim, args.codec, args.fps, True))
+
+    processes = args.processes if args.processes > 0 else None
+    
+    # ffmpeg does the work in its own process, threads are enough to keep the cores busy
+    failures = [job[0] for job, _, error in base.parallel_map(vc.make_proxy, jobs, processes=processes,
+                                                               threads=True, name="make_proxies")
+                if error is not None]
+
+    for target in failures:
+        print("[!] failed to make a proxy of %s" % target)
+
+    print("[*] Made %d proxies in %s" % (len(jobs) - len(failures), args.proxy_directory))
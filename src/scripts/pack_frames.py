@@ -0,0 +1,120 @@
+"""
+Pack the trials of a resized frame tree (e.g rsz32/) into frame stores, one
+T x H x W x C uint8 file per trial next to its frame directory, which the
+FrameProcessor generators read instead of the PNGs when frame_store is on:
+
+    python pack_frames.py rsz32/
+    python run_model.py ... --frame_store
+
+Trials that were partitioned into 0/, 1/, ... get one store per partition.
+Stores newer than their frame directory are left alone unless --force.
+
+With --archive, compressed chunked frame archives (see frame_store.archive)
+are written instead, a fraction of the size of the PNGs:
+
+    python pack_frames.py rsz32/ --archive --chunk_size 32
+"""
+
+import os
+import argparse
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.frame_store as fs
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Pack frame directories into memory mappable frame stores")
+    parser.add_argument("frame_dir",
+                        help="directory of $(subject)/Trial$(N)_frames trials, e.g rsz32/",
+                        type=str)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension of the stored frames, defaults to that of the frames",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension of the stored frames, defaults to that of the frames",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--processes", "-p",
+                        help="the number of trials to pack at once, defaults to the number of cores",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--archive",
+                        help="write compressed frame archives instead of frame stores",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--chunk_size",
+                        help="frames compressed together in an archive",
+                        type=int,
+                        default=32)
+
+    parser.add_argument("--codec",
+                        help="the archive codec, lz4f (when lz4 is installed) or zlib",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--no_delta",
+                        help="do not delta encode the frames of archive chunks along time",
+                        default=False,
+                        action="store_true")
+
+    parser.add_argument("--force",
+                        help="repack stores that are up to date",
+                        default=False,
+                        action="store_true")
+
+    return parser
+
+
+def frame_dirs(frame_dir):
+    """
+    yield every trial directory of frame_dir, or its partitions if it was partitioned
+    """
+    for subject in sorted(os.listdir(frame_dir), key=base.natural_key):
+        subject_dir = os.path.join(frame_dir, subject)
+        if not os.path.isdir(subject_dir):
+            continue
+
+        for trial in sorted(os.listdir(subject_dir), key=base.natural_key):
+            trial_dir = os.path.join(subject_dir, trial)
+            if not trial.endswith("_frames") or not os.path.isdir(trial_dir):
+                continue
+
+            partitions = [p for p in os.listdir(trial_dir) if p.isdigit() and os.path.isdir(os.path.join(trial_dir, p))]
+            if partitions:
+                for partition in sorted(partitions, key=int):
+                    yield os.path.join(trial_dir, partition)
+            else:
+                yield trial_dir
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not os.path.isdir(args.frame_dir):
+        raise FileNotFoundError("[frame_dir] -- %s not found" % args.frame_dir)
+
+    if args.archive:
+        pack, is_packed = fs.pack_archive, fs.open_frame_archive
+        jobs = [(path, None, args.xdim, args.ydim, None, args.chunk_size, args.codec, 1, not args.no_delta)
+                for path in frame_dirs(args.frame_dir) if args.force or is_packed(path) is None]
+    else:
+        pack, is_packed = fs.pack_frames, fs.open_frame_store
+        jobs = [(path, None, args.xdim, args.ydim) for path in frame_dirs(args.frame_dir)
+                if args.force or is_packed(path) is None]
+
+    packed, frames = 0, 0
+    for job, shape, error in base.parallel_map(pack, jobs, processes=args.processes, name="pack_frames"):
+        if error is not None:
+            print("[pack_frames] failed packing %s:\n%s" % (job[0], error))
+            continue
+
+        packed, frames = packed + 1, frames + shape[0]
+
+    print("[pack_frames] packed %d directories (%d frames), %d failed, %d were up to date"
+          % (packed, frames, len(jobs) - packed, sum(1 for _ in frame_dirs(args.frame_dir)) - len(jobs)))
@@ -1,12 +1,16 @@
 import os
 import sys
+import shutil
+import tempfile
 import we_panic_utils.basic_utils.basics as base
 import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.cache import StageCache
+from we_panic_utils.basic_utils.catalog import Catalog
 
 INPUT_CSV = "DeepLearningClassData.csv"
 
 def usage(with_help=True): 
-    print("[Usage]: %s <frame_dir> <partition_out> <output_csv>" % sys.argv[0])
+    print("[Usage]: %s <frame_dir> <partition_out> <output_csv> [cache_dir] [--db catalog.db]" % sys.argv[0])
     if with_help:
         print("         %s HELP|help|h for more info" % sys.argv[0])
     sys.exit()
@@ -20,11 +24,41 @@ def help_msg():
     print("\t| partition them into several 2 second long collections")
     usage(with_help=False)
 
+def partition_linked_copy(frame_path, output_path):
+    """
+    partition_frame_dir moves the frames out of the trial, which would change the
+    cache key of the trial; partition a hardlinked scratch copy instead
+    """
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(frame_path)))
+    try:
+        trial = os.path.join(scratch, "trial")
+        os.makedirs(trial)
+        for frame in os.listdir(frame_path):
+            if not os.path.isdir(os.path.join(frame_path, frame)):
+                os.link(os.path.join(frame_path, frame), os.path.join(trial, frame))
+        if os.path.exists(vc.metadata_path(frame_path)):
+            shutil.copy2(vc.metadata_path(frame_path), vc.metadata_path(trial))
+        return vc.partition_frame_dir(trial, output_dir=output_path)
+    finally:
+        shutil.rmtree(scratch)
+
+def pop_option(name):
+    """
+    remove --name value from sys.argv and return the value, None if it is not there
+    """
+    if name not in sys.argv[:-1]:
+        return None
+    index = sys.argv.index(name)
+    value = sys.argv[index + 1]
+    del sys.argv[index:index + 2]
+    return value
+
 def extract_subject_name(subj_dir):
     subj_dir = subj_dir[1:]
     return str(int(subj_dir))
 
 if __name__ == "__main__":
+    db = pop_option("--db")
     num_args = len(sys.argv)
     if num_args == 2 and sys.argv[1] in ["HELP", "help", "h"]:
         help_msg()
@@ -34,6 +68,8 @@ if __name__ == "__main__":
     frames_path   = sys.argv[1]
     partition_dir = sys.argv[2]
     output_csv    = sys.argv[3]
+    cache         = StageCache(sys.argv[4]) if num_args > 4 else None
+    catalog       = Catalog(db) if db else None
     
     if not os.path.exists(frames_path):
         raise IOError("Error: frames path not found | " + frames_path)
@@ -64,7 +100,17 @@ if __name__ == "__main__":
             if not os.path.isdir(frame_path):
                 continue
             print('*'*85)
-            num_part = vc.partition_frame_dir(frame_path, output_dir=output_path)
+            if cache is None:
+                num_part = vc.partition_frame_dir(frame_path, output_dir=output_path)
+            else:
+                # partitions are numbered directories, count them rather than trust a cache hit to report it
+                cache.run("partition", [frame_path, vc.metadata_path(frame_path)], {"num_seconds": 2},
+                          [output_path], partition_linked_copy, frame_path, output_path)
+                num_part = len([p for p in os.listdir(output_path) if p.isdigit()]) if os.path.isdir(output_path) else 0
+            if catalog is not None and os.path.isdir(output_path):
+                catalog.replace_windows(subj_name, int(trial_dir.split("_")[0][-1]),
+                                        [{"partition": p, "path": os.path.abspath(pth)}
+                                         for p, pth in vc.trial_partitions(output_path)])
             if trial_dir == "Trial1_frames":
                 num_partitions[0] = num_part
             elif trial_dir == "Trial2_frames":
@@ -72,9 +118,17 @@ if __name__ == "__main__":
             else:
                 raise Exception("????")
         data = helper.look_up(subj_name)
+        if catalog is not None and data != "?":
+            catalog.upsert_trials({"subject": subj_name, "trial": t, "heart_rate": float(data[2*t-2]),
+                                   "resp_rate": float(data[2*t-1])}
+                                  for t in (1, 2) if num_partitions[t-1] and len(data) >= 2*t and data[2*t-2] != "")
         
         max_part = num_partitions[0] if num_partitions[0] > num_partitions[1] else num_partitions[1]
         for p in range(max_part):
             helper.write_to(subj_name, p, data, num_partitions)
     helper.release()
+    if catalog is not None:
+        catalog.close()
+    if cache is not None:
+        cache.save()
 
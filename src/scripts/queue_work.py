@@ -0,0 +1,175 @@
+"""
+Spread a preprocessing stage over several machines through a work queue on
+a shared filesystem, one job per subject/trial:
+
+    # once, from anywhere
+    python queue_work.py /shared/queue submit stream NextStartingPoint.csv --movie_directory data/ --output_directory frames/
+
+    # on every node (any number of them, each with several worker processes)
+    python queue_work.py /shared/queue work --workers 8
+
+    python queue_work.py /shared/queue status
+
+Workers that die are noticed through their expired leases and their jobs are
+handed to another worker. Running several local workers stands in for nodes.
+"""
+
+import os
+import argparse
+import multiprocessing
+import pandas as pd
+
+import we_panic_utils.basic_utils.video_core as vc
+from we_panic_utils.basic_utils.workqueue import WorkQueue
+
+# stage -> the function a job of that stage runs, called as func(*args, **kwargs)
+STAGES = {"proxy": vc.make_proxy,
+          "extract": vc.video_file_to_frames,
+          "stream": vc.stream_video_file,
+          "resize": vc.resize_frame_dir,
+          "flow": vc.write_optical_flow}
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Run preprocessing stages from a shared-filesystem work queue")
+    parser.add_argument("queue_dir",
+                        help="the queue directory, on a filesystem every worker can see",
+                        type=str)
+
+    parser.add_argument("--lease_timeout",
+                        help="seconds without a heartbeat after which a job is handed to another worker",
+                        type=int,
+                        default=300)
+
+    parser.add_argument("--heartbeat",
+                        help="seconds between heartbeats of a running job",
+                        type=int,
+                        default=30)
+
+    parser.add_argument("--max_attempts",
+                        help="the number of times a job is tried before it is given up on",
+                        type=int,
+                        default=3)
+
+    commands = parser.add_subparsers(dest="command")
+
+    submit = commands.add_parser("submit", help="queue one job per selected subject/trial")
+    submit.add_argument("stage",
+                        help="the stage to run",
+                        type=str,
+                        choices=sorted(STAGES))
+
+    submit.add_argument("selects",
+                        help="csv of selected subjects",
+                        type=str)
+
+    submit.add_argument("--movie_directory",
+                        help="video file directory (proxy, extract and stream)",
+                        type=str,
+                        default="data/")
+
+    submit.add_argument("--frame_directory",
+                        help="directory of $(subject)/Trial$(N)_frames trials (resize and flow)",
+                        type=str,
+                        default="frames/")
+
+    submit.add_argument("--output_directory",
+                        help="where the stage writes its output (proxy, extract, stream and resize)",
+                        type=str,
+                        default="frames/")
+
+    submit.add_argument("--xdim", "-x",
+                        help="x dimension (proxy, stream and resize)",
+                        type=int,
+                        default=100)
+
+    submit.add_argument("--ydim", "-y",
+                        help="y dimension (proxy, stream and resize)",
+                        type=int,
+                        default=100)
+
+    submit.add_argument("--force",
+                        help="queue jobs again even if they are done or failed",
+                        default=False,
+                        action="store_true")
+
+    work = commands.add_parser("work", help="run jobs until the queue is drained")
+    work.add_argument("--workers", "-w",
+                      help="worker processes to run on this machine",
+                      type=int,
+                      default=1)
+
+    work.add_argument("--wait",
+                      help="keep waiting for new jobs instead of exiting once the queue is drained",
+                      default=False,
+                      action="store_true")
+
+    commands.add_parser("status", help="count the jobs in each state")
+
+    return parser
+
+
+def stage_jobs(args):
+    """
+    one (job id, job) per selected subject/trial for args.stage
+    """
+    selects_df = pd.read_csv(args.selects, dtype={'Subject': str})
+
+    for index, row in selects_df.iterrows():
+        subject, trial = row['Subject'], int(row['Trial'])
+        fmt_dir = 'S' + subject.zfill(4) if subject.isdigit() else 'S' + subject
+        job_id = "%s-%s-Trial%d" % (args.stage, fmt_dir, trial)
+        trial_dir = os.path.join(args.frame_directory, fmt_dir, "Trial%d_frames" % trial)
+
+        if args.stage in ("proxy", "extract", "stream"):
+            movie = vc.trial_video_path(args.movie_directory, fmt_dir, trial)
+
+        if args.stage == "proxy":
+            job = {"args": [movie, args.output_directory], "kwargs": {"width": args.xdim, "height": args.ydim}}
+        elif args.stage == "extract":
+            job = {"args": [movie, args.output_directory], "kwargs": {"suppress": True}}
+        elif args.stage == "stream":
+            job = {"args": [movie, args.output_directory], "kwargs": {"width": args.xdim, "height": args.ydim, "suppress": True}}
+        elif args.stage == "resize":
+            output_path = os.path.join(args.output_directory, fmt_dir, "Trial%d_frames" % trial)
+            job = {"args": [trial_dir, output_path], "kwargs": {"width": args.xdim, "height": args.ydim}}
+        else:
+            job = {"args": [trial_dir, 2], "kwargs": {}}
+
+        job["stage"] = args.stage
+        yield job_id, job
+
+
+def run_job(job):
+    result = STAGES[job["stage"]](*job["args"], **job["kwargs"])
+
+    # keep the result small, the frame lists are in the sidecars
+    return len(result) if isinstance(result, list) else result
+
+
+def work(queue_dir, lease_timeout, heartbeat, max_attempts, wait):
+    queue = WorkQueue(queue_dir, lease_timeout=lease_timeout, heartbeat=heartbeat, max_attempts=max_attempts)
+    return queue.work(run_job, exit_when_idle=not wait)
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+    queue = WorkQueue(args.queue_dir, lease_timeout=args.lease_timeout, heartbeat=args.heartbeat,
+                      max_attempts=args.max_attempts)
+
+    if args.command == "submit":
+        queued = sum(queue.submit(job_id, job, force=args.force) for job_id, job in stage_jobs(args))
+        print("[queue_work] queued %d %s jobs" % (queued, args.stage))
+
+    elif args.command == "work":
+        settings = (args.queue_dir, args.lease_timeout, args.heartbeat, args.max_attempts, args.wait)
+        if args.workers == 1:
+            done, failed = work(*settings)
+        else:
+            with multiprocessing.Pool(args.workers) as pool:
+                counts = pool.starmap(work, [settings] * args.workers)
+            done, failed = sum(c[0] for c in counts), sum(c[1] for c in counts)
+        print("[queue_work] this machine finished %d jobs, %d failed attempts" % (done, failed))
+
+    status = queue.status()
+    print("[queue_work] pending %(pending)d, running %(leases)d, done %(done)d, failed %(failed)d" % status)
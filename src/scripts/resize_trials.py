@@ -4,6 +4,7 @@ import argparse
 
 import we_panic_utils.basic_utils.video_core as vc
 import we_panic_utils.basic_utils.basics as base
+from we_panic_utils.basic_utils.cache import StageCache
 
 def usage(with_help=True): 
     print("[Usage]: %s <partitions_dir> <resized_out>" % sys.argv[0])
@@ -47,9 +48,48 @@ def parse_input():
                         type=int,
                         default=100)
 
+    parser.add_argument("--pyramid",
+                        help="resize to several sizes in one pass, e.g 32x32:rsz32 100x100:rsz "
+                             "(overrides --output_dir, --xdim and --ydim)",
+                        type=str,
+                        nargs="+",
+                        default=None)
+
+    parser.add_argument("--workers",
+                        help="threads reading and resizing frames when using --pyramid",
+                        type=int,
+                        default=4)
+
+    parser.add_argument("--cache_dir",
+                        help="reuse the resized frames of unchanged trials from this stage cache",
+                        type=str,
+                        default=None)
+
+    parser.add_argument("--cache_size",
+                        help="evict least recently used cache entries beyond this many GB",
+                        type=float,
+                        default=None)
+
     return parser
 
 
+def parse_pyramid(specs):
+    """
+    ["32x32:rsz32", "100x100:rsz"] -> [("rsz32", 32, 32), ("rsz", 100, 100)]
+    """
+    pyramid = []
+    for spec in specs:
+        try:
+            dims, output_dir = spec.split(":", 1)
+            xdim, ydim = [int(d) for d in dims.lower().split("x")]
+        except ValueError:
+            raise ValueError("Error: expected a size like WIDTHxHEIGHT:output_dir, got {}".format(spec))
+
+        pyramid.append((output_dir, xdim, ydim))
+
+    return pyramid
+
+
 if __name__ == "__main__":
     args = parse_input().parse_args()
 
@@ -62,7 +102,15 @@ if __name__ == "__main__":
     if args.ydim <= 0:
         raise ValueError("Error: ydim should be > 0, got {}".format(args.ydim))
 
-    base.check_exists_create_if_not(args.output_dir)
+    pyramid = parse_pyramid(args.pyramid) if args.pyramid else None
+    output_dirs = [output_dir for output_dir, _, _ in pyramid] if pyramid else [args.output_dir]
+    
+    for output_dir in output_dirs:
+        base.check_exists_create_if_not(output_dir)
+
+    cache = None
+    if args.cache_dir:
+        cache = StageCache(args.cache_dir, max_bytes=args.cache_size * 2**30 if args.cache_size else None)
 
     for subject in os.listdir(args.frame_dir):
         
@@ -74,13 +122,43 @@ if __name__ == "__main__":
             if not os.path.isdir(trial_path):
                 continue
             
-            os.makedirs(os.path.join(args.output_dir, subject, trial), exist_ok=True)
-
             # for frame in os.listdir(trial_path):
             frame_path = trial_path
+            inputs = [frame_path, vc.metadata_path(frame_path)]
+            
+            if pyramid:
+                outputs = [(os.path.join(output_dir, subject, trial), xdim, ydim) for output_dir, xdim, ydim in pyramid]
+
+                # every size is its own cache entry, only the missing ones are resized
+                keys = {}
+                if cache is not None:
+                    for output_path, xdim, ydim in outputs:
+                        key = cache.plan("resize", inputs, {"width": xdim, "height": ydim},
+                                         [output_path, vc.metadata_path(output_path)])
+                        if key is not None:
+                            keys[output_path] = key
+                    outputs = [output for output in outputs if output[0] in keys]
+
+                if outputs:
+                    vc.resize_frame_dir_pyramid(frame_path, outputs, workers=args.workers)
+
+                for output_path, key in keys.items():
+                    cache.store(key, [output_path, vc.metadata_path(output_path)], stage="resize")
+                continue
                 
             output_path = os.path.join(args.output_dir, subject, trial)
+
+            if cache is not None:
+                cache.run("resize", inputs, {"width": args.xdim, "height": args.ydim},
+                          [output_path, vc.metadata_path(output_path)],
+                          vc.resize_frame_dir, frame_path, output_path, width=args.xdim, height=args.ydim)
+                continue
+
+            os.makedirs(os.path.join(args.output_dir, subject, trial), exist_ok=True)
+                
             vc.resize_frame_dir(frame_path, output_path, width=args.xdim, height=args.ydim)
     
-    print("Done.")
+    if cache is not None:
+        cache.save()
 
+    print("Done.")
@@ -0,0 +1,138 @@
+"""
+Decode, trim, resize and (optionally) partition the videos of the subjects
+listed in a csv in a single pass, writing only the final training-resolution
+frames. Replaces running extract_frames.py, resize_trials.py and
+partition_trials.py one after the other.
+"""
+
+import os
+import argparse
+import pandas as pd
+
+import we_panic_utils.basic_utils.basics as base
+import we_panic_utils.basic_utils.video_core as vc
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Stream video files into resized frame directories")
+    parser.add_argument("selects",
+                        help="csv of selected subjects",
+                        type=str)
+
+    parser.add_argument("data_csv",
+                        help="the csv containing all of the subject data",
+                        type=str)
+
+    parser.add_argument("movie_directory",
+                        help="video file directory",
+                        type=str)
+
+    parser.add_argument("output_directory",
+                        help="the directory to save the resized frame directories",
+                        type=str)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension to resize",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension to resize",
+                        type=int,
+                        default=100)
+
+    parser.add_argument("--clip",
+                        help="seconds to clip off of each end of the videos",
+                        type=int,
+                        default=2)
+
+    parser.add_argument("--num_seconds",
+                        help="partition each trial into windows of this many seconds",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--front_trim",
+                        help="frames to drop from the front of each trial",
+                        type=int,
+                        default=0)
+
+    parser.add_argument("--end_trim",
+                        help="frames to drop from the end of each trial",
+                        type=int,
+                        default=0)
+
+    parser.add_argument("--output_csv",
+                        help="where to write the subject data csv",
+                        type=str,
+                        default="subject_data.csv")
+
+    parser.add_argument("--decoder",
+                        help="the video decoder backend",
+                        type=str,
+                        choices=["opencv", "ffmpeg"],
+                        default="opencv")
+
+    return parser
+
+
+if __name__ == "__main__":
+
+    args = parse_input().parse_args()
+
+    if args.xdim <= 0:
+        raise ValueError("Error: xdim should be > 0, got {}".format(args.xdim))
+
+    if args.ydim <= 0:
+        raise ValueError("Error: ydim should be > 0, got {}".format(args.ydim))
+
+    if not os.path.exists(args.selects):
+        raise FileNotFoundError("[selects] -- %s not found" % args.selects)
+
+    if not os.path.exists(args.data_csv):
+        raise FileNotFoundError("[data_csv] -- %s not found" % args.data_csv)
+
+    if not os.path.isdir(args.movie_directory):
+        raise FileNotFoundError("[movie_dir] -- %s not found" % args.movie_directory)
+
+    base.check_exists_create_if_not(args.output_directory)
+
+    selects_df = pd.read_csv(args.selects, dtype={'Subject': str})
+    metadf = pd.read_csv(args.data_csv, dtype={'SUBJECT': str})
+    columns = metadf.columns
+
+    rows = []
+    num_frames = 0
+
+    for index, row in selects_df.iterrows():
+        subject, trial = row['Subject'], int(row['Trial'])
+        fmt_dir = 'S' + subject.zfill(4)
+        target = vc.trial_video_path(args.movie_directory, fmt_dir, trial)
+        trial_dir = os.path.join(args.output_directory, fmt_dir, "Trial%d_frames" % trial)
+
+        data = metadf[metadf['SUBJECT'] == str(subject)]
+        subj, t1_hrate, t1_resprate, t2_hrate, t2_resprate = [list(data[col])[0] for col in columns]
+
+        if trial == 1:
+            rows.append([subject, trial, trial_dir, t1_hrate, t1_resprate])
+        else:
+            rows.append([subject, trial, trial_dir, t2_hrate, t2_resprate])
+
+        if os.path.exists(trial_dir):
+            print("{} already exists, skipping".format(trial_dir))
+            continue
+
+        imgs = vc.stream_video_file(target,
+                                    args.output_directory,
+                                    width=args.xdim,
+                                    height=args.ydim,
+                                    clip=args.clip,
+                                    num_seconds=args.num_seconds,
+                                    front_trim=args.front_trim,
+                                    end_trim=args.end_trim,
+                                    decoder=args.decoder)
+        num_frames += len(imgs)
+        print("-" * 78)
+
+    frame_df = pd.DataFrame(rows, columns=["Subject", "Trial", "Path", "Heart Rate", "Respiratory Rate"])
+    frame_df.to_csv(args.output_csv, index=False)
+    print("[*] Wrote %d resized frames from %d different video files" % (num_frames, len(rows)))
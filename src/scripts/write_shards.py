@@ -0,0 +1,107 @@
+"""
+Cut the trials of a catalog csv (Subject, Trial, Path, Heart Rate,
+Respiratory Rate, e.g the subject_data.csv of build_dataset.py) into windows
+and pack them into large sequential record shards:
+
+    python write_shards.py subject_data.csv shards/ --length 60 --overlap 0.5 -x 32 -y 32
+    python run_model.py ... --train_shards shards/
+
+The trials are packed in a random order and every window of a trial goes
+into the same shard; the reader mixes them back up with its interleaving and
+shuffle buffer. Trials are read from their frame store or archive when they
+have one, from their PNGs otherwise.
+"""
+
+import os
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+import we_panic_utils.basic_utils.frame_store as fs
+from we_panic_utils.basic_utils.video_core.partitions import trial_frame_names
+
+
+def parse_input():
+    parser = argparse.ArgumentParser("Pack the windows of the catalogued trials into record shards")
+    parser.add_argument("catalog",
+                        help="csv with Subject, Trial, Path, Heart Rate and Respiratory Rate columns",
+                        type=str)
+
+    parser.add_argument("shard_dir",
+                        help="the directory to write the shards to",
+                        type=str)
+
+    parser.add_argument("--length", "-l",
+                        help="the number of frames in a window",
+                        type=int,
+                        default=60)
+
+    parser.add_argument("--overlap",
+                        help="fraction of each window shared with the next, in [0, 1)",
+                        type=float,
+                        default=0.)
+
+    parser.add_argument("--xdim", "-x",
+                        help="x dimension of the stored frames, defaults to that of the frames",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--ydim", "-y",
+                        help="y dimension of the stored frames, defaults to that of the frames",
+                        type=int,
+                        default=None)
+
+    parser.add_argument("--shard_size",
+                        help="the size of a shard in MB",
+                        type=int,
+                        default=256)
+
+    parser.add_argument("--seed",
+                        help="seed of the order the trials are packed in",
+                        type=int,
+                        default=7)
+
+    return parser
+
+
+def trial_frames(path, width, height):
+    """
+    every frame of a trial as one T x H x W x C uint8 array
+    """
+    source = fs.open_frame_source(path)
+    if source is not None and (width is None or source.shape[1:3] == (height, width)):
+        return np.asarray(source[:])
+
+    frames, _ = trial_frame_names(path)
+    return np.stack(list(fs.read_frames(path, frames, width=width, height=height)))
+
+
+if __name__ == "__main__":
+    args = parse_input().parse_args()
+
+    if not 0. <= args.overlap < 1.:
+        raise ValueError("overlap should be in [0, 1), got %f" % args.overlap)
+
+    catalog = pd.read_csv(args.catalog, dtype={'Subject': str})
+    rows = [row for _, row in catalog.iterrows()]
+    random.Random(args.seed).shuffle(rows)
+
+    step = max(1, int(round(args.length * (1 - args.overlap))))
+    windows, skipped = 0, 0
+    with fs.ShardWriter(args.shard_dir, shard_bytes=args.shard_size * 2**20) as writer:
+        for row in rows:
+            path = row["Path"]
+            if not os.path.isdir(path):
+                print("[write_shards] %s not found, skipping subject %s trial %d" % (path, row["Subject"], row["Trial"]))
+                skipped += 1
+                continue
+
+            frames = trial_frames(path, args.xdim, args.ydim)
+            for start in range(0, len(frames) - args.length + 1, step):
+                writer.write(frames[start:start + args.length], row["Heart Rate"], row["Respiratory Rate"],
+                             row["Subject"], int(row["Trial"]))
+                windows += 1
+
+    print("[write_shards] wrote %d windows of %d trials into %d shards in %s, %d trials skipped"
+          % (windows, len(rows) - skipped, len(writer.shards), args.shard_dir, skipped))
@@ -1,2 +1,7 @@
 from . import basics
 from . import video_core
+from . import cache
+from . import build
+from . import workqueue
+from . import frame_store
+from . import catalog
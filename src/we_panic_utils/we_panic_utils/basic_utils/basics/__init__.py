@@ -1 +1 @@
-from .basics import CSV_Helper, csv2data, check_exists_create_if_not
+from .basics import CSV_Helper, csv2data, check_exists_create_if_not, parallel_map, natural_key, write_csv_atomic
@@ -5,7 +5,11 @@ to expedite boiler plate actions like loading up data
 
 import sys
 import os
+import re
 import csv
+import traceback
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 class CSV_Helper():
     """
@@ -15,6 +19,7 @@ class CSV_Helper():
     def __init__(self, look_up_csv, write_to_csv, header=None):
         self.look_up_csv = look_up_csv
         self.write_to_csv = write_to_csv 
+        self._rows = None
         self.csv_writer = csv.writer(write_to_csv, delimiter=',',
                 quotechar='|', quoting=csv.QUOTE_MINIMAL)
         if header==None:
@@ -33,13 +38,19 @@ class CSV_Helper():
         self.csv_writer.writerow(header)
 
     def look_up(self, subj_name):    
-        size = len(subj_name)
-        for line in self.look_up_csv:
-            if line[0 : size] == subj_name:
-                self.look_up_csv.seek(0)
-                return line[size+1:].rstrip().split(",")
-        self.look_up_csv.seek(0)
-        return "?"
+        """
+        the fields after the subject column of subj_name's row, "?" if it has none;
+        the csv is read into a dict of subject -> fields on the first look up
+        """
+        if self._rows is None:
+            self._rows = {}
+            self.look_up_csv.seek(0)
+            for line in self.look_up_csv:
+                fields = line.rstrip().split(",")
+                self._rows.setdefault(fields[0], fields[1:])
+            self.look_up_csv.seek(0)
+
+        return self._rows.get(subj_name, "?")
     
     def write_to(self, subj_name, partition, specs, num_partitions):
         params = [subj_name, partition]
@@ -93,6 +104,39 @@ def csv2data(filename, has_header=True):
         raise FileNotFoundError("Could not locate %s" % filename)
 
 
+def write_csv_atomic(filename, rows, header=None):
+    """
+    write rows to a .csv by writing a temporary file next to it and
+    renaming it over the original, so that readers never see a
+    half written file and a killed job leaves the original intact
+
+    args:
+        --> filename : the .csv file
+        --> rows : the rows to write
+        --> header : optional first row
+    """
+    temp = "%s.%d.tmp" % (filename, os.getpid())
+    with open(temp, "w", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        if header is not None:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+    os.replace(temp, filename)
+
+
+_numbers = re.compile(r'(\d+)')
+
+
+def natural_key(value):
+    """
+    sort key that orders embedded numbers by value, so that
+    frame2.png comes before frame10.png
+    """
+    parts = _numbers.split(value)
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
 def check_exists_create_if_not(directory, suppress=False):
     """
     check whether a directory exists -- create it if it doesn't
@@ -111,3 +155,69 @@ def check_exists_create_if_not(directory, suppress=False):
         if not suppress:
             print("[check_exists_create_if_not] making a dir: %s" % directory)
         os.makedirs(directory)
+
+
+def _guarded_call(packed):
+    """
+    run func(*args) and capture any exception as a string so
+    that one bad job never takes down the whole pool
+    """
+    func, args = packed
+    try:
+        return args, func(*args), None
+    except Exception:
+        return args, None, traceback.format_exc()
+
+
+def parallel_map(func, jobs, processes=None, maxtasksperchild=None, threads=False, suppress=False, name="parallel_map"):
+    """
+    run func over a list of argument tuples with a pool of workers,
+    yielding results as they complete
+
+    args:
+        func : a picklable (module level) function
+        jobs : list of argument tuples, func is called as func(*job)
+        processes : the number of workers, defaults to the number of cores
+        maxtasksperchild : recycle each worker process after this many jobs,
+                           bounding the memory any single worker can accumulate
+        threads : use a thread pool instead of a process pool (for jobs that
+                  spend their time in subprocesses or release the GIL)
+        suppress : boolean to suppress the progress bar or not
+        name : title for the progress output
+
+    yields:
+        (job, result, error) : the argument tuple, func's return value and
+                               None, or None and the formatted traceback if
+                               the job raised
+    """
+    jobs = [tuple(job) for job in jobs]
+    total = len(jobs)
+
+    if total == 0:
+        return
+
+    if threads:
+        pool = ThreadPool(processes)
+    else:
+        pool = Pool(processes, maxtasksperchild=maxtasksperchild)
+
+    done, failed = 0, 0
+    try:
+        for job, result, error in pool.imap_unordered(_guarded_call, [(func, job) for job in jobs]):
+            done += 1
+            if error is not None:
+                failed += 1
+
+            if not suppress:
+                sys.stdout.write("\r[%s] %d/%d done, %d failed" % (name, done, total, failed))
+                sys.stdout.flush()
+
+            yield job, result, error
+
+    finally:
+        pool.close()
+        pool.join()
+
+        if not suppress:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
@@ -0,0 +1,233 @@
+"""
+build.py runs the preprocessing stages as a dependency graph of small
+(per trial) tasks instead of a chain of scripts guarded by directory
+existence checks.
+
+Every finished task is checkpointed in a json manifest along with a
+signature of its function and arguments. A rerun skips the tasks that
+are in the manifest with the same signature, whose outputs still exist
+and whose dependencies were skipped as well; anything else (including a
+task that was interrupted half way) has its outputs removed and is run
+again. Tasks whose dependencies are done run concurrently, so independent
+branches (e.g the real and the augmented trials) overlap.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import traceback
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _call(func, args, kwargs):
+    """
+    run a task, capturing its exception as a string so it can cross process boundaries
+    """
+    start = time.time()
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        return time.time() - start, traceback.format_exc()
+    return time.time() - start, None
+
+
+class Task():
+    """
+    a node of a BuildGraph, see BuildGraph.add
+    """
+    def __init__(self, name, func, args, kwargs, deps, outputs):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs)
+        self.deps = list(deps)
+        self.outputs = list(outputs)
+
+    def signature(self):
+        """
+        sha256 of the task's function and arguments, a change reruns the task
+        """
+        described = json.dumps([self.func.__module__, self.func.__name__, self.args, self.kwargs],
+                               sort_keys=True, default=repr)
+        return hashlib.sha256(described.encode()).hexdigest()
+
+
+class BuildGraph():
+    """
+    a resumable dependency graph of build tasks
+
+    usage example:
+        graph = BuildGraph("frames.manifest.json", workers=4)
+        graph.add("proxy:S0001/Trial1", vc.make_proxy, args=(movie, "proxies/"),
+                  outputs=[proxy])
+        graph.add("frames:S0001/Trial1", vc.stream_video_file, args=(proxy, "frames/"),
+                  deps=["proxy:S0001/Trial1"], outputs=[frame_dir, frame_dir + ".json"])
+        done, skipped, failed = graph.run()
+
+    args:
+        manifest : the json file checkpointing the finished tasks
+        workers (optional) : the number of tasks to run at once
+        processes (optional) : run tasks in worker processes instead of threads
+                               (the task functions must then be picklable)
+        suppress (optional) : boolean to suppress messages or not
+    """
+    def __init__(self, manifest, workers=4, processes=False, suppress=False):
+        self.manifest_path = manifest
+        self.workers = workers
+        self.processes = processes
+        self.suppress = suppress
+        self.tasks = {}
+
+        try:
+            with open(manifest, "r") as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def add(self, name, func, args=(), kwargs=None, deps=(), outputs=()):
+        """
+        add a task to the graph
+
+        args:
+            name : unique name of the task, e.g "frames:S0001/Trial1"
+            func : the function to run, func(*args, **kwargs)
+            args, kwargs (optional) : its arguments
+            deps (optional) : names of the tasks that must finish first
+            outputs (optional) : the files and directories the task writes; they are
+                                 removed before the task (re)runs and must exist for
+                                 the task to count as done on the next run
+        """
+        if name in self.tasks:
+            raise ValueError("task %s was already added" % name)
+
+        self.tasks[name] = Task(name, func, args, kwargs or {}, deps, outputs)
+        return name
+
+    def _save(self):
+        temp = "%s.%d.tmp" % (self.manifest_path, os.getpid())
+        with open(temp, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(temp, self.manifest_path)
+
+    def _order(self):
+        """
+        the tasks in dependency order, checking the graph for missing tasks and cycles
+        """
+        order, state = [], {}
+
+        def visit(name, path):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("dependency cycle: %s" % " -> ".join(path + [name]))
+            if name not in self.tasks:
+                raise ValueError("%s depends on unknown task %s" % (path[-1], name))
+
+            state[name] = "visiting"
+            for dep in self.tasks[name].deps:
+                visit(dep, path + [name])
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.tasks:
+            visit(name, [])
+        return order
+
+    def _up_to_date(self, task, rerun):
+        entry = self.manifest.get(task.name)
+        return (entry is not None
+                and entry["signature"] == task.signature()
+                and all(os.path.exists(output) for output in task.outputs)
+                and not any(dep in rerun for dep in task.deps))
+
+    def run(self):
+        """
+        run every task that is not up to date, as concurrently as the dependencies allow;
+        a failed task is reported and its dependents are not run
+
+        returns:
+            (done, skipped, failed) : the names of the tasks that ran, that were up to
+                                      date, and that failed or could not run
+        """
+        order = self._order()
+        done, skipped, failed, rerun = [], [], [], set()
+        waiting = list(order)
+        running = {}
+
+        executor = ProcessPoolExecutor(self.workers) if self.processes else ThreadPoolExecutor(self.workers)
+        try:
+            while waiting or running:
+                # start every task whose dependencies have finished
+                for name in list(waiting):
+                    unfinished = set(waiting) | set(running.values())
+                    task = self.tasks[name]
+                    if any(dep in failed for dep in task.deps):
+                        waiting.remove(name)
+                        failed.append(name)
+                        continue
+
+                    if any(dep in unfinished for dep in task.deps):
+                        continue
+
+                    waiting.remove(name)
+                    if self._up_to_date(task, rerun):
+                        skipped.append(name)
+                        continue
+
+                    # a task that was interrupted may have left partial outputs behind
+                    self.manifest.pop(name, None)
+                    for output in task.outputs:
+                        _remove(output)
+
+                    running[executor.submit(_call, task.func, task.args, task.kwargs)] = name
+
+                if not running:
+                    continue
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    task = self.tasks[name]
+                    elapsed, error = future.result()
+
+                    if error is not None:
+                        failed.append(name)
+                        if not self.suppress:
+                            print("[BuildGraph] FAILED %s\n%s" % (name, error))
+                        continue
+
+                    missing = [output for output in task.outputs if not os.path.exists(output)]
+                    if missing:
+                        failed.append(name)
+                        if not self.suppress:
+                            print("[BuildGraph] FAILED %s: missing outputs %s" % (name, ", ".join(missing)))
+                        continue
+
+                    done.append(name)
+                    rerun.add(name)
+                    self.manifest[name] = {"signature": task.signature(), "outputs": task.outputs,
+                                           "finished": time.time(), "seconds": elapsed}
+                    self._save()
+
+                    if not self.suppress:
+                        sys.stdout.write("\r[BuildGraph] %d/%d tasks done, %d skipped, %d failed"
+                                         % (len(done), len(order), len(skipped), len(failed)))
+                        sys.stdout.flush()
+        finally:
+            executor.shutdown(wait=True)
+            self._save()
+
+        if not self.suppress:
+            print("\n[BuildGraph] ran %d tasks, %d up to date, %d failed" % (len(done), len(skipped), len(failed)))
+
+        return done, skipped, failed
@@ -0,0 +1,369 @@
+"""
+cache.py is a content addressed cache for the outputs of the preprocessing
+stages (extract, resize, flow, augment, partition). An output is keyed by
+the sha256 of the stage name, its parameters and the content of its inputs,
+so unchanged work is reused across runs and across output directories while
+a changed input (or parameter) is recomputed automatically.
+
+    cache_dir/objects/<key>/0, 1, ...     the stored outputs
+    cache_dir/objects/<key>/entry.json    stage, size; its mtime is the last use
+    cache_dir/hashes.json                 memo of file hashes by size and mtime
+    cache_dir/links.json                  which key each output path was made from, and its stamp
+
+Outputs are hardlinked in and out of the cache (copied across filesystems),
+so a hit costs no extra disk space. An output is untouched as long as the
+files it was made with keep their size and mtime; later stages may add
+subdirectories of their own (e.g flow_h/ and its sidecar in a resized trial)
+without making it stale.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+CHUNK = 1 << 20
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _link_tree(src, dst):
+    """
+    hardlink (or copy) a file or a directory tree from src to dst
+    """
+    if not os.path.isdir(src):
+        _link_or_copy(src, dst)
+        return
+
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        _link_tree(os.path.join(src, name), os.path.join(dst, name))
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(_size(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _stamp(path, dirs=None):
+    """
+    a digest of the names, sizes and mtimes of the files of an output
+
+    args:
+        path : the output file or directory
+        dirs : the subdirectories the output was made with, all of the present ones
+               if None; the others and their sidecars were added by later stages
+               and are left out
+
+    returns:
+        (digest, dirs)
+    """
+    digest = hashlib.sha256()
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        digest.update(("%d %d" % (stat.st_size, stat.st_mtime_ns)).encode())
+        return digest.hexdigest(), None
+
+    names = sorted(os.listdir(path))
+    if dirs is None:
+        dirs = [name for name in names if os.path.isdir(os.path.join(path, name))]
+    added = set(name for name in names if os.path.isdir(os.path.join(path, name)) and name not in dirs)
+
+    for name in names:
+        if name in added or (name.endswith(".json") and name[:-5] in added):
+            continue
+
+        full = os.path.join(path, name)
+        if name in dirs:
+            files = []
+            for root, subdirs, filenames in os.walk(full):
+                subdirs.sort()
+                files.extend(os.path.join(root, f) for f in sorted(filenames))
+        else:
+            files = [full]
+
+        for f in files:
+            stat = os.stat(f)
+            digest.update(("%s %d %d" % (os.path.relpath(f, path), stat.st_size, stat.st_mtime_ns)).encode())
+
+    # a subdirectory that went missing changes the digest too
+    digest.update(json.dumps(dirs).encode())
+    return digest.hexdigest(), dirs
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    temp = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp, "w") as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+class StageCache():
+    """
+    content addressed cache of preprocessing stage outputs
+
+    usage example:
+        cache = StageCache("cache/", max_bytes=50 * 2**30)
+        outputs = [frame_dir, frame_dir + ".json"]
+        cache.run("extract", [movie], {"clip": 2, "fps": 30}, outputs,
+                  vc.video_file_to_frames, movie, output_dir)
+        cache.save()
+
+    args:
+        cache_dir : directory holding the cache
+        max_bytes (optional) : evict the least recently used entries beyond this size
+        suppress (optional) : boolean to suppress messages or not
+    """
+    def __init__(self, cache_dir, max_bytes=None, suppress=False):
+        self.cache_dir = cache_dir
+        self.objects = os.path.join(cache_dir, "objects")
+        self.max_bytes = max_bytes
+        self.suppress = suppress
+        os.makedirs(self.objects, exist_ok=True)
+
+        self.hashes_path = os.path.join(cache_dir, "hashes.json")
+        self.links_path = os.path.join(cache_dir, "links.json")
+        self.hashes = _read_json(self.hashes_path, {})
+        self.links = _read_json(self.links_path, {})
+
+    def file_hash(self, path):
+        """
+        sha256 of a file, memoized on its size and modification time
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+
+        memo = self.hashes.get(path)
+        if memo is not None and memo[:2] == stamp:
+            return memo[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                digest.update(chunk)
+
+        self.hashes[path] = stamp + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def content_hash(self, path):
+        """
+        sha256 of a file, or of the names and contents of every file under a directory
+        """
+        if not os.path.isdir(path):
+            return self.file_hash(path)
+
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).encode())
+                digest.update(self.file_hash(full).encode())
+
+        return digest.hexdigest()
+
+    def key(self, stage, inputs, params):
+        """
+        the cache key of running stage with params over inputs
+
+        args:
+            stage : the stage name, e.g "extract"
+            inputs : the input files or directories (missing ones, like an
+                     absent sidecar, are hashed as missing)
+            params : dict of the parameters that change the output
+        """
+        digest = hashlib.sha256()
+        digest.update(stage.encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        for path in inputs:
+            digest.update(self.content_hash(path).encode() if os.path.exists(path) else b"missing")
+
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.objects, key)
+
+    def has(self, key):
+        return os.path.exists(os.path.join(self._entry(key), "entry.json"))
+
+    def is_current(self, key, outputs):
+        """
+        whether outputs were already made from (or materialized for) key and are untouched since
+        """
+        if not os.path.exists(outputs[0]):
+            return False
+        
+        link = self.links.get(os.path.abspath(outputs[0]))
+        if link is None or link[0] != key or len(link) < 3:
+            return False
+
+        return _stamp(outputs[0], link[2])[0] == link[1]
+
+    def _record(self, key, outputs):
+        if os.path.exists(outputs[0]):
+            self.links[os.path.abspath(outputs[0])] = [key] + list(_stamp(outputs[0]))
+
+    def store(self, key, outputs, stage=""):
+        """
+        hardlink outputs into the cache under key
+        """
+        entry = self._entry(key)
+        if self.has(key):
+            self._record(key, outputs)
+            return
+
+        temp = "%s.%d.tmp" % (entry, os.getpid())
+        _remove(temp)
+        os.makedirs(temp)
+
+        present, size = [], 0
+        for i, output in enumerate(outputs):
+            present.append(os.path.exists(output))
+            if present[-1]:
+                _link_tree(output, os.path.join(temp, str(i)))
+                size += _size(output)
+
+        _write_json(os.path.join(temp, "entry.json"), {"stage": stage, "size": size, "outputs": present,
+                                                       "created": time.time()})
+
+        try:
+            os.rename(temp, entry)
+        except OSError:
+            # another process stored the same key first
+            _remove(temp)
+
+        self._record(key, outputs)
+
+    def materialize(self, key, outputs):
+        """
+        hardlink the outputs stored under key to outputs, replacing whatever is there
+        """
+        entry = self._entry(key)
+        info = _read_json(os.path.join(entry, "entry.json"), None)
+        if info is None:
+            raise KeyError("no cache entry %s" % key)
+
+        for i, output in enumerate(outputs):
+            _remove(output)
+            if not info["outputs"][i]:
+                continue
+
+            parent = os.path.dirname(os.path.abspath(output))
+            os.makedirs(parent, exist_ok=True)
+
+            temp = "%s.%d.tmp" % (output.rstrip("/"), os.getpid())
+            _remove(temp)
+            _link_tree(os.path.join(entry, str(i)), temp)
+            os.rename(temp, output)
+
+        # the mtime of entry.json is the last use, for eviction
+        os.utime(os.path.join(entry, "entry.json"))
+        self._record(key, outputs)
+
+    def plan(self, stage, inputs, params, outputs):
+        """
+        restore outputs from the cache if possible
+
+        args:
+            stage : the stage name
+            inputs : the input files or directories of the stage
+            params : dict of the parameters that change the output
+            outputs : the paths the stage writes, the first being the main output
+
+        returns:
+            None if outputs are current or were restored from the cache, otherwise
+            the key to store them under (see store) once they have been computed;
+            stale outputs are removed in that case
+        """
+        key = self.key(stage, inputs, params)
+        if self.is_current(key, outputs):
+            return None
+
+        if self.has(key):
+            if not self.suppress:
+                print("[StageCache] %s hit -> %s" % (stage, outputs[0]))
+            self.materialize(key, outputs)
+            return None
+
+        for output in outputs:
+            _remove(output)
+
+        return key
+
+    def run(self, stage, inputs, params, outputs, func, *args, **kwargs):
+        """
+        make outputs by calling func(*args, **kwargs), unless they are current
+        or stored in the cache
+
+        returns:
+            True if func was called
+        """
+        key = self.plan(stage, inputs, params, outputs)
+        if key is None:
+            return False
+
+        func(*args, **kwargs)
+        self.store(key, outputs, stage=stage)
+        return True
+
+    def evict(self, max_bytes=None):
+        """
+        remove the least recently used entries until the cache holds at most max_bytes
+
+        returns:
+            the number of entries removed
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return 0
+
+        entries = []
+        for key in os.listdir(self.objects):
+            pth = os.path.join(self.objects, key, "entry.json")
+            info = _read_json(pth, None)
+            if info is not None:
+                entries.append((os.path.getmtime(pth), info["size"], key))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, key in sorted(entries):
+            if total <= max_bytes:
+                break
+            _remove(self._entry(key))
+            total -= size
+            removed += 1
+
+        if removed and not self.suppress:
+            print("[StageCache] evicted %d entries, %d bytes left" % (removed, total))
+        return removed
+
+    def save(self):
+        """
+        persist the hash memo and output records, and evict down to max_bytes
+        """
+        _write_json(self.hashes_path, self.hashes)
+        _write_json(self.links_path, self.links)
+        self.evict()
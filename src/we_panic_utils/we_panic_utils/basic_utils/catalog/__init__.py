@@ -0,0 +1 @@
+from .catalog import Catalog, HR_BUCKETS, bucket_index
@@ -0,0 +1,353 @@
+"""
+catalog.py keeps everything known about the dataset in one indexed SQLite
+file, in place of the label and partition csvs every stage used to write
+and re-scan (DeepLearningClassData.csv, NextStartingPoint.csv,
+subject_data.csv, partitions_cons.csv, reg_part_out.csv):
+
+    subjects    subject, and for augmentations the subject, trial and speed
+                factor they were made from
+    trials      subject, trial, heart rate, respiratory rate, fps, frame count
+    locations   where a trial is stored: its video, frames, frame store, ...
+    windows     the partitions of a trial, either a partition directory or
+                a (start, length, stride) record over the trial's frames
+
+The preprocessing stages upsert into it in bulk, one transaction per call,
+and the split functions and the FrameProcessor query it, e.g every window
+of the training subjects whose heart rate is in bucket k. The database is
+in WAL mode so a training job can read it while a stage is writing.
+"""
+
+import sqlite3
+import threading
+
+# the heart rate ranges of the buckets of split_utils.buckets, [low, high)
+HR_BUCKETS = [(None, 45), (45, 60), (60, 75), (75, 90), (90, 105),
+              (105, 120), (120, 135), (135, 150), (150, 175), (175, None)]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subjects (
+    subject TEXT PRIMARY KEY,
+    parent TEXT,
+    parent_trial INTEGER,
+    speed REAL
+);
+CREATE INDEX IF NOT EXISTS subjects_parent ON subjects (parent);
+
+CREATE TABLE IF NOT EXISTS trials (
+    subject TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    heart_rate REAL,
+    resp_rate REAL,
+    fps REAL,
+    frame_count INTEGER,
+    PRIMARY KEY (subject, trial)
+);
+CREATE INDEX IF NOT EXISTS trials_heart_rate ON trials (heart_rate);
+
+CREATE TABLE IF NOT EXISTS locations (
+    subject TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (subject, trial, kind)
+);
+
+CREATE TABLE IF NOT EXISTS windows (
+    subject TEXT NOT NULL,
+    trial INTEGER NOT NULL,
+    partition INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    start INTEGER,
+    length INTEGER,
+    stride INTEGER,
+    PRIMARY KEY (subject, trial, partition)
+);
+"""
+
+KEYS = {"subjects": ("subject",),
+        "trials": ("subject", "trial"),
+        "locations": ("subject", "trial", "kind"),
+        "windows": ("subject", "trial", "partition")}
+
+
+def bucket_index(val):
+    """
+    the index in HR_BUCKETS of a bucket value of split_utils.buckets,
+    e.g 0 -> 0, .3 -> 3, None if val is over 1
+    """
+    for k in range(len(HR_BUCKETS) - 1):
+        if val < (k + 1) / 10.:
+            return k
+
+    return len(HR_BUCKETS) - 1 if val <= 1.0 else None
+
+
+def _bucket_clause(bucket, column="t.heart_rate"):
+    low, high = HR_BUCKETS[bucket]
+    clauses, params = [], []
+    if low is not None:
+        clauses.append("%s >= ?" % column)
+        params.append(low)
+    if high is not None:
+        clauses.append("%s < ?" % column)
+        params.append(high)
+
+    return clauses, params
+
+
+class Catalog():
+    """
+    the SQLite dataset catalog
+
+    usage example:
+        catalog = Catalog("dataset.db")
+        catalog.upsert_trials([{"subject": "1", "trial": 1, "heart_rate": 72., "resp_rate": 18.}])
+        catalog.upsert_locations([{"subject": "1", "trial": 1, "kind": "frames", "path": "rsz32/S0001/Trial1_frames"}])
+
+        catalog.labels("1", 1)                                  # (72.0, 18.0)
+        catalog.windows(trials=[("1", 1), ("2", 2)], bucket=3)  # windows with 75 <= heart rate < 90
+
+    Every thread gets its own connection, so a catalog can be shared by the
+    threads of a training job.
+
+    args:
+        path : the database file, created if it does not exist
+        timeout (optional) : seconds to wait for another process's write to finish
+    """
+    def __init__(self, path, timeout=60.):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+
+        return conn
+
+    def close(self):
+        """
+        close the connection of the calling thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _query(self, sql, params=()):
+        return [dict(row) for row in self._connection().execute(sql, params)]
+
+    def _upsert(self, table, rows, delete=None):
+        """
+        insert rows (dicts of column -> value) into table in one transaction,
+        updating the columns they hold on the rows that already exist and
+        leaving their other columns alone; delete is an optional (sql, params)
+        run first in the same transaction
+        """
+        rows = list(rows)
+        if not rows and delete is None:
+            return 0
+
+        columns = list(rows[0].keys()) if rows else list(KEYS[table])
+        key = KEYS[table]
+        updates = [c for c in columns if c not in key]
+        sql = "INSERT INTO %s (%s) VALUES (%s)" % (table, ", ".join(columns), ", ".join("?" * len(columns)))
+        if updates:
+            sql += " ON CONFLICT (%s) DO UPDATE SET %s" % (", ".join(key),
+                                                           ", ".join("%s = excluded.%s" % (c, c) for c in updates))
+        else:
+            sql += " ON CONFLICT DO NOTHING"
+
+        with self._connection() as conn:
+            if delete is not None:
+                conn.execute(*delete)
+            conn.executemany(sql, [tuple(_value(row[c]) for c in columns) for row in rows])
+
+        return len(rows)
+
+    def upsert_subjects(self, rows):
+        """
+        add or update subjects, dicts with the key subject and optionally the
+        parent, parent_trial and speed of an augmentation
+        """
+        return self._upsert("subjects", rows)
+
+    def upsert_trials(self, rows):
+        """
+        add or update trials, dicts with the keys subject and trial and any of
+        heart_rate, resp_rate, fps and frame_count; the subjects are added too
+        """
+        rows = list(rows)
+        self._upsert("subjects", [{"subject": row["subject"]} for row in rows])
+        return self._upsert("trials", rows)
+
+    def upsert_trial_rows(self, rows, kind="frames"):
+        """
+        add or update trials from rows of Subject, Trial, Path, Heart Rate and
+        Respiratory Rate, like the ones of subject_data.csv, cataloging each
+        Path as the kind location of its trial
+        """
+        rows = list(rows)
+        self.upsert_trials({"subject": str(row[0]), "trial": int(row[1]), "heart_rate": row[3], "resp_rate": row[4]}
+                           for row in rows)
+        return self.upsert_locations({"subject": str(row[0]), "trial": int(row[1]), "kind": kind, "path": row[2]}
+                                     for row in rows)
+
+    def upsert_locations(self, rows):
+        """
+        add or update storage locations, dicts with the keys subject, trial,
+        kind (e.g video, frames, store, archive) and path
+        """
+        return self._upsert("locations", rows)
+
+    def upsert_windows(self, rows):
+        """
+        add or update windows, dicts with the keys subject, trial, partition
+        and path, and start, length and stride for partition records
+        """
+        return self._upsert("windows", rows)
+
+    def replace_windows(self, subject, trial, rows):
+        """
+        replace every window of a trial, e.g after it was partitioned again
+        """
+        rows = [dict(row, subject=str(subject), trial=int(trial)) for row in rows]
+        return self._upsert("windows", rows,
+                            delete=("DELETE FROM windows WHERE subject = ? AND trial = ?", (str(subject), int(trial))))
+
+    def labels(self, subject, trial):
+        """
+        the (heart rate, respiratory rate) of a trial, None if it is not cataloged
+        """
+        row = self._connection().execute("SELECT heart_rate, resp_rate FROM trials WHERE subject = ? AND trial = ?",
+                                         (str(subject), int(trial))).fetchone()
+        return None if row is None else (row["heart_rate"], row["resp_rate"])
+
+    def master_row(self, subject):
+        """
+        the labels of a subject as a row of the master csv after its subject
+        column, [hr1, rr1, hr2, rr2] with "" for a missing trial, None if the
+        subject is not cataloged
+        """
+        rows = self._query("SELECT trial, heart_rate, resp_rate FROM trials WHERE subject = ?", (str(subject),))
+        if not rows:
+            return None
+
+        labels = ["", "", "", ""]
+        for row in rows:
+            if row["trial"] in (1, 2):
+                i = 2 * (row["trial"] - 1)
+                labels[i:i + 2] = ["" if v is None else "%g" % v for v in (row["heart_rate"], row["resp_rate"])]
+
+        return labels
+
+    def location(self, subject, trial, kind="frames"):
+        """
+        the path of a trial's kind of storage, None if it has none
+        """
+        row = self._connection().execute("SELECT path FROM locations WHERE subject = ? AND trial = ? AND kind = ?",
+                                         (str(subject), int(trial), kind)).fetchone()
+        return None if row is None else row["path"]
+
+    def _select(self, sql, params=(), trials=None, subjects=None, bucket=None, augmented=None):
+        """
+        run a select over trials t joined with subjects s, restricted to the
+        given (subject, trial) pairs, subjects, heart rate bucket and
+        augmented or real subjects
+        """
+        clauses, params = [], list(params)
+        conn = self._connection()
+
+        if trials is not None:
+            # committed right away: an open transaction would pin this connection to
+            # a stale snapshot of the database and keep the WAL from being checkpointed
+            with conn:
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS selected_trials (subject TEXT, trial INTEGER, "
+                             "PRIMARY KEY (subject, trial))")
+                conn.execute("DELETE FROM selected_trials")
+                conn.executemany("INSERT OR IGNORE INTO selected_trials VALUES (?, ?)",
+                                 [(str(s), int(t)) for s, t in trials])
+            sql += " JOIN selected_trials x ON x.subject = t.subject AND x.trial = t.trial"
+
+        if subjects is not None:
+            subjects = [str(s) for s in subjects]
+            clauses.append("t.subject IN (%s)" % ", ".join("?" * len(subjects)))
+            params.extend(subjects)
+
+        if bucket is not None:
+            bucket_clauses, bucket_params = _bucket_clause(bucket)
+            clauses.extend(bucket_clauses)
+            params.extend(bucket_params)
+
+        if augmented is not None:
+            clauses.append("s.parent IS NOT NULL" if augmented else "s.parent IS NULL")
+
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+
+        return [dict(row) for row in conn.execute(sql, params)]
+
+    def trials(self, trials=None, subjects=None, bucket=None, augmented=None, kind="frames"):
+        """
+        the cataloged trials
+
+        args:
+            trials (optional) : only these (subject, trial) pairs
+            subjects (optional) : only the trials of these subjects
+            bucket (optional) : only the trials whose heart rate is in HR_BUCKETS[bucket]
+            augmented (optional) : only the augmented (True) or the real (False) subjects
+            kind (optional) : the storage location returned as path
+
+        returns:
+            a list of dicts with the keys subject, trial, heart_rate, resp_rate,
+            fps, frame_count, parent, speed and path (None if it has no such location)
+        """
+        sql = ("SELECT t.subject, t.trial, t.heart_rate, t.resp_rate, t.fps, t.frame_count, s.parent, s.speed, "
+               "l.path FROM trials t JOIN subjects s ON s.subject = t.subject "
+               "LEFT JOIN locations l ON l.subject = t.subject AND l.trial = t.trial AND l.kind = ?")
+        return self._select(sql, (kind,), trials=trials, subjects=subjects, bucket=bucket, augmented=augmented)
+
+    def windows(self, trials=None, subjects=None, bucket=None, augmented=None):
+        """
+        the cataloged windows, restricted like trials
+
+        returns:
+            a list of dicts with the keys subject, trial, partition, path, start,
+            length, stride, heart_rate and resp_rate; start, length and stride
+            are None for partition directories
+        """
+        sql = ("SELECT w.subject, w.trial, w.partition, w.path, w.start, w.length, w.stride, "
+               "t.heart_rate, t.resp_rate FROM windows w "
+               "JOIN trials t ON t.subject = w.subject AND t.trial = w.trial "
+               "JOIN subjects s ON s.subject = t.subject")
+        return self._select(sql, trials=trials, subjects=subjects, bucket=bucket, augmented=augmented)
+
+    def lineage(self, subject):
+        """
+        the subjects augmented from subject
+        """
+        return [row["subject"] for row in self._query("SELECT subject FROM subjects WHERE parent = ?", (str(subject),))]
+
+
+def _value(value):
+    # numpy scalars and the like are not sqlite types
+    if value is None or isinstance(value, (str, int, float, bytes)):
+        return value
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
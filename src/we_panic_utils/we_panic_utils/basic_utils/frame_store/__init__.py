@@ -0,0 +1,3 @@
+from .frame_store import FrameStore, pack_frames, open_frame_store, store_path, read_frames
+from .archive import FrameArchive, pack_archive, open_frame_archive, open_frame_source, archive_path
+from .shards import ShardWriter, ShardReader, read_shard, shard_paths
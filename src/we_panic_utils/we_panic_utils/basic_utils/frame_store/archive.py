@@ -0,0 +1,316 @@
+"""
+archive.py stores the frames of a trial as a compressed archive. Fingertip
+videos are nearly static red fields, so consecutive frames differ very little:
+the frames are grouped into chunks of chunk_size, each chunk optionally
+delta encoded along time (every frame but the first minus the one before it,
+wrapping around in uint8) and compressed with lz4 when it is installed,
+zlib otherwise.
+
+    rsz32/S0001/Trial1_frames  ->  rsz32/S0001/Trial1_frames.archive
+
+    header | json blob | chunk 0 | chunk 1 | ... | index
+
+The index holds the offset and length of every chunk, so reading a window
+only decompresses the chunks it touches.
+"""
+
+import os
+import json
+import mmap
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+from we_panic_utils.basic_utils.video_core.partitions import trial_frame_names
+from .frame_store import read_frames, open_frame_store, changed_since
+
+MAGIC = b"WPFARCHV"
+VERSION = 1
+EXTENSION = ".archive"
+
+# magic, version, frame count, height, width, channels, fps, chunk size,
+# codec, delta encoded, offset of the index, length of the json blob
+HEADER = struct.Struct("<8sIIIIIdI4sIQI")
+
+# offset and length of a chunk
+INDEX_ENTRY = struct.Struct("<QQ")
+
+CODECS = {b"zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress)}
+if lz4 is not None:
+    CODECS[b"lz4f"] = (lambda data, level: lz4.compress(data, compression_level=level), lz4.decompress)
+
+# lz4 decompresses several times faster than zlib, which is what training pays for
+DEFAULT_CODEC = b"lz4f" if lz4 is not None else b"zlib"
+
+_cache = {}
+
+
+def archive_path(frame_dir):
+    """
+    the frame archive of a trial (or partition) frame directory
+    """
+    return frame_dir.rstrip("/") + EXTENSION
+
+
+def encode_chunk(frames, delta=True):
+    """
+    the bytes of a n x H x W x C uint8 chunk, each frame but the first
+    replaced by its difference with the previous one when delta is on
+    """
+    if delta and len(frames) > 1:
+        frames = np.concatenate([frames[:1], np.diff(frames, axis=0)])
+
+    return np.ascontiguousarray(frames, dtype=np.uint8).tobytes()
+
+
+def decode_chunk(data, shape, delta=True):
+    """
+    the n x H x W x C uint8 chunk encoded by encode_chunk
+    """
+    frames = np.frombuffer(data, dtype=np.uint8).reshape(shape)
+    if delta:
+        # the running sum undoes the differences, wrapping around like they did
+        return np.cumsum(frames, axis=0, dtype=np.uint8)
+
+    return frames
+
+
+def pack_archive(frame_dir, output_path=None, width=None, height=None, frames=None,
+                 chunk_size=32, codec=None, level=1, delta=True):
+    """
+    Pack the frames of a directory into a frame archive, a chunk at a time.
+    The archive is written next to its final path and renamed into place.
+
+    args:
+        frame_dir : the trial (or partition) frame directory
+        output_path (optional) : the archive to write, defaults to archive_path(frame_dir)
+        width, height (optional) : resize the frames to this resolution, None keeps theirs
+        frames (optional) : the frame names in temporal order, read from the sidecar
+                            (or the natural order of the directory) by default
+        chunk_size (optional) : the number of frames compressed together
+        codec (optional) : "lz4f" or "zlib", defaults to lz4f when lz4 is installed
+        level (optional) : the compression level of the codec
+        delta (optional) : delta encode the frames of each chunk along time
+
+    returns:
+        the (frame count, height, width, channels) of the archive
+    """
+    if not os.path.isdir(frame_dir):
+        raise FileNotFoundError("provided directory |%s| not found" % frame_dir)
+
+    codec = codec.encode("ascii") if isinstance(codec, str) else (codec or DEFAULT_CODEC)
+    if codec not in CODECS:
+        raise ValueError("codec %s is not available, expected one of %s" % (str(codec), str(sorted(CODECS))))
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size should be >= 1, got %d" % chunk_size)
+
+    output_path = output_path or archive_path(frame_dir)
+    fps = 30
+    if frames is None:
+        frames, fps = trial_frame_names(frame_dir)
+
+    if len(frames) == 0:
+        raise ValueError("no frames in %s" % frame_dir)
+
+    compress = CODECS[codec][0]
+    blob = json.dumps({"source": os.path.abspath(frame_dir)}).encode("utf-8")
+    index, chunk, shape = [], [], None
+
+    temp = "%s.%d.tmp" % (output_path, os.getpid())
+    try:
+        with open(temp, "wb") as archive:
+            archive.seek(HEADER.size + len(blob))
+
+            def flush():
+                data = compress(encode_chunk(np.stack(chunk), delta=delta), level)
+                index.append((archive.tell(), len(data)))
+                archive.write(data)
+                del chunk[:]
+
+            for image in read_frames(frame_dir, frames, width=width, height=height):
+                shape = image.shape
+                chunk.append(image)
+                if len(chunk) == chunk_size:
+                    flush()
+
+            if chunk:
+                flush()
+
+            index_offset = archive.tell()
+            for entry in index:
+                archive.write(INDEX_ENTRY.pack(*entry))
+
+            archive.seek(0)
+            archive.write(HEADER.pack(MAGIC, VERSION, len(frames), shape[0], shape[1], shape[2], fps,
+                                      chunk_size, codec, int(delta), index_offset, len(blob)))
+            archive.write(blob)
+
+        os.replace(temp, output_path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    return (len(frames),) + tuple(shape)
+
+
+class FrameArchive:
+    """
+    Random access to the frames of a frame archive. Windows decompress only
+    the chunks they touch, and the last few decoded chunks are kept so that
+    nearby windows do not decode them again. Indexing and windows return
+    uint8 arrays like FrameStore, so the two are interchangeable.
+
+    usage example:
+        archive = FrameArchive("rsz32/S0001/Trial1_frames.archive")
+        window = archive.window(120, 60)         # 60 x H x W x C uint8
+        print(archive.chunks_decoded)
+
+    args:
+        path : the frame archive
+        cached_chunks (optional) : the number of decoded chunks to keep
+    """
+    def __init__(self, path, cached_chunks=4):
+        with open(path, "rb") as archive:
+            header = archive.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("%s is not a frame archive" % path)
+
+            (magic, version, count, height, width, channels, fps, chunk_size,
+             codec, delta, index_offset, blob_length) = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("%s is not a frame archive" % path)
+            if version != VERSION:
+                raise ValueError("%s is a version %d frame archive, expected %d" % (path, version, VERSION))
+            if codec not in CODECS:
+                raise ValueError("%s is compressed with %s, which is not available" % (path, codec.decode("ascii")))
+
+            info = json.loads(archive.read(blob_length).decode("utf-8") or "{}")
+            self._map = mmap.mmap(archive.fileno(), 0, access=mmap.ACCESS_READ)
+
+        num_chunks = -(-count // chunk_size)
+        self.index = [INDEX_ENTRY.unpack_from(self._map, index_offset + i * INDEX_ENTRY.size) for i in range(num_chunks)]
+
+        self.path = path
+        self.fps = fps
+        self.source = info.get("source")
+        self.shape = (count, height, width, channels)
+        self.chunk_size = chunk_size
+        self.codec = codec.decode("ascii")
+        self.delta = bool(delta)
+        self.cached_chunks = cached_chunks
+        self.chunks_decoded = 0
+
+        self._decompress = CODECS[codec][1]
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def chunk(self, i):
+        """
+        the decoded frames of the i'th chunk
+        """
+        with self._lock:
+            if i in self._chunks:
+                self._chunks.move_to_end(i)
+                return self._chunks[i]
+
+        offset, length = self.index[i]
+        first = i * self.chunk_size
+        shape = (min(self.chunk_size, len(self) - first),) + self.shape[1:]
+        frames = decode_chunk(self._decompress(self._map[offset:offset + length]), shape, delta=self.delta)
+
+        with self._lock:
+            self.chunks_decoded += 1
+            self._chunks[i] = frames
+            while len(self._chunks) > self.cached_chunks:
+                self._chunks.popitem(last=False)
+
+        return frames
+
+    def take(self, indices):
+        """
+        the frames at indices, in order, decoding each chunk they touch once
+        """
+        indices = list(indices)
+        out = np.empty((len(indices),) + self.shape[1:], dtype=np.uint8)
+
+        by_chunk = OrderedDict()
+        for position, index in enumerate(indices):
+            if index < 0 or index >= len(self):
+                raise IndexError("frame %d is out of the %d frames of %s" % (index, len(self), self.path))
+            by_chunk.setdefault(index // self.chunk_size, []).append((position, index % self.chunk_size))
+
+        for i, pairs in by_chunk.items():
+            frames = self.chunk(i)
+            positions, local = zip(*pairs)
+            out[list(positions)] = frames[list(local)]
+
+        return out
+
+    def window(self, start, length, stride=1):
+        """
+        the length frames starting at start, every stride'th frame
+        """
+        if start < 0 or length <= 0 or start + (length - 1) * stride >= len(self):
+            raise ValueError("window (%d, %d, %d) is out of the %d frames of %s"
+                             % (start, length, stride, len(self), self.path))
+
+        return self.take(range(start, start + (length - 1) * stride + 1, stride))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("frame %d is out of the %d frames of %s" % (index, len(self), self.path))
+
+        return self.chunk(index // self.chunk_size)[index % self.chunk_size]
+
+
+def open_frame_archive(frame_dir):
+    """
+    the FrameArchive of a frame directory, or None if it has none or the
+    directory changed since it was packed (see changed_since, the frames
+    themselves are checked when the archive is opened); memoized on the
+    archive's mtime
+    """
+    path = archive_path(frame_dir)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _cache.get(path)
+    if changed_since(frame_dir, mtime, check_frames=cached is None or cached[0] != mtime):
+        return None
+
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, FrameArchive(path))
+        _cache[path] = cached
+
+    return cached[1]
+
+
+def open_frame_source(frame_dir):
+    """
+    the FrameStore of a frame directory, else its FrameArchive, else None
+    """
+    store = open_frame_store(frame_dir)
+    if store is not None:
+        return store
+
+    return open_frame_archive(frame_dir)
@@ -0,0 +1,218 @@
+"""
+frame_store.py packs the frames of a trial into one contiguous T x H x W x C
+uint8 file, so that training reads a window as a slice of a memory map
+instead of decoding a PNG per frame.
+
+    rsz32/S0001/Trial1_frames         ->  rsz32/S0001/Trial1_frames.frames
+    rsz32/S0001/Trial1_frames/0       ->  rsz32/S0001/Trial1_frames/0.frames
+
+A store is a small fixed header (magic, version, shape, frame rate, offset of
+the frames) followed by a json blob naming the trial it was packed from, and
+then the frames themselves in temporal order, RGB like keras' load_img.
+"""
+
+import os
+import json
+import struct
+import numpy as np
+import cv2
+
+from we_panic_utils.basic_utils.video_core.partitions import trial_frame_names
+from we_panic_utils.basic_utils.video_core.metadata import metadata_path
+
+MAGIC = b"WPFSTORE"
+VERSION = 1
+EXTENSION = ".frames"
+
+# magic, version, frame count, height, width, channels, fps, offset of the frames
+HEADER = struct.Struct("<8sIIIIIdQ")
+
+# the frames start on a multiple of ALIGNMENT bytes
+ALIGNMENT = 64
+
+_cache = {}
+
+
+def store_path(frame_dir):
+    """
+    the frame store of a trial (or partition) frame directory
+    """
+    return frame_dir.rstrip("/") + EXTENSION
+
+
+def changed_since(frame_dir, mtime, check_frames=False):
+    """
+    whether a frame directory changed after mtime (e.g a store's): frames added
+    or removed (the directory's mtime), a new frame order (its sidecar, or the
+    sidecar of the trial a partition is in) and, with check_frames, frames
+    rewritten in place under the same names
+    """
+    frame_dir = frame_dir.rstrip("/")
+    paths = [frame_dir, metadata_path(frame_dir)]
+    if os.path.dirname(frame_dir):
+        paths.append(metadata_path(os.path.dirname(frame_dir)))
+    if check_frames:
+        paths.extend(os.path.join(frame_dir, name) for name in trial_frame_names(frame_dir)[0])
+
+    for path in paths:
+        try:
+            if os.path.getmtime(path) > mtime:
+                return True
+        except OSError:
+            continue
+
+    return False
+
+
+def read_frames(frame_dir, frames, width=None, height=None):
+    """
+    yield the frames of a directory one at a time as uint8 RGB arrays,
+    optionally resized, checking that they all have the same shape
+
+    args:
+        frame_dir : the frame directory
+        frames : the frame names in temporal order
+        width, height (optional) : resize the frames to this resolution, None keeps theirs
+    """
+    shape = None
+    for name in frames:
+        image = cv2.imread(os.path.join(frame_dir, name))
+        if image is None:
+            raise IOError("could not read %s" % os.path.join(frame_dir, name))
+
+        if width is not None and height is not None and image.shape[:2] != (height, width):
+            image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if shape is None:
+            shape = image.shape
+        elif image.shape != shape:
+            raise ValueError("%s is %s, the frames before it are %s" % (name, str(image.shape), str(shape)))
+
+        yield np.ascontiguousarray(image, dtype=np.uint8)
+
+
+def pack_frames(frame_dir, output_path=None, width=None, height=None, frames=None):
+    """
+    Pack the frames of a directory into a frame store, one frame at a time so
+    that a trial never has to fit in memory. The store is written next to its
+    final path and renamed into place.
+
+    args:
+        frame_dir : the trial (or partition) frame directory
+        output_path (optional) : the store to write, defaults to store_path(frame_dir)
+        width, height (optional) : resize the frames to this resolution, None keeps theirs
+        frames (optional) : the frame names in temporal order, read from the sidecar
+                            (or the natural order of the directory) by default
+
+    returns:
+        the (frame count, height, width, channels) of the store
+    """
+    if not os.path.isdir(frame_dir):
+        raise FileNotFoundError("provided directory |%s| not found" % frame_dir)
+
+    output_path = output_path or store_path(frame_dir)
+    fps = 30
+    if frames is None:
+        frames, fps = trial_frame_names(frame_dir)
+
+    if len(frames) == 0:
+        raise ValueError("no frames in %s" % frame_dir)
+
+    blob = json.dumps({"source": os.path.abspath(frame_dir)}).encode("utf-8")
+    offset = -(-(HEADER.size + len(blob)) // ALIGNMENT) * ALIGNMENT
+
+    shape = None
+    temp = "%s.%d.tmp" % (output_path, os.getpid())
+    try:
+        with open(temp, "wb") as store:
+            store.seek(offset)
+            for image in read_frames(frame_dir, frames, width=width, height=height):
+                shape = image.shape
+                store.write(image.tobytes())
+
+            store.seek(0)
+            store.write(HEADER.pack(MAGIC, VERSION, len(frames), shape[0], shape[1], shape[2], fps, offset))
+            store.write(blob)
+
+        os.replace(temp, output_path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+    return (len(frames),) + tuple(shape)
+
+
+class FrameStore:
+    """
+    Read access to a frame store through a read only memory map. Indexing and
+    windows return views into the map, no frame is copied until it is used.
+
+    usage example:
+        store = FrameStore("rsz32/S0001/Trial1_frames.frames")
+        window = store.window(120, 60)           # 60 x H x W x C uint8 view
+        every_other = store.window(120, 60, 2)
+
+    args:
+        path : the frame store
+    """
+    def __init__(self, path):
+        with open(path, "rb") as store:
+            header = store.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError("%s is not a frame store" % path)
+
+            magic, version, count, height, width, channels, fps, offset = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError("%s is not a frame store" % path)
+            if version != VERSION:
+                raise ValueError("%s is a version %d frame store, expected %d" % (path, version, VERSION))
+
+            info = json.loads(store.read(offset - HEADER.size).rstrip(b"\0").decode("utf-8") or "{}")
+
+        self.path = path
+        self.fps = fps
+        self.source = info.get("source")
+        self.shape = (count, height, width, channels)
+        self.frames = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def window(self, start, length, stride=1):
+        """
+        the length frames starting at start, every stride'th frame, as a view
+        """
+        if start < 0 or length <= 0 or start + (length - 1) * stride >= len(self):
+            raise ValueError("window (%d, %d, %d) is out of the %d frames of %s"
+                             % (start, length, stride, len(self), self.path))
+
+        return self.frames[start:start + (length - 1) * stride + 1:stride]
+
+
+def open_frame_store(frame_dir):
+    """
+    the FrameStore of a frame directory, or None if it has none or the
+    directory changed since it was packed (see changed_since, the frames
+    themselves are checked when the store is opened); memoized on the
+    store's mtime
+    """
+    path = store_path(frame_dir)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _cache.get(path)
+    if changed_since(frame_dir, mtime, check_frames=cached is None or cached[0] != mtime):
+        return None
+
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, FrameStore(path))
+        _cache[path] = cached
+
+    return cached[1]
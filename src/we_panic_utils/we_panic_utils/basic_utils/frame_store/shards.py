@@ -0,0 +1,237 @@
+"""
+shards.py packs training windows into a few large files that are only ever
+read front to back, for datasets on spinning disks or network mounts where
+listing directories and opening a PNG per frame is what limits training.
+
+    shard_dir/shard-00000.records    records, back to back
+    shard_dir/shard-00001.records
+    shard_dir/shards.json            the shards and their record counts
+
+A record is a fixed header (magic, window shape, trial, heart rate,
+respiratory rate, length of the subject) followed by the subject and the
+window's L x H x W x C uint8 RGB frames. ShardReader streams several shards
+at once through large buffered reads and mixes their records with a shuffle
+buffer, so randomness costs memory instead of seeks.
+"""
+
+import os
+import json
+import glob
+import random
+import struct
+import numpy as np
+
+RECORD_MAGIC = b"WPRC"
+EXTENSION = ".records"
+MANIFEST = "shards.json"
+
+# magic, frames, height, width, channels, trial, heart rate, respiratory rate, subject length
+RECORD = struct.Struct("<4sIIIIIffH")
+
+
+class ShardWriter:
+    """
+    Write records into shards of about shard_bytes each. A shard is written
+    under a temporary name and renamed once it is full, and the manifest is
+    written on close, so readers never see a partial shard.
+
+    usage example:
+        with ShardWriter("shards/train") as writer:
+            writer.write(window, 72.0, 18.0, "1", 1)
+
+    args:
+        shard_dir : the directory to write the shards to
+        shard_bytes (optional) : start a new shard once one reaches this size
+        prefix (optional) : the name of the shards
+    """
+    def __init__(self, shard_dir, shard_bytes=256 * 2**20, prefix="shard"):
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        self.shard_bytes = shard_bytes
+        self.prefix = prefix
+        self.shards = []
+
+        self._file = None
+        self._path = None
+        self._records = 0
+        self._bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _roll(self):
+        self._finish()
+        self._path = os.path.join(self.shard_dir, "%s-%05d%s" % (self.prefix, len(self.shards), EXTENSION))
+        self._file = open(self._path + ".tmp", "wb")
+        self._records, self._bytes = 0, 0
+
+    def _finish(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        os.replace(self._path + ".tmp", self._path)
+        self.shards.append({"name": os.path.basename(self._path), "records": self._records, "bytes": self._bytes})
+        self._file = None
+
+    def write(self, frames, heart_rate, resp_rate, subject, trial):
+        """
+        append a record
+
+        args:
+            frames : L x H x W x C uint8 window
+            heart_rate, resp_rate : the labels of the window
+            subject : the subject, e.g "1" or "a101"
+            trial : the trial number
+        """
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        if frames.ndim != 4:
+            raise ValueError("a record holds an L x H x W x C window, got shape %s" % str(frames.shape))
+
+        if self._file is None or self._bytes >= self.shard_bytes:
+            self._roll()
+
+        subject = str(subject).encode("utf-8")
+        header = RECORD.pack(RECORD_MAGIC, frames.shape[0], frames.shape[1], frames.shape[2], frames.shape[3],
+                             int(trial), float(heart_rate), float(resp_rate), len(subject))
+        self._file.write(header)
+        self._file.write(subject)
+        self._file.write(frames.tobytes())
+
+        self._records += 1
+        self._bytes += len(header) + len(subject) + frames.nbytes
+
+    def close(self):
+        self._finish()
+
+        manifest = os.path.join(self.shard_dir, MANIFEST)
+        temp = "%s.%d.tmp" % (manifest, os.getpid())
+        with open(temp, "w") as f:
+            json.dump({"shards": self.shards}, f, indent=1)
+        os.replace(temp, manifest)
+
+
+def shard_paths(shard_dir):
+    """
+    the shards of a directory, from its manifest when it has one
+    """
+    manifest = os.path.join(shard_dir, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest, "r") as f:
+            return [os.path.join(shard_dir, shard["name"]) for shard in json.load(f)["shards"]]
+
+    return sorted(glob.glob(os.path.join(shard_dir, "*" + EXTENSION)))
+
+
+def read_shard(path, read_size=8 * 2**20):
+    """
+    yield the records of a shard in order as dicts with keys frames,
+    heart_rate, resp_rate, subject and trial, reading read_size bytes at a time
+    """
+    with open(path, "rb", buffering=read_size) as shard:
+        while True:
+            header = shard.read(RECORD.size)
+            if not header:
+                return
+            if len(header) < RECORD.size:
+                raise IOError("%s ends in the middle of a record" % path)
+
+            magic, length, height, width, channels, trial, heart_rate, resp_rate, subject_length = RECORD.unpack(header)
+            if magic != RECORD_MAGIC:
+                raise IOError("%s is corrupt, found %s where a record should start" % (path, str(magic)))
+
+            subject = shard.read(subject_length).decode("utf-8")
+            shape = (length, height, width, channels)
+            data = shard.read(length * height * width * channels)
+            if len(data) < length * height * width * channels:
+                raise IOError("%s ends in the middle of a record" % path)
+
+            yield {"frames": np.frombuffer(data, dtype=np.uint8).reshape(shape),
+                   "heart_rate": heart_rate,
+                   "resp_rate": resp_rate,
+                   "subject": subject,
+                   "trial": trial}
+
+
+class ShardReader:
+    """
+    Stream the records of a set of shards: interleave shards are read at once,
+    taking a record from each in turn, and the records pass through a shuffle
+    buffer of shuffle_buffer records. Every pass visits the shards in a new
+    random order.
+
+    usage example:
+        reader = ShardReader("shards/train", interleave=4, shuffle_buffer=512)
+        for record in reader:
+            window, hr = record["frames"], record["heart_rate"]
+
+    args:
+        shard_dir : the directory of the shards
+        interleave (optional) : the number of shards read at once
+        shuffle_buffer (optional) : the number of records to draw from at random, 1 keeps their order
+        keep (optional) : function of (subject, trial), only the records it is true for are yielded
+        cycle (optional) : start over once every shard was read, forever
+        read_size (optional) : the bytes read from a shard at a time
+        seed (optional) : seed of the shard order and the shuffle buffer
+    """
+    def __init__(self, shard_dir, interleave=4, shuffle_buffer=1024, keep=None, cycle=True,
+                 read_size=8 * 2**20, seed=None):
+        self.shards = shard_paths(shard_dir)
+        if not self.shards:
+            raise FileNotFoundError("no shards in %s" % shard_dir)
+
+        self.interleave = max(1, interleave)
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.keep = keep
+        self.cycle = cycle
+        self.read_size = read_size
+        self.random = random.Random(seed)
+
+    def _interleaved(self):
+        """
+        the records of every shard once, interleave shards at a time
+        """
+        order = list(self.shards)
+        self.random.shuffle(order)
+
+        active = []
+        while order or active:
+            while order and len(active) < self.interleave:
+                active.append(read_shard(order.pop(), read_size=self.read_size))
+
+            for shard in list(active):
+                record = next(shard, None)
+                if record is None:
+                    active.remove(shard)
+                elif self.keep is None or self.keep(record["subject"], record["trial"]):
+                    yield record
+
+    def _records(self):
+        while True:
+            found = False
+            for record in self._interleaved():
+                found = True
+                yield record
+
+            if not self.cycle:
+                return
+            if not found:
+                raise ValueError("none of the records in the shards are kept")
+
+    def __iter__(self):
+        buffer = []
+        for record in self._records():
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(record)
+                continue
+
+            i = self.random.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = record
+
+        self.random.shuffle(buffer)
+        for record in buffer:
+            yield record
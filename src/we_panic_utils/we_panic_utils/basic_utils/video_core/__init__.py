@@ -1,4 +1,16 @@
-from .video_core import video_file_exists, video_file_to_frames
-from .video_core import video_dir_to_frame_dir, partition_frame_dir, resize_frame_dir
-from .video_core import change_speed, fetch_path
+from .video_core import video_file_exists, video_file_to_frames, iter_video_frames
+from .video_core import video_files_to_frames, video_dir_to_frame_dir, partition_frame_dir, resize_frame_dir
+from .video_core import resize_frame_dir_pyramid
+from .video_core import change_speed, transform_video, fetch_path, stream_video_file
+from .video_core import keyframe_timestamps, video_segments
+from .video_core import decode_video, iter_ffmpeg_frames, probe_video, DECODERS
 from .optical_flow import write_optical_flow, optical_flow_of_first_and_rest  
+from .video_core import make_proxy, trial_video_path, PROXY_CODECS, VIDEO_EXTENSIONS
+from .metadata import video_info, read_trial_metadata, write_trial_metadata, metadata_path
+from .metadata import frame_index, partition_index, index_metadata
+from .frame_writer import FrameWriter
+from .partitions import partition_records, partition_frames, write_partition_records, read_partition_records
+from .partitions import trial_partitions
+from .partitions import write_slug_manifest, read_slug_manifest
+from .augment import resample_frame_dir, resample_indices, augmentation_lineage, catalog_lineage, SPEED_CHANGES
+from .quality import QualityTracker, good_frames, good_window_starts, QUALITY_THRESHOLDS
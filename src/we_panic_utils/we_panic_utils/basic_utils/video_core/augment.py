@@ -0,0 +1,275 @@
+"""
+augment.py holds the speed augmentation shared by augment_speed2.py (which
+re-encodes the videos with ffmpeg) and augment_frames.py (which resamples
+already extracted frames): the speed factors, the heart rate thresholds,
+the naming of augmented subjects and the scaling of their labels, as well
+as the frame-space resampling itself.
+
+A speed factor follows ffmpeg's setpts: the augmented video lasts factor
+times as long as the original, so output frame j shows the original at
+frame j / factor and the heart rate is scaled by 1 / factor.
+"""
+
+import os
+import string
+import cv2
+import pandas as pd
+
+from we_panic_utils.basic_utils.basics import check_exists_create_if_not, csv2data, write_csv_atomic
+from .frame_writer import FrameWriter
+from .metadata import read_trial_metadata, write_trial_metadata
+from .partitions import trial_frame_names
+
+UPPER_THRESHOLD = 235
+LOWER_THRESHOLD = 25
+
+#gives a list of values between 0.5 and 2 without 1
+#speed_changes = [round(x*0.1, 1) for x in range(5, 21) if x != 10]
+SPEED_CHANGES = [0.5, 0.6, 0.7, 0.8, 0.9, 1.2, 1.4, 1.6, 1.8, 2.0]
+SPEED_LETTERS = {key : letter for key, letter in zip(SPEED_CHANGES, string.ascii_lowercase)}
+
+
+def augmented_subject(subj, trial, factor):
+    """
+    the subject id of a speed augmentation, e.g subject 7 trial 1 at 0.5 -> a107
+    """
+    return "%s%d%02d" % (SPEED_LETTERS[factor], trial, subj)
+
+
+def augmentation_lineage(subject):
+    """
+    the (subject, trial, factor) an augmented subject was made from, the
+    inverse of augmented_subject, e.g a107 -> (7, 1, 0.5); None for a real subject
+    """
+    subject = str(subject)
+    factors = {letter : key for key, letter in SPEED_LETTERS.items()}
+    if len(subject) < 4 or subject[0] not in factors or not subject[1:].isdigit():
+        return None
+
+    return int(subject[2:]), int(subject[1]), factors[subject[0]]
+
+
+def catalog_lineage(subjects):
+    """
+    the catalog subject rows (see catalog.Catalog.upsert_subjects) recording
+    what the augmented subjects among subjects were made from
+    """
+    rows = []
+    for subject in subjects:
+        lineage = augmentation_lineage(subject)
+        if lineage is not None:
+            rows.append({"subject": str(subject), "parent": str(lineage[0]), "parent_trial": lineage[1],
+                         "speed": lineage[2]})
+
+    return rows
+
+
+def augmented_labels(heart_rate, factor):
+    """
+    the heart rate and respiratory rate of a trial played at factor
+
+    returns:
+        (heart rate, respiratory rate), or None if the heart rate would
+        fall outside of [LOWER_THRESHOLD, UPPER_THRESHOLD]
+    """
+    scaled = heart_rate * (1 / factor)
+    if scaled > UPPER_THRESHOLD or scaled < LOWER_THRESHOLD:
+        return None
+
+    return round(scaled, 1), scaled / 4
+
+
+def plan_augmentations(selected_df, data, aug_log=None, speed_changes=SPEED_CHANGES):
+    """
+    every (subject, trial, speed factor) augmentation of the selected trials
+    whose heart rate stays within the thresholds
+
+    args:
+        selected_df : dataframe of selected subjects with Subject and Trial columns
+        data : the rows of the master csv, see csv2data
+        aug_log (optional) : file to log the skipped augmentations to
+        speed_changes (optional) : the speed factors
+
+    returns:
+        list of (subject, trial, factor, master csv row) tuples
+    """
+    # only the original subjects are augmented, not the augmentations of a previous run
+    filtered = sorted(((int(subj), int(trial)) for subj, trial in zip(list(selected_df["Subject"]), list(selected_df["Trial"]))
+                       if str(subj).isdigit()), key=lambda x: x[1])
+
+    # the rows are not in subject order once augmentations have been appended
+    rows = {str(row[0]) : row for row in data if row}
+
+    plan = []
+    for subj, trial in filtered:
+        subj_row = rows[str(subj)]
+        hr_index = 1 if trial == 1 else 3
+        heart_rate = float(subj_row[hr_index])
+
+        for change in speed_changes:
+            labels = augmented_labels(heart_rate, change)
+            if labels is None:
+                log_str = "Not changing the speed of subject {} trial {} by factor of {}: resulting" \
+                        " heart rate would have been {}".format(subj, trial, change, heart_rate * (1/change))
+                print(log_str)
+                if aug_log is not None:
+                    aug_log.write(log_str + '\n')
+                continue
+
+            """     s   hr1  rr1  hr2  rr2   """
+            """     |    |    |    |    |    """
+            row = ["",  "",  "",  "",  ""]
+            row[0] = augmented_subject(subj, trial, change)
+            row[hr_index], row[hr_index + 1] = labels
+
+            plan.append((subj, trial, change, row))
+
+    return plan
+
+
+def write_augmented_csvs(master_csv, selected, rows):
+    """
+    add the augmented subjects to the master and selects csvs, replacing
+    the rows a previous run left for them, and write both atomically
+
+    args:
+        master_csv : the csv containing all of the subject data
+        selected : the csv of selected subjects
+        rows : list of (master csv row, trial) of the finished augmentations
+    """
+    data, header = csv2data(master_csv)
+    new_subjects = set(row[0] for row, _ in rows)
+
+    master_rows = [row for row in data if row and row[0] not in new_subjects]
+    master_rows.extend(row for row, _ in rows)
+    write_csv_atomic(master_csv, master_rows, header=header)
+
+    selected_df = pd.read_csv(selected)
+    selected_df = selected_df[~selected_df["Subject"].astype(str).isin(new_subjects)]
+    selected_df = pd.concat([selected_df, pd.DataFrame([[row[0], trial] for row, trial in rows], columns=selected_df.columns)],
+                            ignore_index=True)
+
+    temp = selected + ".tmp"
+    selected_df.to_csv(temp, encoding='utf-8', index=False)
+    os.replace(temp, selected)
+
+
+def resample_indices(num_frames, factor, fps=30, max_duration=30, blend=False):
+    """
+    the source frames of each frame of a trial played at factor, trimmed
+    around the center to at most max_duration seconds like transform_video
+
+    args:
+        num_frames : the number of frames in the trial
+        factor : the speed factor
+        fps (optional) : the frame rate of the trial
+        max_duration (optional) : the longest the output may be, in seconds
+        blend (optional) : blend the two nearest source frames instead of
+                           taking the nearest one
+
+    returns:
+        list of (first, second, weight), output frame j being
+        (1 - weight) * frames[first] + weight * frames[second]
+    """
+    if factor <= 0:
+        raise ValueError("the speed factor should be > 0, got %s" % str(factor))
+
+    length = int(num_frames * factor)
+    keep = min(length, int(max_duration * fps))
+    offset = (length - keep) // 2
+
+    indices = []
+    for j in range(offset, offset + keep):
+        position = min(j / factor, num_frames - 1)
+        if blend:
+            first = int(position)
+            indices.append((first, min(first + 1, num_frames - 1), position - first))
+        else:
+            nearest = min(int(round(position)), num_frames - 1)
+            indices.append((nearest, nearest, 0.))
+
+    return indices
+
+
+def resample_frame_dir(frame_dir, output_dir, factor, width=None, height=None, blend=False, max_duration=30,
+                       writers=2, png_compression=3, suppress=False):
+    """
+    Write a trial of extracted frames as it would look played at factor,
+    without going back to the video: frame indices are resampled (optionally
+    blending neighbouring frames) and only the final, optionally resized,
+    frames are written as frame-%05d.png along with a sidecar.
+
+    args:
+        frame_dir : the trial's frame directory
+        output_dir : the augmented trial's frame directory
+        factor : the speed factor, < 1 speeds the trial up and > 1 slows it down
+        width, height (optional) : resize to this resolution, None keeps the original
+        blend (optional) : linearly blend the two nearest source frames
+        max_duration (optional) : the longest the output may be, in seconds
+        writers (optional) : number of threads encoding and writing frames
+        png_compression (optional) : PNG compression level, 0-9
+        suppress (optional) : boolean to suppress messages or not
+
+    returns:
+        the names of the written frames
+    """
+    if not os.path.isdir(frame_dir):
+        raise FileNotFoundError("provided directory |%s| not found" % frame_dir)
+
+    frames, fps = trial_frame_names(frame_dir)
+    if len(frames) == 0:
+        raise ValueError("no frames in %s" % frame_dir)
+
+    check_exists_create_if_not(output_dir, suppress=True)
+
+    if not suppress:
+        print("[resample_frame_dir]-- %s -> %s (factor %s)" % (frame_dir, output_dir, str(factor)))
+
+    cache = {}
+    def load(index):
+        if index not in cache:
+            # consecutive output frames only ever look back one source frame
+            for stale in [i for i in cache if i < index - 1]:
+                del cache[stale]
+
+            image = cv2.imread(os.path.join(frame_dir, frames[index]))
+            if image is None:
+                raise IOError("could not read %s" % os.path.join(frame_dir, frames[index]))
+            if width is not None and height is not None:
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            cache[index] = image
+
+        return cache[index]
+
+    names = []
+    with FrameWriter(workers=writers, compression=png_compression) as writer:
+        for j, (first, second, weight) in enumerate(resample_indices(len(frames), factor, fps=fps,
+                                                                     max_duration=max_duration, blend=blend)):
+            image = load(first)
+            if weight > 0:
+                image = cv2.addWeighted(image, 1 - weight, load(second), weight, 0)
+
+            name = "frame-%05d.png" % j
+            writer.write(os.path.join(output_dir, name), image)
+            names.append(name)
+
+    if not names:
+        raise ValueError("%d frames of %s at factor %s leave no frames to write" 
+                         % (len(frames), frame_dir, str(factor)))
+
+    out_height, out_width = image.shape[:2]
+    metadata = dict(read_trial_metadata(frame_dir) or {})
+
+    # the quality statistics describe the source frames, not the resampled ones
+    metadata.pop("quality", None)
+    metadata.update({"fps": fps,
+                     "frame_count": len(names),
+                     "width": out_width,
+                     "height": out_height,
+                     "frames": names,
+                     "timestamps": [j * 1000. / fps for j in range(len(names))],
+                     "speed_factor": factor,
+                     "augmented_from": frame_dir})
+    write_trial_metadata(output_dir, metadata)
+
+    return names
@@ -0,0 +1,113 @@
+"""
+frame_writer.py is a small pool of threads that encode and write frames
+handed to it by a decode loop, so decoding the next frame overlaps with
+encoding the last ones. OpenCV releases the GIL while encoding, so threads
+are enough.
+"""
+
+import time
+import threading
+import cv2
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class FrameWriter():
+    """
+    write frames in the background with a bounded queue between the
+    producer (the decode loop) and the writer threads
+
+    usage example:
+        with FrameWriter(workers=2, compression=3) as writer:
+            for index, image in iter_video_frames(movie):
+                writer.write("frame-%05d.png" % index, image)
+        print(writer.encode_time, writer.blocked_time)
+
+    args:
+        workers : the number of writer threads
+        compression : PNG compression level, 0 (fastest, largest) to 9 (slowest, smallest)
+        queue_size : the number of frames that may wait to be written; write() blocks
+                     once it is full, which bounds memory when encoding is the bottleneck
+    """
+    def __init__(self, workers=2, compression=3, queue_size=32):
+        if workers < 1:
+            raise ValueError("FrameWriter needs at least one worker, got %d" % workers)
+
+        if compression < 0 or compression > 9:
+            raise ValueError("PNG compression should be in [0, 9], got %d" % compression)
+
+        self.params = [cv2.IMWRITE_PNG_COMPRESSION, compression]
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.error = None
+        self.written = 0
+
+        # seconds spent encoding (summed over the workers) and seconds the
+        # producer spent waiting for room in the queue
+        self.encode_time = 0.
+        self.blocked_time = 0.
+
+        self.threads = [threading.Thread(target=self._work) for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            pth, image = item
+            if self.error is not None:
+                continue
+
+            start = time.time()
+            try:
+                if not cv2.imwrite(pth, image, self.params):
+                    raise IOError("could not write %s" % pth)
+            except Exception as e:
+                self.error = e
+                continue
+
+            with self.lock:
+                self.encode_time += time.time() - start
+                self.written += 1
+
+    def write(self, pth, image):
+        """
+        queue a frame to be written to pth, blocking while the queue is full
+        """
+        if self.error is not None:
+            raise self.error
+
+        start = time.time()
+        self.queue.put((pth, image))
+        self.blocked_time += time.time() - start
+
+    def close(self):
+        """
+        wait for every queued frame to be written and stop the workers
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.close()
+        except Exception:
+            # don't mask an error raised inside the with block
+            if exc_type is None:
+                raise
@@ -0,0 +1,272 @@
+"""
+metadata.py reads and writes the small json sidecars that describe
+videos and the frame directories extracted from them, so that later
+stages never have to re-probe a video or list a directory to learn its
+frame rate, length or resolution.
+
+    data/S0001/Trial1.MOV       ->  data/S0001/Trial1.MOV.json (only when asked to persist)
+    frames/S0001/Trial1_frames  ->  frames/S0001/Trial1_frames.json
+
+The "frames" of a trial sidecar are its frame index, the frame names in
+temporal order. Partitioned trials also index each partition directory
+("partitions"), and the flow_h/flow_v directories of a trial with optical
+flow have sidecars of their own (flow_h.json, flow_v.json), so frame_index
+never has to list a directory that has a sidecar.
+"""
+
+import os
+import json
+import threading
+import cv2
+
+from we_panic_utils.basic_utils.basics import natural_key
+
+_cache = {}
+_index_cache = {}
+_video_cache = {}
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+FLOW_DIRS = ("flow_h", "flow_v")
+
+
+def metadata_path(path):
+    """
+    the sidecar of a video file or frame directory
+    """
+    return path.rstrip("/") + ".json"
+
+
+def _read_json(pth):
+    """
+    read a json file, memoized on its modification time
+    """
+    try:
+        mtime = os.path.getmtime(pth)
+    except OSError:
+        return None
+
+    cached = _cache.get(pth)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(pth, "r") as f:
+        data = json.load(f)
+
+    _cache[pth] = (mtime, data)
+    return data
+
+
+def _write_json(pth, data):
+    """
+    write a json file atomically
+    """
+    # unique per writer, so concurrent writers never interleave in the same temp file
+    temp = "%s.%d.%d.tmp" % (pth, os.getpid(), threading.get_ident())
+    with open(temp, "w") as f:
+        json.dump(data, f)
+    os.replace(temp, pth)
+
+
+def read_trial_metadata(frame_dir):
+    """
+    read the sidecar of a frame directory
+
+    args:
+        frame_dir : the frame directory, e.g frames/S0001/Trial1_frames
+
+    returns:
+        the metadata dict, or None if the directory has no sidecar
+    """
+    return _read_json(metadata_path(frame_dir))
+
+
+def write_trial_metadata(frame_dir, metadata):
+    """
+    write the sidecar of a frame directory
+
+    args:
+        frame_dir : the frame directory
+        metadata : dict describing the frames, see trial_metadata
+    """
+    _write_json(metadata_path(frame_dir), metadata)
+
+
+def partition_index(frames):
+    """
+    the frames of each partition of a partitioned trial, in temporal order
+
+    args:
+        frames : the trial's frame names, e.g ["0/frame0.png", "0/frame1.png", "1/frame0.png"]
+
+    returns:
+        dict of partition -> frame names, e.g {"0": ["frame0.png", "frame1.png"], "1": ["frame0.png"]},
+        empty if the trial is not partitioned
+    """
+    partitions = {}
+    for frame in frames:
+        partition, name = os.path.split(frame)
+        if partition:
+            partitions.setdefault(partition, []).append(name)
+
+    return partitions
+
+
+def index_metadata(frames, width=None, height=None):
+    """
+    the sidecar of a frame directory that was not extracted by this module,
+    holding its frame index and a frame rate estimated from its length
+    """
+    #rough estimation to determine frame rate
+    return {"fps": 60 if len(frames) > 1600 else 30,
+            "frame_count": len(frames),
+            "width": width,
+            "height": height,
+            "frames": frames,
+            "partitions": partition_index(frames)}
+
+
+def frame_index(frame_dir):
+    """
+    the frame names of a frame directory in temporal order: a trial's or a
+    flow_h/flow_v directory's from its sidecar, a partition's from the sidecar
+    of the trial it is in (as are the flows of trials indexed before flow
+    directories had sidecars), and otherwise the images of the directory in
+    natural order (frame2.png before frame10.png), memoized until it changes
+
+    args:
+        frame_dir : a trial, partition or flow directory
+
+    returns:
+        the frame names, relative to frame_dir
+    """
+    frame_dir = frame_dir.rstrip("/")
+    metadata = read_trial_metadata(frame_dir)
+    if metadata is not None and "frames" in metadata:
+        return metadata["frames"]
+
+    parent, name = os.path.split(frame_dir)
+    parent_metadata = read_trial_metadata(parent)
+    if parent_metadata is not None:
+        if name in FLOW_DIRS and "flows" in parent_metadata:
+            return parent_metadata["flows"]
+        if name in parent_metadata.get("partitions", {}):
+            return parent_metadata["partitions"][name]
+
+    mtime = os.path.getmtime(frame_dir)
+    cached = _index_cache.get(frame_dir)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    frames = sorted((f for f in os.listdir(frame_dir) if f.lower().endswith(IMAGE_EXTENSIONS)), key=natural_key)
+    _index_cache[frame_dir] = (mtime, frames)
+    return frames
+
+
+def trial_metadata(source, info, frames, fps, width, height, clip, start, end, indices=None, timestamps=None):
+    """
+    build the sidecar for a directory of extracted frames
+
+    args:
+        source : the video the frames came from
+        info : video_info(source)
+        frames : the frame file names, in temporal order
+        fps : the frame rate of the extracted frames
+        width, height : the resolution of the extracted frames
+        clip : the seconds clipped off of each end of the video
+        start, end : the timestamps (ms) of the clipped video
+        indices : the index of each frame in the resampled video, read
+                  from the frame names if not given
+        timestamps : the timestamp (ms) the decoder reported for each frame,
+                     placed on the nominal grid of fps from start if not given
+
+    returns:
+        the metadata dict
+    """
+    if timestamps is None:
+        period = 1000. / fps
+        if indices is None:
+            indices = [_frame_number(f) for f in frames]
+        timestamps = [start + i * period for i in indices]
+
+    return {"source": source,
+            "source_fps": info["fps"],
+            "source_frame_count": info["frame_count"],
+            "source_width": info["width"],
+            "source_height": info["height"],
+            "fps": fps,
+            "frame_count": len(frames),
+            "width": width,
+            "height": height,
+            "clip": clip,
+            "trim_start": start,
+            "trim_end": end,
+            "frames": frames,
+            "timestamps": list(timestamps)}
+
+
+def _frame_number(name):
+    """
+    frame-00012.png -> 12, frame12.png -> 12
+    """
+    digits = "".join(c for c in os.path.splitext(name)[0] if c.isdigit())
+    return int(digits) if digits else 0
+
+
+def resized_metadata(metadata, frames, width, height):
+    """
+    the sidecar of a resized copy of a frame directory
+    """
+    resized = dict(metadata)
+    resized["frames"] = frames
+    resized["frame_count"] = len(frames)
+    resized["width"] = width
+    resized["height"] = height
+
+    return resized
+
+
+def video_info(filename, persist=False):
+    """
+    the frame rate, frame count, resolution and duration of a video, read
+    from its sidecar when it is up to date and probed in process with
+    OpenCV (no ffprobe) otherwise, memoized until the video changes
+
+    args:
+        filename : the video file
+        persist : write the sidecar next to the video after probing; off by
+                  default, the movie directories may be read only or shared
+
+    returns:
+        dict with keys fps, frame_count, width, height and duration (ms)
+    """
+    pth = metadata_path(filename)
+    mtime = os.path.getmtime(filename)
+    if os.path.exists(pth) and os.path.getmtime(pth) >= mtime:
+        return _read_json(pth)
+
+    cached = _video_cache.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    vidcap = cv2.VideoCapture(filename)
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    info = {"fps": fps,
+            "frame_count": int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            "width": int(vidcap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(vidcap.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+    vidcap.release()
+
+    if fps <= 0:
+        raise ValueError("could not determine the frame rate of %s" % filename)
+
+    info["duration"] = info["frame_count"] * 1000. / fps
+    _video_cache[filename] = (mtime, info)
+
+    if persist:
+        try:
+            _write_json(pth, info)
+        except OSError:
+            pass
+
+    return info
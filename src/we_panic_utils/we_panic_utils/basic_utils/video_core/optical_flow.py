@@ -3,22 +3,25 @@ import numpy as np
 import pickle
 from PIL import Image
 import os
-import glob
 import gc
 import sys
 from ..basics import check_exists_create_if_not 
+from .metadata import frame_index, write_trial_metadata
+
+def _rgb(frame):
+    # a frame path, or an RGB frame already in memory (e.g from a FrameStore)
+    return frame if isinstance(frame, np.ndarray) else np.array(Image.open(frame))
 
 def optical_flow_of_first_and_rest(frames):
     count = 0
-    frame1 = Image.open(frames[0])
     
     #only compare the optical flow of first image to every other image
-    prvs = cv2.cvtColor(np.array(frame1), cv2.COLOR_RGB2GRAY)
+    prvs = cv2.cvtColor(_rgb(frames[0]), cv2.COLOR_RGB2GRAY)
     
     all_hor = []
     all_ver = []
     for pth in frames[1:]:
-        next_ = cv2.cvtColor(np.array(Image.open(pth)), cv2.COLOR_RGB2GRAY)
+        next_ = cv2.cvtColor(_rgb(pth), cv2.COLOR_RGB2GRAY)
         
         flow = cv2.calcOpticalFlowFarneback(prvs, next_, None, 0.6, 3, 10, 3, 5, 1.2, 0)
         horz = cv2.normalize(flow[..., 0], None, 0, 255, cv2.NORM_MINMAX)
@@ -34,7 +37,8 @@ def write_optical_flow(path, width):
 
     try:
         all_horz, all_vert = [], []
-        frame_paths = sorted(glob.glob(path + "/*"))
+        frame_paths = [os.path.join(path, f) for f in frame_index(path)]
+        flows = []
 
         frame1 = Image.open(frame_paths[0])
 
@@ -64,11 +68,21 @@ def write_optical_flow(path, width):
                 
                 cv2.imwrite(os.path.join(flow_h, fname), horz)
                 cv2.imwrite(os.path.join(flow_v, fname), vert)
+                flows.append(fname)
                 
                 prvs = next_
                 
         cv2.destroyAllWindows()
 
+        # flows are only written every width frames, index them in their own sidecars
+        # so the trial's sidecar stays the stage's that made the frames
+        index = {"frames": flows, "frame_count": len(flows), "stride": width}
+        write_trial_metadata(flow_h, index)
+        write_trial_metadata(flow_v, index)
+
     except Exception as e:
-        print(e)
-        return count
+        # raise, so the work queue retries the trial and the stage cache doesn't store a partial run
+        print("[write_optical_flow] %s failed after %d frames: %s" % (path, count, e))
+        raise
+
+    return count
@@ -0,0 +1,190 @@
+"""
+partitions.py describes partitions as index records over a trial's single
+sequence of frames instead of physically moving frames into 0/, 1/, ...
+directories. A record is (trial frame directory, start, length, stride):
+the partition is every stride'th frame starting at start, length frames long.
+Changing num_seconds, trims or overlap only means recomputing the records.
+"""
+
+import os
+import csv
+
+from .metadata import read_trial_metadata, frame_index
+from .quality import good_frames
+
+FPS = 30
+
+PARTITION_HEADER = ["PATH", "START", "LENGTH", "STRIDE"]
+
+MANIFEST_HEADER = ["SLUG", "PATH"]
+
+
+def trial_frame_names(frame_dir):
+    """
+    the frame names of a trial directory in temporal order, from
+    its metadata sidecar if it has one
+    """
+    metadata = read_trial_metadata(frame_dir)
+    if metadata is not None:
+        return metadata["frames"], metadata["fps"]
+
+    frames = frame_index(frame_dir)
+
+    #rough estimation to determine frame rate
+    return frames, (60 if len(frames) > 1600 else 30)
+
+
+def trial_partitions(trial_dir):
+    """
+    the partition directories of a partitioned trial, from its sidecar if
+    it has one, its numbered subdirectories otherwise
+
+    returns:
+        a list of (partition, partition directory), in order
+    """
+    metadata = read_trial_metadata(trial_dir)
+    if metadata is not None and "partitions" in metadata:
+        partitions = list(metadata["partitions"])
+    else:
+        partitions = [p for p in os.listdir(trial_dir) if p.isdigit() and os.path.isdir(os.path.join(trial_dir, p))]
+
+    return [(int(p), os.path.join(trial_dir, p)) for p in sorted(partitions, key=int)]
+
+
+def partition_records(frame_dir, num_seconds=2, front_trim=60, end_trim=60, overlap=0.,
+                      capacity_tolerance=1.0, fps=FPS, quality_thresholds=None, min_good_fraction=1.):
+    """
+    Compute the partitions of a trial as index records, the same windows
+    partition_frame_dir would create but without touching any frames, and
+    optionally overlapping.
+
+    args:
+        frame_dir : directory containing the trial's frames
+        num_seconds (optional) : the number of seconds that make up each partition
+        front_trim (optional) : the number of frames to ignore from beginning of directory
+        end_trim (optional) : the number of frames to ignore from end of directory
+        overlap (optional) : fraction of each partition shared with the next, in [0, 1)
+        capacity_tolerance (optional) : how full an acceptable last partition must be
+        fps (optional) : the frame rate of the partitions
+        quality_thresholds (optional) : skip partitions in which less than min_good_fraction of
+                                        the frames pass these thresholds (see quality.good_frames),
+                                        using the statistics in the trial's sidecar
+        min_good_fraction (optional) : the fraction of good frames a partition needs
+
+    returns:
+        a list of dicts with keys path, start, length and stride
+    """
+    if not os.path.isdir(frame_dir):
+        raise FileNotFoundError("provided directory |%s| not found" % frame_dir)
+    if front_trim < 0 or end_trim < 0 or num_seconds <= 0:
+        raise ValueError("num_seconds, front_trim and end_trim must be positive")
+    if overlap < 0 or overlap >= 1:
+        raise ValueError("overlap should be in [0, 1), got %f" % overlap)
+
+    frames, source_fps = trial_frame_names(frame_dir)
+
+    stride = max(1, int(round(source_fps / fps)))
+    length = int(num_seconds * fps)
+    span = length * stride
+    hop = max(stride, int(round(span * (1 - overlap))) // stride * stride)
+
+    end = len(frames) - end_trim
+    records = []
+    start = front_trim
+
+    while start + span <= end:
+        records.append({"path": frame_dir, "start": start, "length": length, "stride": stride})
+        start += hop
+
+    #If the leftover frames are acceptably full, keep them as a shorter partition
+    left_over = (end - start + stride - 1) // stride
+    if left_over > 0 and left_over / length >= capacity_tolerance:
+        records.append({"path": frame_dir, "start": start, "length": left_over, "stride": stride})
+
+    metadata = read_trial_metadata(frame_dir)
+    if quality_thresholds is not None and metadata is not None and "quality" in metadata:
+        good = good_frames(metadata["quality"], quality_thresholds)
+        records = [record for record in records
+                   if good[record["start"]:record["start"] + record["length"] * record["stride"]:record["stride"]].mean()
+                   >= min_good_fraction]
+
+    return records
+
+
+def partition_frames(record):
+    """
+    the frame paths of a partition record, in temporal order
+    """
+    frames, _ = trial_frame_names(record["path"])
+    start, length, stride = int(record["start"]), int(record["length"]), int(record["stride"])
+    
+    return [os.path.join(record["path"], f) for f in frames[start:start + length * stride:stride]]
+
+
+def write_partition_records(records, csv_path, extra_header=None, extra_rows=None):
+    """
+    write partition records to a csv with the columns PATH, START, LENGTH, STRIDE
+    followed by any extra columns
+
+    args:
+        records : the partition records
+        csv_path : the output csv
+        extra_header (optional) : names of extra columns
+        extra_rows (optional) : one list of extra values per record
+    """
+    header = PARTITION_HEADER + (extra_header or [])
+    with open(csv_path, "w") as csv_out:
+        writer = csv.writer(csv_out)
+        writer.writerow(header)
+        for i, record in enumerate(records):
+            row = [record["path"], record["start"], record["length"], record["stride"]]
+            if extra_rows is not None:
+                row.extend(extra_rows[i])
+            writer.writerow(row)
+
+
+def read_partition_records(csv_path):
+    """
+    read the partition records (and any extra columns) written by write_partition_records
+
+    returns:
+        a list of dicts, keyed by the lowercased column names
+    """
+    with open(csv_path, "r") as csv_in:
+        reader = csv.DictReader(csv_in)
+        return [{key.lower(): value for key, value in row.items()} for row in reader]
+
+
+def write_slug_manifest(slugs, csv_path):
+    """
+    write a consolidation manifest mapping each S%04d_t%d_p%d slug to the
+    partition directory it names, in place of copying the partitions into
+    a consolidated directory; written atomically
+
+    args:
+        slugs : list of (slug, partition directory)
+        csv_path : the output csv
+    """
+    temp = "%s.%d.tmp" % (csv_path, os.getpid())
+    with open(temp, "w", newline="") as csv_out:
+        writer = csv.writer(csv_out)
+        writer.writerow(MANIFEST_HEADER)
+        writer.writerows(slugs)
+
+    os.replace(temp, csv_path)
+
+
+def read_slug_manifest(csv_path):
+    """
+    read a manifest written by write_slug_manifest
+
+    returns:
+        dict of slug -> partition directory
+    """
+    with open(csv_path, "r") as csv_in:
+        reader = csv.reader(csv_in)
+        header = next(reader)
+        if [column.upper() for column in header] != MANIFEST_HEADER:
+            raise ValueError("%s is not a slug manifest, its columns are %s" % (csv_path, str(header)))
+
+        return {slug: path for slug, path in reader}
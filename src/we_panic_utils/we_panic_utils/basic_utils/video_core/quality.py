@@ -0,0 +1,131 @@
+"""
+quality.py computes cheap per-frame quality statistics while a video is
+decoded, so that dark frames, saturated frames and frames where the finger
+lifts off the lens can be skipped by partitioning and the training samplers
+without ever loading them.
+
+The statistics are kept in the trial's sidecar, aligned with its frames:
+
+    "quality": {"mean": [...],        mean grey intensity, 0-255
+                "saturation": [...],  fraction of pixels clipped at 255 in any channel
+                "difference": [...]}  mean absolute grey difference to the previous
+                                      frame (null for the first frame of a segment)
+"""
+
+import cv2
+import numpy as np
+
+from .metadata import read_trial_metadata
+
+# every SUBSAMPLE'th row and column is enough for these statistics
+SUBSAMPLE = 4
+SATURATION_LEVEL = 250
+
+QUALITY_THRESHOLDS = {"min_mean": 20.,
+                      "max_saturation": 0.5,
+                      "max_difference": 40.}
+
+
+class QualityTracker():
+    """
+    accumulate the quality statistics of frames as they are decoded
+
+    usage example:
+        tracker = QualityTracker()
+        for index, image in decode_video(movie):
+            tracker.add(index, image)
+        metadata["quality"] = tracker.select(indices)
+    """
+    def __init__(self):
+        self.stats = {}
+        self.previous = None
+
+    def add(self, index, image):
+        """
+        record the statistics of the frame at index; frames must be added in temporal order
+        """
+        small = image[::SUBSAMPLE, ::SUBSAMPLE]
+        grey = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+
+        difference = None
+        if self.previous is not None:
+            difference = float(np.abs(grey - self.previous).mean())
+
+        saturation = float((small >= SATURATION_LEVEL).any(axis=2).mean())
+        self.stats[index] = (float(grey.mean()), saturation, difference)
+        self.previous = grey
+
+    def select(self, indices):
+        """
+        the statistics of the frames at indices, in the sidecar layout
+        """
+        selected = [self.stats[i] for i in indices]
+        return {"mean": [s[0] for s in selected],
+                "saturation": [s[1] for s in selected],
+                "difference": [s[2] for s in selected]}
+
+
+def merge_quality(parts):
+    """
+    concatenate the sidecar quality of consecutive segments
+    """
+    return {key: [value for part in parts for value in part[key]] for key in ("mean", "saturation", "difference")}
+
+
+def good_frames(quality, thresholds=None):
+    """
+    which frames pass the thresholds
+
+    args:
+        quality : the "quality" of a sidecar
+        thresholds (optional) : dict with min_mean, max_saturation and max_difference,
+                                missing keys fall back to QUALITY_THRESHOLDS
+
+    returns:
+        boolean numpy array, one per frame
+    """
+    limits = dict(QUALITY_THRESHOLDS)
+    limits.update(thresholds or {})
+
+    mean = np.asarray(quality["mean"], dtype=np.float32)
+    saturation = np.asarray(quality["saturation"], dtype=np.float32)
+    difference = np.asarray([0. if d is None else d for d in quality["difference"]], dtype=np.float32)
+
+    return (mean >= limits["min_mean"]) & (saturation <= limits["max_saturation"]) \
+        & (difference <= limits["max_difference"])
+
+
+def good_window_starts(good, length, stride=1, min_good_fraction=1.):
+    """
+    the starts of the windows of length frames, taking every stride'th frame,
+    in which at least min_good_fraction of the frames are good
+
+    args:
+        good : boolean array from good_frames
+        length : the number of frames in a window
+        stride (optional) : the step between the frames of a window
+        min_good_fraction (optional) : the fraction of good frames a window needs
+
+    returns:
+        numpy array of the acceptable start indices
+    """
+    span = (length - 1) * stride + 1
+    if len(good) < span:
+        return np.zeros(0, dtype=np.int64)
+
+    starts = np.arange(len(good) - span + 1)
+    counts = np.zeros(len(starts), dtype=np.int64)
+    for j in range(length):
+        counts += good[starts + j * stride]
+
+    return starts[counts >= min_good_fraction * length]
+
+
+def trial_quality(frame_dir):
+    """
+    the quality statistics of a trial from its sidecar, or None if it has none
+    """
+    metadata = read_trial_metadata(frame_dir)
+    if metadata is None:
+        return None
+    return metadata.get("quality")
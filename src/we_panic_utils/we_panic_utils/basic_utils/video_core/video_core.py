@@ -5,25 +5,42 @@ for video processing.
 from PIL import Image
 import sys
 import os
+import time
+import shutil
 import cv2
-from we_panic_utils.basic_utils.basics import check_exists_create_if_not 
+import numpy as np
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from we_panic_utils.basic_utils.basics import check_exists_create_if_not, parallel_map
+from .frame_writer import FrameWriter
+from .metadata import video_info, read_trial_metadata, write_trial_metadata, trial_metadata, resized_metadata
+from .metadata import frame_index, partition_index, index_metadata, metadata_path
+from .quality import QualityTracker, merge_quality, good_frames
 
 import subprocess
+import tempfile
 FPS = 30
 
-BASH_COMMAND = 'ffmpeg -i {} -q:v 1 -vf setpts={}*PTS {}' 
 GET_DURATION_COMMAND = "ffprobe -v error -show_entries format=duration \
         -of default=noprint_wrappers=1:nokey=1 {}"
-SPLIT_COMMAND = "ffmpeg -i {} -vcodec copy -acodec copy -ss {} -t {} {}"
+PROBE_COMMAND = "ffprobe -v error -select_streams v:0 \
+        -show_entries stream=width,height,avg_frame_rate:stream_tags=rotate:stream_side_data=rotation:format=duration \
+        -of default=noprint_wrappers=1 {}"
+KEYFRAMES_COMMAND = "ffprobe -v error -select_streams v:0 -skip_frame nokey \
+        -show_entries frame=best_effort_timestamp_time -of csv=p=0 {}"
 
-HALVE_COMMAND = "ffmpeg -i {} -vcodec copy -acodec copy \
-    -ss {} -t {} {}"
+# extensions of the original phone videos (.MOV) and of the proxies made from them
+VIDEO_EXTENSIONS = (".mov", ".mkv")
+
+# all intra, audio free codecs for the low resolution proxies, with their container extension
+PROXY_CODECS = {"mjpeg": (["-c:v", "mjpeg", "-q:v", "2"], ".MOV"),
+                "ffv1": (["-c:v", "ffv1", "-level", "3", "-g", "1"], ".mkv")}
 
 
 def video_file_exists(filename):
     """
     Return whether or not this file exists and is a
-    video file (i.e, ends in [.MOV | .mov]
+    video file (i.e, ends in [.MOV | .mov | .mkv]
 
     args:
         --> filename : the file to test
@@ -34,7 +51,7 @@ def video_file_exists(filename):
         --> the filename minus the extension and parent dirs
     """
     does_exist = os.path.exists(filename)
-    is_vid = filename.endswith(".mov") or filename.endswith(".MOV")
+    is_vid = filename.lower().endswith(VIDEO_EXTENSIONS)
 
     if does_exist and is_vid:
         if len(filename.split("/")) > 1:
@@ -51,7 +68,7 @@ def video_file_exists(filename):
 
     output_string = []
     if not is_vid:
-        output_string.append("%s isn't a .MOV or .mov" % filename)
+        output_string.append("%s isn't a .MOV, .mov or .mkv" % filename)
 
     if not does_exist:
         output_string.append("%s not found" % filename)
@@ -60,7 +77,475 @@ def video_file_exists(filename):
     return False, error, None
 
 
-def video_file_to_frames(filename, output_dir=None, suppress=False, clip=2):
+def _target_slot(timestamp, start, source_fps, target_fps):
+    """
+    Decide which output frame a source frame at `timestamp` (ms) becomes
+    when resampling from source_fps to target_fps.
+
+    The output timeline is cut into slots of 1000/target_fps ms starting at `start`
+    (shifted by half a source frame so that jitter in the reported timestamps never
+    lands on a slot boundary), and a source frame is kept only if it is the first
+    frame to fall in its slot.
+
+    returns:
+        the index of the output frame, or None if this frame should be dropped
+    """
+    period = 1000. / source_fps
+    offset = timestamp - start + period / 2.
+
+    if target_fps is None or target_fps >= round(source_fps):
+        return int(offset // period)
+
+    slot = int(offset * target_fps // 1000.)
+    previous = int((offset - period) * target_fps // 1000.)
+
+    return slot if slot > previous else None
+
+
+def _frame_timestamp(vidcap, index, source_fps):
+    """
+    the timestamp (ms) of the most recently grabbed frame, falling back
+    to the nominal timestamp for containers that don't report one
+    """
+    timestamp = vidcap.get(cv2.CAP_PROP_POS_MSEC)
+    if timestamp > 0 or index == 0:
+        return timestamp
+
+    return index * 1000. / source_fps
+
+
+def _clip_bounds(source_fps, total, clip):
+    """
+    the index of the first frame kept after clipping `clip` seconds off the front
+    of a video, and the [start, end) timestamps (ms) of the clipped video
+    """
+    first = int(round(source_fps * clip))
+    start = first * 1000. / source_fps
+    end = (total - source_fps * clip) * 1000. / source_fps if total > 0 else float("inf")
+
+    return first, start, end
+
+
+def iter_video_frames(filename, clip=2, target_fps=FPS, segment=None, suppress=True, timestamps=None):
+    """
+    Decode a video file and yield its frames one at a time, after clipping
+    `clip` seconds off of each end and resampling to target_fps.
+
+    The clipped head is skipped by seeking, and frames that are dropped by the
+    resampling (e.g, every other frame of a 60 fps video) are only grabbed,
+    never retrieved, so they are not converted to images.
+
+    args:
+        --> filename : video file to decode
+        --> clip : number of seconds to clip off of each end
+        --> target_fps : the frame rate to resample to, None to keep every frame
+        --> segment : optional (start, end) timestamps (ms) restricting decoding to
+                      one piece of the video; indices stay relative to the whole
+                      clipped video so segments can be decoded independently
+        --> suppress : boolean to suppress messages or not
+        --> timestamps : optional dict filled with the timestamp (ms) the container
+                         reports for each yielded frame, by index
+
+    yields:
+        --> (index, image) : the index of the frame in the resampled video and
+                             the BGR image as a numpy array
+    """
+    vidcap = cv2.VideoCapture(filename)
+    source_fps = vidcap.get(cv2.CAP_PROP_FPS)
+    total = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    if source_fps <= 0:
+        vidcap.release()
+        raise ValueError("could not determine the frame rate of %s" % filename)
+
+    if not suppress:
+        print("[iter_video_frames]-- decoding %d fps video with %d frames at %s fps" 
+              % (round(source_fps), total, str(target_fps or round(source_fps))))
+
+    count, start, end = _clip_bounds(source_fps, total, clip)
+    lower, upper = start, end
+
+    if segment is not None:
+        lower, upper = max(start, segment[0]), min(end, segment[1])
+        count = int(round(lower * source_fps / 1000.))
+
+    # skip the clipped head (or everything before this segment) without decoding it to images
+    if segment is not None and lower > 0:
+        vidcap.set(cv2.CAP_PROP_POS_MSEC, lower)
+
+    elif count > 0:
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES, count)
+
+    half_period = 500. / source_fps
+
+    while vidcap.grab():
+        timestamp = _frame_timestamp(vidcap, count, source_fps)
+        count += 1
+
+        if timestamp + half_period < lower:
+            continue
+
+        if timestamp + half_period >= upper:
+            break
+
+        index = _target_slot(timestamp, start, source_fps, target_fps)
+        if index is None:
+            continue
+
+        success, image = vidcap.retrieve()
+        if not success:
+            break
+
+        if timestamps is not None:
+            timestamps[index] = timestamp
+        yield index, image
+
+    vidcap.release()
+
+
+def probe_video(filename):
+    """
+    read the width, height, frame rate and duration of a video with ffprobe
+
+    returns:
+        dict with keys width, height, fps, duration (ms) and rotation (degrees);
+        width and height are the displayed ones, i.e swapped for a video rotated
+        by 90 degrees like a portrait phone MOV, since ffmpeg autorotates
+    """
+    command = PROBE_COMMAND.format(filename)
+    p = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+
+    if p.returncode != 0:
+        raise ValueError("ffprobe failed on %s: %s" % (filename, err.decode().strip()))
+
+    fields = dict(line.split("=", 1) for line in out.decode().splitlines() if "=" in line)
+    num, _, den = fields["avg_frame_rate"].partition("/")
+
+    # older ffmpegs report the rotation as a stream tag, newer ones as display matrix side data
+    rotation = int(float(fields.get("TAG:rotate") or fields.get("rotation") or 0))
+    width, height = int(fields["width"]), int(fields["height"])
+    if rotation % 180:
+        width, height = height, width
+
+    return {"width": width,
+            "height": height,
+            "fps": float(num) / float(den or 1),
+            "duration": float(fields["duration"]) * 1000.,
+            "rotation": rotation}
+
+
+def iter_ffmpeg_frames(filename, clip=2, target_fps=FPS, segment=None, size=None, suppress=True,
+                       timestamps=None):
+    """
+    Decode a video file by piping raw frames out of ffmpeg, yielding the same
+    (index, image) pairs as iter_video_frames.
+
+    Trimming, frame rate selection and scaling all happen inside ffmpeg's filter
+    graph, so full resolution frames never reach python. Frames are read straight
+    off the pipe into numpy buffers.
+
+    args:
+        --> filename : video file to decode
+        --> clip : number of seconds to clip off of each end
+        --> target_fps : the frame rate to resample to, None to keep every frame
+        --> segment : optional (start, end) timestamps (ms), see iter_video_frames
+        --> size : optional (width, height) to scale the frames to
+        --> suppress : boolean to suppress messages or not
+        --> timestamps : optional dict filled with the timestamp (ms) of each yielded
+                         frame, by index (the fps filter emits frames on an exact grid)
+
+    yields:
+        --> (index, image) : the index of the frame in the resampled video and
+                             the BGR image as a numpy array
+    """
+    info = probe_video(filename)
+    width, height = size if size is not None else (info["width"], info["height"])
+    fps = target_fps or info["fps"]
+
+    start, end = clip * 1000., info["duration"] - clip * 1000.
+    lower, upper = start, end
+    if segment is not None:
+        lower, upper = max(start, segment[0]), min(end, segment[1])
+
+    if upper <= lower:
+        return
+
+    filters = []
+    if target_fps is not None:
+        filters.append("fps=%s" % str(target_fps))
+    if size is not None:
+        filters.append("scale=%d:%d:flags=area" % (width, height))
+
+    # bgr24 rather than rgb24 so the frames can go straight to cv2 like iter_video_frames'
+    command = ["ffmpeg", "-v", "error", "-ss", "%.3f" % (lower / 1000.), "-i", filename,
+               "-t", "%.3f" % ((upper - lower) / 1000.), "-an"]
+    if filters:
+        command.extend(["-vf", ",".join(filters)])
+    command.extend(["-f", "rawvideo", "-pix_fmt", "bgr24", "-"])
+
+    if not suppress:
+        print("[iter_ffmpeg_frames]-- %s" % " ".join(command))
+
+    frame_size = width * height * 3
+    index = int(round((lower - start) * fps / 1000.))
+
+    # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+    errors = tempfile.TemporaryFile()
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors, bufsize=frame_size * 4)
+    try:
+        while True:
+            image = np.empty((height, width, 3), dtype=np.uint8)
+            view = memoryview(image).cast("B")
+            
+            filled = 0
+            while filled < frame_size:
+                n = p.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+
+            if filled < frame_size:
+                break
+
+            if timestamps is not None:
+                timestamps[index] = start + index * 1000. / fps
+            yield index, image
+            index += 1
+
+        # stdout is at its end, a corrupt or unsupported video shows in the exit status
+        if p.wait() != 0:
+            errors.seek(0)
+            raise RuntimeError("ffmpeg failed decoding %s: %s" % (filename, errors.read().decode().strip()))
+
+        if filled:
+            raise RuntimeError("ffmpeg left a truncated %dx%d frame decoding %s" % (width, height, filename))
+
+    finally:
+        p.stdout.close()
+        # only still running when the caller stopped early
+        if p.poll() is None:
+            p.kill()
+        p.wait()
+        errors.close()
+
+
+DECODERS = {"opencv": iter_video_frames,
+            "ffmpeg": iter_ffmpeg_frames}
+
+
+def decode_video(filename, decoder="opencv", size=None, **kwargs):
+    """
+    yield (index, image) pairs from a video with the chosen decoder backend,
+    optionally resized to size=(width, height)
+
+    args:
+        filename : video file to decode
+        decoder : one of DECODERS ("opencv" or "ffmpeg")
+        size : optional (width, height) of the yielded frames
+        kwargs : passed on to the decoder (clip, target_fps, segment, suppress, timestamps)
+    """
+    if decoder not in DECODERS:
+        raise ValueError("unknown decoder %s, expected one of %s" % (decoder, ", ".join(DECODERS)))
+
+    if decoder == "ffmpeg":
+        for index, image in iter_ffmpeg_frames(filename, size=size, **kwargs):
+            yield index, image
+
+    else:
+        for index, image in iter_video_frames(filename, **kwargs):
+            if size is not None:
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            yield index, image
+
+
+def keyframe_timestamps(filename):
+    """
+    list the timestamps (ms) of the keyframes of a video with ffprobe
+
+    returns:
+        the sorted keyframe timestamps, or an empty list if they couldn't be read
+    """
+    command = KEYFRAMES_COMMAND.format(filename)
+    try:
+        p = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    except OSError:
+        return []
+
+    timestamps = []
+    for line in out.decode().split():
+        try:
+            timestamps.append(float(line.strip(",")) * 1000.)
+        except ValueError:
+            continue
+
+    return sorted(timestamps)
+
+
+def video_segments(filename, segments, clip=2):
+    """
+    Split the clipped portion of a video into (at most) `segments` contiguous
+    time ranges whose boundaries fall on keyframes, so that each range can be
+    seeked to exactly and decoded on its own.
+
+    args:
+        filename : the video file
+        segments : the desired number of segments
+        clip : number of seconds clipped off of each end of the video
+
+    returns:
+        a list of (start, end) timestamps in ms
+    """
+    vidcap = cv2.VideoCapture(filename)
+    source_fps = vidcap.get(cv2.CAP_PROP_FPS)
+    total = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    vidcap.release()
+
+    if source_fps <= 0 or total <= 0:
+        raise ValueError("could not determine the length of %s" % filename)
+
+    _, start, end = _clip_bounds(source_fps, total, clip)
+    keyframes = [k for k in keyframe_timestamps(filename) if start < k < end]
+
+    bounds = [start]
+    for i in range(1, segments):
+        target = start + (end - start) * i / segments
+
+        # snap to the closest keyframe, or split anywhere if there are none
+        if keyframes:
+            target = min(keyframes, key=lambda k: abs(k - target))
+
+        if target > bounds[-1]:
+            bounds.append(target)
+
+    bounds.append(end)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _write_segment(filename, output_dir, clip, target_fps, segment, decoder="opencv",
+                   writers=2, png_compression=3):
+    """
+    decode one segment of a video and write its frames, see video_file_to_frames
+
+    returns:
+        the image filenames, their quality statistics and their timestamps (ms)
+    """
+    image_names, indices, timestamps = [], [], {}
+    tracker = QualityTracker()
+    with FrameWriter(workers=writers, compression=png_compression) as writer:
+        for count, image in decode_video(filename, decoder=decoder, clip=clip, target_fps=target_fps, 
+                                         segment=segment, timestamps=timestamps):
+            pth = os.path.join(output_dir, "frame-%05d.png" % count)
+            writer.write(pth, image)
+            tracker.add(count, image)
+            image_names.append(pth)
+            indices.append(count)
+
+    return image_names, tracker.select(indices), [timestamps[i] for i in indices]
+
+
+def _output_fps(source_fps, target_fps, decoder="opencv"):
+    """
+    the frame rate decode_video actually yields frames at: the opencv decoder
+    only ever drops frames (see _target_slot), while ffmpeg's fps filter also
+    duplicates them to reach a target_fps above the source's
+    """
+    if target_fps is None:
+        return source_fps
+
+    if decoder == "ffmpeg" or target_fps < round(source_fps):
+        return target_fps
+
+    return source_fps
+
+
+def _write_frames_metadata(filename, frame_dir, image_names, clip, target_fps, size=None, indices=None,
+                           quality=None, timestamps=None, decoder="opencv"):
+    """
+    write the sidecar of a directory of frames extracted from filename,
+    with their quality statistics (see quality.py) and the timestamps the
+    decoder reported for them if given
+    """
+    info = video_info(filename)
+    _, start, end = _clip_bounds(info["fps"], info["frame_count"], clip)
+    width, height = size if size is not None else (info["width"], info["height"])
+    frames = [os.path.relpath(pth, frame_dir) for pth in image_names]
+
+    metadata = trial_metadata(filename, info, frames, _output_fps(info["fps"], target_fps, decoder), 
+                              width, height, clip, start, end, indices=indices, timestamps=timestamps)
+    if quality is not None:
+        metadata["quality"] = quality
+
+    partitions = partition_index(frames)
+    if partitions:
+        metadata["partitions"] = partitions
+    write_trial_metadata(frame_dir, metadata)
+
+
+def _write_video_frames(filename, output_dir, suppress, clip, target_fps, segments, decoder, writers,
+                        png_compression):
+    """
+    decode a video into its frame directory and write the sidecar, see video_file_to_frames
+    """
+    # have output directory, now need to create the framesies
+    if segments > 1:
+        jobs = [(filename, output_dir, clip, target_fps, segment, decoder, writers, png_compression)
+                for segment in video_segments(filename, segments, clip=clip)]
+        
+        parts = []
+        for job, result, error in parallel_map(_write_segment, jobs, processes=len(jobs),
+                                               suppress=suppress, name="video_file_to_frames"):
+            if error is not None:
+                raise RuntimeError("failed decoding segment %s of %s\n%s" % (str(job[4]), filename, error))
+            parts.append((job[4], result))
+
+        # segments finish in any order, put them back in temporal order
+        parts.sort(key=lambda part: part[0])
+        image_names = [name for _, (names, _, _) in parts for name in names]
+        quality = merge_quality([quality for _, (_, quality, _) in parts])
+        timestamps = [timestamp for _, (_, _, stamps) in parts for timestamp in stamps]
+        _write_frames_metadata(filename, output_dir, image_names, clip, target_fps, quality=quality,
+                               timestamps=timestamps, decoder=decoder)
+        return image_names
+
+    image_names = []
+    indices = []
+    timestamps = {}
+    decode_time = 0.
+    tracker = QualityTracker()
+
+    with FrameWriter(workers=writers, compression=png_compression) as writer:
+        start = time.time()
+        for count, image in decode_video(filename, decoder=decoder, clip=clip, target_fps=target_fps, 
+                                         suppress=suppress, timestamps=timestamps):
+            decode_time += time.time() - start
+            
+            pth = os.path.join(output_dir, "frame-%05d.png" % count)
+            image_names.append(pth)
+            writer.write(pth, image)
+            tracker.add(count, image)
+            indices.append(count)
+
+            if not suppress:
+                sys.stdout.write("\r[video_file_to_frames]-- writing [%s]" % pth)
+                sys.stdout.flush()
+            
+            start = time.time()
+
+    if not suppress:
+        print("\n[video_file_to_frames]-- clipped [%d] seconds off of each end of video" % clip)
+        print("[video_file_to_frames]-- decode %.2fs, encode %.2fs over %d writers, waited on writers %.2fs" 
+              % (decode_time, writer.encode_time, writers, writer.blocked_time))
+
+    _write_frames_metadata(filename, output_dir, image_names, clip, target_fps, quality=tracker.select(indices),
+                           timestamps=[timestamps[i] for i in indices], decoder=decoder)
+    return image_names
+
+
+def video_file_to_frames(filename, output_dir=None, suppress=False, clip=2, target_fps=FPS, segments=1,
+                         decoder="opencv", writers=2, png_compression=3):
     """
     Convert a video file to individual frames
 
@@ -70,8 +555,20 @@ def video_file_to_frames(filename, output_dir=None, suppress=False, clip=2):
                                for the frames
 
         --> suppress : boolean to suppress messages or not
+        --> clip : number of seconds to clip off of each end
+        --> target_fps : the frame rate of the extracted frames, None to keep every frame
+        --> segments : split the video into this many keyframe aligned pieces and
+                       decode each one in its own process (must not be used from
+                       inside another worker process, e.g video_files_to_frames)
+        --> decoder : the decoder backend, "opencv" or "ffmpeg"
+        --> writers : the number of threads encoding and writing frames
+                      while the next ones are decoded
+        --> png_compression : PNG compression level of the frames, 0-9
     returns:
         --> list of image filenames
+        
+    the mean intensity, saturated fraction and inter-frame difference of every
+    frame are computed in the same pass and kept in the sidecar (see quality.py)
     some facts:
     ----------
         1) This procedure will save the png images in an output directory
@@ -97,73 +594,64 @@ def video_file_to_frames(filename, output_dir=None, suppress=False, clip=2):
             output_dir = "%s_frames" % no_ext
             check_exists_create_if_not(output_dir, suppress=suppress)
 
-        # have output directory, now need to create the framesies
-        vidcap = cv2.VideoCapture(filename)
-        FPS = int(round(vidcap.get(cv2.CAP_PROP_FPS)))
-        total = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        success, image = vidcap.read()
-        
-        image_names = []
-        count = 0
-        success = True
-
-        if not suppress:
-            print("[video_file_to_frames]-- extracting frames from %d fps video with %d frames" % (FPS, total))
-
-        # while there is a next image
-        while success:
-            pth = ""
-            if count >= FPS * clip and count < total - (FPS * clip):
-                if FPS == 60:
-                    if count % 2 == 0:        
-                        pth = os.path.join(output_dir, "frame-%05d.png" % ((count-FPS*clip)/2))
-                        image_names.append(pth)
-                        cv2.imwrite(pth, image)
-                else:
-                    pth = os.path.join(output_dir, "frame-%05d.png" % (count-FPS*clip))
-                    image_names.append(pth)
-                    cv2.imwrite(pth, image)
-
-             
-            success, image = vidcap.read()
-             
-            if not suppress and pth != "":
-                if success:
-                    sys.stdout.write("\r[video_file_to_frames]-- writing [%s]" % pth)
-                    sys.stdout.flush()
-                
-                else:
-                    sys.stdout.write("\n")
-                    sys.stdout.flush()
-
-            count += 1
-          
-        if not suppress:
-            print("\n[video_file_to_frames]-- clipped [%d] seconds off of each end of video" % clip)
-        #clip off two seconds of the video
-        
-        #i = 0
-        #size = len(image_names)
-        #for video_frame in os.listdir(output_dir): 
-        #    if i < clip * FPS:
-        #        pth = os.path.join(output_dir, video_frame)
-        #        os.remove(pth)
-        #    elif i > size - (clip * FPS):
-        #        pth = os.path.join(output_dir, video_frame)
-        #        os.remove(pth)
-        #    elif FPS == 60 and i % 2 == 1:
-        #        pth = os.path.join(output_dir, video_frame)
-        #        os.remove(pth)
-        #    i+=1
-        return image_names
+        try:
+            return _write_video_frames(filename, output_dir, suppress, clip, target_fps, segments, decoder,
+                                       writers, png_compression)
+        except BaseException:
+            # never leave a partial trial behind, the next run would take it for a finished one
+            shutil.rmtree(output_dir, ignore_errors=True)
+            if os.path.exists(metadata_path(output_dir)):
+                os.remove(metadata_path(output_dir))
+            raise
     
     # a problem occurred
     else:
         raise ValueError(err)
 
 
-def video_dir_to_frame_dir(video_dir, output_dir, suppress=False):
+def video_files_to_frames(filenames, output_dir, processes=None, maxtasksperchild=1, clip=2, suppress=False,
+                          decoder="opencv", writers=1, png_compression=3):
+    """
+    Convert several video files to frames in parallel, one video per worker process.
+    A video that fails to convert is reported and skipped rather than aborting the rest.
+
+    args:
+        filenames : the video files to convert
+        output_dir : the directory to place the frame directories in
+        processes (optional) : the number of worker processes, defaults to the number of cores
+        maxtasksperchild (optional) : the number of videos a worker converts before it is
+                                      replaced, which bounds the memory held by any one worker
+        clip (optional) : number of seconds to clip off of each end of the videos
+        suppress (optional) : boolean to suppress messages or not
+        decoder (optional) : the decoder backend, "opencv" or "ffmpeg"
+        writers (optional) : the number of frame writing threads per worker process
+        png_compression (optional) : PNG compression level of the frames, 0-9
+
+    returns:
+        imgs_captured : dict mapping each successfully converted video to its image filenames
+        failures : dict mapping each failed video to the traceback of its error
+    """
+    imgs_captured, failures = {}, {}
+    jobs = [(filename, output_dir, True, clip, FPS, 1, decoder, writers, png_compression) for filename in filenames]
+
+    for job, framenames, error in parallel_map(video_file_to_frames, jobs,
+                                               processes=processes,
+                                               maxtasksperchild=maxtasksperchild,
+                                               suppress=suppress,
+                                               name="video_files_to_frames"):
+        if error is None:
+            imgs_captured[job[0]] = framenames
+        else:
+            failures[job[0]] = error
+
+    if not suppress:
+        for filename, error in failures.items():
+            print("[video_files_to_frames]-- FAILED %s\n%s" % (filename, error))
+
+    return imgs_captured, failures
+
+
+def video_dir_to_frame_dir(video_dir, output_dir, suppress=False, processes=1):
     """
     create a directory that contains subdirectories
     that contain all of the frames of the movies contained
@@ -173,6 +661,7 @@ def video_dir_to_frame_dir(video_dir, output_dir, suppress=False):
         video_dir : directory with videos
         output_dir : location to place the output frames
         suppress (optional) : display output 
+        processes (optional) : number of videos to convert at once, None for one per core
     returns:
         imgs_captured : a list of image framenames from all 
                         videos in video dir
@@ -184,18 +673,24 @@ def video_dir_to_frame_dir(video_dir, output_dir, suppress=False):
         # path is a dir?
         if os.path.isdir(video_dir):
             contents = os.listdir(video_dir)
-            movies = [os.path.join(video_dir, cont) for cont in contents if cont.lower().endswith(".mov")]
+            movies = [os.path.join(video_dir, cont) for cont in contents if cont.lower().endswith(VIDEO_EXTENSIONS)]
 
-            # path contains .MOV or .mov files ??
+            # path contains .MOV, .mov or .mkv files ??
             if len(movies) > 0:
                 
                 imgs_captured = []
 
                 check_exists_create_if_not(output_dir, suppress=suppress)
 
-                for mov in movies:
-                    framenames = video_file_to_frames(mov, output_dir=output_dir, suppress=suppress)
-                    imgs_captured.extend(framenames)
+                if processes == 1:
+                    for mov in movies:
+                        framenames = video_file_to_frames(mov, output_dir=output_dir, suppress=suppress)
+                        imgs_captured.extend(framenames)
+
+                else:
+                    captured, _ = video_files_to_frames(movies, output_dir, processes=processes, suppress=suppress)
+                    for mov in movies:
+                        imgs_captured.extend(captured.get(mov, []))
 
                 return imgs_captured
 
@@ -209,7 +704,7 @@ def video_dir_to_frame_dir(video_dir, output_dir, suppress=False):
         raise FileNotFoundError("%s not found" % video_dir)
 
 def partition_frame_dir(frame_dir, output_dir, num_seconds=2, front_trim=60, end_trim=60, 
-                        capacity_tolerance=1.0):
+                        capacity_tolerance=1.0, quality_thresholds=None):
     """
     Given a directory of frames, this method partitions them into several subdirectories,
     such that each directory contains num_seconds*FPS frames.
@@ -221,6 +716,9 @@ def partition_frame_dir(frame_dir, output_dir, num_seconds=2, front_trim=60, end
         front_trim (optional) : the number of frames to ignore from beginning of directory
         end_trim (optional) : the number of frames to ignore from end of directory
         capacity_tolerance (optional) : how full an acceptable partition must be 
+        quality_thresholds (optional) : skip partitions containing frames that fail these
+                                        thresholds (see quality.good_frames), requires
+                                        the quality statistics in the trial's sidecar
     
     return:
         the number of partitions created
@@ -233,20 +731,38 @@ def partition_frame_dir(frame_dir, output_dir, num_seconds=2, front_trim=60, end
     if front_trim < 0 or end_trim < 0 or num_seconds < 0:
         raise ValueError("num_seconds, front_trim and end_trim must be positive")
     
-    listed_directory = os.listdir(frame_dir)
-    num_frames = len(listed_directory)
+    metadata = read_trial_metadata(frame_dir)
+    good = None
+
+    if metadata is not None:
+        # the sidecar knows the real frame rate and the temporal order of the frames
+        listed_directory = metadata["frames"]
+        fps = int(round(metadata["fps"]))
+        
+        if quality_thresholds is not None and "quality" in metadata:
+            good = good_frames(metadata["quality"], quality_thresholds)
+    
+    else:
+        listed_directory = frame_index(frame_dir)
+        #rough estimation to determine frame rate
+        fps = 60 if len(listed_directory) > 1600 else 30
 
-    #rough estimation to determine frame rate
-    is_60_fps = num_frames > 1600
+    num_frames = len(listed_directory)
+    step = max(1, fps // FPS)
     
     print('[partition_frame_dir]: PARTITIONING {} -> {}'.format(frame_dir, output_dir))
-    print("[partition_frame_dir]: Found {} frames".format(num_frames), ("(60fps)" if is_60_fps else "(30fps)"))
+    print("[partition_frame_dir]: Found {} frames".format(num_frames), "(%dfps)" % fps)
     iteration = 0
     num_partitions = 0
+    skipped = 0
     current_partition = []
+    current_indices = []
+    current_good = True
+    partitions = {}
+    kept = []
     
     #The next five lines are only used for the progress bar output. Ignore it if you want.
-    eligible_frames = (num_frames - front_trim - end_trim + 1) // (2 if is_60_fps else 1)
+    eligible_frames = (num_frames - front_trim - end_trim + 1) // step
     total_partitions = eligible_frames // (num_seconds * FPS)
     left_over = eligible_frames - total_partitions * num_seconds * FPS
     if left_over / (num_seconds * FPS) >= capacity_tolerance:
@@ -254,29 +770,49 @@ def partition_frame_dir(frame_dir, output_dir, num_seconds=2, front_trim=60, end
 
     while iteration < num_frames - end_trim:
         if iteration >= front_trim:
-            if not is_60_fps:
-                current_partition.append(listed_directory[iteration])
-            elif iteration % 2 == 0:
+            if iteration % step == 0:
                 current_partition.append(listed_directory[iteration])
+                current_indices.append(iteration)
+                current_good = current_good and (good is None or bool(good[iteration]))
             
             if len(current_partition) >= num_seconds*FPS:
-                next_output_dir = os.path.join(output_dir, str(num_partitions))
-                move_frames(frame_dir, current_partition, next_output_dir)           
-                num_partitions+=1
+                if current_good:
+                    next_output_dir = os.path.join(output_dir, str(num_partitions))
+                    partitions[str(num_partitions)] = move_frames(frame_dir, current_partition, next_output_dir)
+                    kept.extend(current_indices)
+                    num_partitions+=1
+                    progressBar(num_partitions, total_partitions)
+                else:
+                    skipped += 1
                 current_partition = []
-                progressBar(num_partitions, total_partitions)
+                current_indices = []
+                current_good = True
         iteration+=1
 
     #Handle any leftover frame lists that did not reach full capacity due to trimming.
     #If the frame list is acceptably full, then include it with the other partitioned directories
-    if current_partition:
+    if current_partition and current_good:
         if len(current_partition) / (num_seconds*FPS) >= capacity_tolerance:
             next_output_dir = os.path.join(output_dir, str(num_partitions))
-            move_frames(frame_dir, current_partition, next_output_dir)
+            partitions[str(num_partitions)] = move_frames(frame_dir, current_partition, next_output_dir)
+            kept.extend(current_indices)
             num_partitions+=1
             progressBar(num_partitions, total_partitions)
 
+    # index the partitions in the sidecar of the partitioned trial, so they are never listed
+    frames = [os.path.join(p, name) for p in sorted(partitions, key=int) for name in partitions[p]]
+    partitioned = dict(metadata) if metadata is not None else index_metadata(frames)
+    # the per frame entries follow the kept frames, in the same order
+    if "quality" in partitioned:
+        partitioned["quality"] = {key: [values[i] for i in kept] for key, values in partitioned["quality"].items()}
+    if "timestamps" in partitioned:
+        partitioned["timestamps"] = [partitioned["timestamps"][i] for i in kept]
+    partitioned.update({"fps": fps // step, "frame_count": len(frames), "frames": frames, "partitions": partitions})
+    write_trial_metadata(output_dir, partitioned)
+
     print()
+    if skipped:
+        print("[partition_frame_dir]: skipped %d partitions failing the quality thresholds" % skipped)
     return num_partitions
     
 def move_frames(source_dir, partitioned_frames, output_dir):
@@ -288,15 +824,22 @@ def move_frames(source_dir, partitioned_frames, output_dir):
         source_dir : the origin directory
         partitioned_frames : a list of frames that are being moved out of source directory
         output_dir : the directory where selected frames are being placed
+
+    returns:
+        the names of the moved frames in output_dir, in order
     """
     check_exists_create_if_not(output_dir,suppress=True)
     current_index = 0
+    names = []
     for frame in partitioned_frames:
         frame_path = os.path.join(source_dir, frame)
-        source_path = os.path.join(output_dir, "frame" + str(current_index) + ".png")
+        names.append("frame" + str(current_index) + ".png")
+        source_path = os.path.join(output_dir, names[-1])
         os.rename(frame_path, source_path)
         current_index+=1
 
+    return names
+
 def resize_frame_dir(frame_dir, output_dir, width=224, height=224):
     """
     Copy and resize frames in given directory.
@@ -309,102 +852,386 @@ def resize_frame_dir(frame_dir, output_dir, width=224, height=224):
     check_exists_create_if_not(output_dir, suppress=True)
 
     print("[resize_frame_dir]: RESIZING {} -> {}".format(frame_dir, output_dir))
-    listed_directory = os.listdir(frame_dir)
+    listed_directory = frame_index(frame_dir)
     num_partitions = len(listed_directory)
     completed_partitions = 0
 
-    for frame in os.listdir(frame_dir):
+    for frame in listed_directory:
         current_frame_dir = os.path.join(frame_dir, frame)
         img = Image.open(current_frame_dir)
         img = img.resize((width, height), Image.ANTIALIAS)
         output_path = os.path.join(output_dir, frame)
+
+        # partitioned trials keep their frames in numbered subdirectories
+        if os.path.dirname(frame):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
         img.save(output_path) 
         completed_partitions += 1
         progressBar(completed_partitions, num_partitions)
     print()
 
+    metadata = read_trial_metadata(frame_dir) or index_metadata(listed_directory)
+    write_trial_metadata(output_dir, resized_metadata(metadata, listed_directory, width, height))
+
+
+def _resize_to_pyramid(frame_dir, frame, outputs):
+    """
+    read one frame and write it at every (output_dir, width, height) in outputs
+    """
+    image = cv2.imread(os.path.join(frame_dir, frame))
+    if image is None:
+        raise IOError("could not read %s" % os.path.join(frame_dir, frame))
+
+    for output_dir, width, height in outputs:
+        output_path = os.path.join(output_dir, frame)
+        
+        # partitioned trials keep their frames in numbered subdirectories
+        if os.path.dirname(frame):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        cv2.imwrite(output_path, cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA))
+
+
+def resize_frame_dir_pyramid(frame_dir, outputs, workers=4):
+    """
+    Resize the frames of a directory to several sizes at once, reading each frame
+    a single time and writing one copy per size with area interpolation.
+
+    args:
+        frame_dir : directory containing frames
+        outputs : list of (output_dir, width, height)
+        workers (optional) : the number of threads reading and resizing frames
+    """
+    if not os.path.exists(frame_dir):
+        raise FileNotFoundError("Error: path {} does not exists".format(frame_dir))
+    if not os.path.isdir(frame_dir):
+        raise IOError("Error: path {} is not a directory".format(frame_dir))
+
+    for output_dir, width, height in outputs:
+        if width <= 0 or height <= 0:
+            raise ValueError("Error: dimensions should be > 0, got {}x{}".format(width, height))
+        check_exists_create_if_not(output_dir, suppress=True)
+
+    frames = frame_index(frame_dir)
+    metadata = read_trial_metadata(frame_dir) or index_metadata(frames)
+
+    print("[resize_frame_dir_pyramid]: RESIZING {} -> {}".format(frame_dir, 
+          ", ".join("%s (%dx%d)" % output for output in outputs)))
+
+    pool = ThreadPool(workers)
+    try:
+        completed = 0
+        for _ in pool.imap_unordered(lambda frame: _resize_to_pyramid(frame_dir, frame, outputs), frames):
+            completed += 1
+            progressBar(completed, len(frames))
+    finally:
+        pool.close()
+        pool.join()
+    print()
+
+    for output_dir, width, height in outputs:
+        write_trial_metadata(output_dir, resized_metadata(metadata, frames, width, height))
+
+
+def stream_video_file(filename, output_dir, width=100, height=100, clip=2,
+                      num_seconds=None, front_trim=0, end_trim=0,
+                      capacity_tolerance=1.0, target_fps=FPS, decoder="opencv", writers=2,
+                      png_compression=3, suppress=False):
+    """
+    Decode a video file once and write only its final, resized frames. Trimming,
+    resizing and (optionally) partitioning all happen in memory, so no full
+    resolution frames are ever written to disk.
+
+    args:
+        filename : video file to convert
+        output_dir : directory in which to place the $(subject)/$(trial)_frames dir
+        width (optional) : width of the written frames
+        height (optional) : height of the written frames
+        clip (optional) : number of seconds to clip off of each end of the video
+        num_seconds (optional) : if given, partition the frames into subdirectories
+                                 0/, 1/, ... of num_seconds*target_fps frames each
+                                 (the layout produced by partition_frame_dir)
+        front_trim (optional) : the number of frames to ignore after clipping
+        end_trim (optional) : the number of frames to ignore before the clipped end
+        capacity_tolerance (optional) : how full an acceptable last partition must be
+        target_fps (optional) : the frame rate of the written frames
+        decoder (optional) : the decoder backend, "opencv" or "ffmpeg" (which scales
+                             inside ffmpeg instead of resizing in python)
+        writers (optional) : the number of threads encoding and writing frames
+        png_compression (optional) : PNG compression level of the frames, 0-9
+        suppress (optional) : boolean to suppress messages or not
+
+    returns:
+        the list of written image filenames
+    """
+    vid_valid, err, no_ext = video_file_exists(filename)
+
+    if not vid_valid:
+        raise ValueError(err)
+
+    if front_trim < 0 or end_trim < 0:
+        raise ValueError("front_trim and end_trim must be positive")
+
+    if num_seconds is not None and num_seconds <= 0:
+        raise ValueError("num_seconds must be positive")
+
+    if num_seconds is not None and target_fps is None:
+        raise ValueError("partitioning by num_seconds requires a target_fps")
+
+    output_dir = os.path.join(output_dir, "%s_frames" % no_ext)
+    check_exists_create_if_not(output_dir, suppress=suppress)
+
+    partition_size = num_seconds * target_fps if num_seconds is not None else None
+    
+    # frames are held back end_trim frames at a time so the tail can be dropped
+    # without knowing the length of the video up front
+    delayed = deque()
+    current_partition = []
+    num_partitions = 0
+    image_names = []
+    indices = []
+    timestamps = {}
+    tracker = QualityTracker()
+    writer = FrameWriter(workers=writers, compression=png_compression)
+
+    def flush_partition(frames, partition):
+        partition_dir = os.path.join(output_dir, str(partition))
+        check_exists_create_if_not(partition_dir, suppress=True)
+        for i, (index, frame) in enumerate(frames):
+            pth = os.path.join(partition_dir, "frame%d.png" % i)
+            writer.write(pth, frame)
+            image_names.append(pth)
+            indices.append(index)
+
+    with writer:
+        for count, image in decode_video(filename, decoder=decoder, size=(width, height), clip=clip, 
+                                         target_fps=target_fps, suppress=suppress, timestamps=timestamps):
+            if count < front_trim:
+                continue
+
+            tracker.add(count, image)
+            delayed.append((count, image))
+            if len(delayed) <= end_trim:
+                continue
+
+            index, frame = delayed.popleft()
+            
+            if partition_size is None:
+                pth = os.path.join(output_dir, "frame-%05d.png" % (index - front_trim))
+                writer.write(pth, frame)
+                image_names.append(pth)
+                indices.append(index)
+
+            else:
+                current_partition.append((index, frame))
+                if len(current_partition) >= partition_size:
+                    flush_partition(current_partition, num_partitions)
+                    num_partitions += 1
+                    current_partition = []
+
+            if not suppress:
+                sys.stdout.write("\r[stream_video_file]-- wrote %d frames" % len(image_names))
+                sys.stdout.flush()
+
+        if current_partition and len(current_partition) / partition_size >= capacity_tolerance:
+            flush_partition(current_partition, num_partitions)
+            num_partitions += 1
+
+    if not suppress:
+        print("\n[stream_video_file]-- %s -> %s (%dx%d)" % (filename, output_dir, width, height))
+        if partition_size is not None:
+            print("[stream_video_file]-- created %d partitions" % num_partitions)
+
+    _write_frames_metadata(filename, output_dir, image_names, clip, target_fps, size=(width, height), 
+                           indices=indices, quality=tracker.select(indices),
+                           timestamps=[timestamps[i] for i in indices], decoder=decoder)
+    return image_names
+
+
+def trial_video_path(movie_dir, subject_dir, trial):
+    """
+    locate the video for a trial, e.g data/S0001/Trial1.MOV, whether
+    it is an original or a proxy with a different extension
+
+    args:
+        movie_dir : the movie directory
+        subject_dir : the subject's directory name, e.g S0001
+        trial : the trial number
+
+    returns:
+        the path to the video (the .MOV path if nothing is found)
+    """
+    name = "Trial%d" % trial
+    default = os.path.join(movie_dir, subject_dir, name + ".MOV")
+
+    if os.path.exists(default):
+        return default
+
+    for ext in VIDEO_EXTENSIONS + tuple(ext.upper() for ext in VIDEO_EXTENSIONS):
+        candidate = os.path.join(movie_dir, subject_dir, name + ext)
+        if os.path.exists(candidate):
+            return candidate
+
+    return default
+
+
+def make_proxy(filename, output_dir, width=100, height=100, codec="mjpeg", fps=None, suppress=False):
+    """
+    Transcode a video once into a small, all-intra, audio free proxy that every
+    downstream stage can decode much faster than the phone original.
+
+    The proxy keeps the full duration of the video (clipping still happens at
+    extraction time) and the $(subject)/$(trial) layout of the movie directory.
+
+    args:
+        filename : the original video
+        output_dir : the proxy movie directory
+        width (optional) : width of the proxy
+        height (optional) : height of the proxy
+        codec (optional) : one of PROXY_CODECS, "mjpeg" (.MOV) or "ffv1" (.mkv)
+        fps (optional) : resample the proxy to this frame rate, None keeps the original rate
+        suppress (optional) : boolean to suppress messages or not
+
+    returns:
+        the path to the proxy
+    """
+    vid_valid, err, no_ext = video_file_exists(filename)
+    if not vid_valid:
+        raise ValueError(err)
+
+    if codec not in PROXY_CODECS:
+        raise ValueError("unknown proxy codec %s, expected one of %s" % (codec, ", ".join(PROXY_CODECS)))
+
+    codec_args, ext = PROXY_CODECS[codec]
+    output_path = os.path.join(output_dir, no_ext + ext)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    filters = "scale=%d:%d:flags=area" % (width, height)
+    if fps is not None:
+        filters = "fps=%s,%s" % (str(fps), filters)
+
+    # write next to the destination and rename, so a killed job never leaves a partial proxy
+    temp_path = output_path + ".part" + ext
+    command = ["ffmpeg", "-y", "-v", "error", "-i", filename, "-an", "-vf", filters] + codec_args + [temp_path]
+
+    if not suppress:
+        print("[make_proxy]-- %s -> %s" % (filename, output_path))
+
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+
+    if p.returncode != 0:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RuntimeError("ffmpeg failed making a proxy of %s: %s" % (filename, err.decode().strip()))
+
+    os.replace(temp_path, output_path)
+    return output_path
+
 
 def fetch_path(subj, data_dir):
     subject = "S" + ("0" * (4-len(subj))) + subj
     full_path = os.path.join(data_dir, subject)
     return full_path
 
+def transform_video(video_path, output_path, factor, max_duration=30, loop=False, head=None, suppress=False):
+    """
+    Change the speed of a video, trim it to at most max_duration seconds around
+    its center and optionally loop it forwards then backwards, all in a single
+    ffmpeg decode/encode pass.
+
+    Only the source span that survives the trim is decoded (the seek happens on
+    the input), and the result is written to a unique temporary file next to
+    output_path and renamed into place, so concurrent jobs never collide and a
+    killed job never leaves a partial video behind. Audio is dropped.
+
+    args:
+        video_path : the video to transform
+        output_path : where to write the transformed video
+        factor : the setpts factor, < 1 speeds the video up and > 1 slows it down
+        max_duration (optional) : the longest the output may be, in seconds
+        loop (optional) : play the trimmed clip forwards and then backwards (ping-pong),
+                          the forward half being max_duration / 2 at most
+        head (optional) : keep only the first head seconds of the transformed video,
+                          before trimming it around its center
+        suppress (optional) : boolean to suppress messages or not
+
+    returns:
+        the duration of the transformed video in seconds
+    """
+    if factor <= 0:
+        raise ValueError("the speed factor should be > 0, got %s" % str(factor))
+
+    # setpts scales the duration by exactly the factor, no need to probe the new video
+    duration = video_info(video_path)["duration"] / 1000. * factor
+    if head is not None:
+        duration = min(duration, head)
+
+    segment = min(duration, max_duration / 2. if loop else max_duration)
+    source_start = (duration - segment) / 2. / factor
+    source_length = segment / factor
+
+    graph = "[0:v]setpts=%s*(PTS-STARTPTS)" % repr(float(factor))
+    if loop:
+        graph += ",split[f][b];[b]reverse[r];[f][r]concat=n=2:v=1:a=0"
+    graph += "[v]"
+
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=out_dir, prefix=".transform-", suffix=os.path.splitext(output_path)[1])
+    os.close(fd)
+
+    command = ["ffmpeg", "-y", "-v", "error",
+               "-ss", "%.3f" % source_start, "-t", "%.3f" % source_length, "-i", video_path,
+               "-filter_complex", graph, "-map", "[v]", "-an", "-q:v", "1", temp_path]
+
+    if not suppress:
+        print("[transform_video]-- %s -> %s (factor %s, %.1fs%s)" 
+              % (video_path, output_path, str(factor), segment * (2 if loop else 1), ", looped" if loop else ""))
+
+    p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+
+    if p.returncode != 0:
+        os.remove(temp_path)
+        raise RuntimeError("ffmpeg failed transforming %s: %s" % (video_path, err.decode().strip()))
+
+    os.replace(temp_path, output_path)
+    return segment * (2 if loop else 1)
+
+def _clip_head(duration, factor):
+    """
+    the first seconds of a video of duration seconds that clip_video keeps, None for all of them
+    """
+    return int(duration) * factor if factor < 1 else None
+
 def change_speed(video_path, new_name, factor):
-    command = BASH_COMMAND.format(video_path, factor, new_name)
     print("[{}]: CHANGING SPEED of video {} by a factor of {}".format(sys.argv[0], video_path, str(factor)))
-    p = subprocess.Popen(command.split(' '), stdout=subprocess.PIPE)
-    p.wait()
-    p.kill()
-    clip_video(new_name, factor)
-
-def clip_video(video_path, factor):
-    command = GET_DURATION_COMMAND.format(video_path)
-    p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-    out, err = p.communicate()
-    print(out)
-    out = int(float(out))
-    print(out)
-    if factor < 1:
-        end_time = "00:00:" + str(int(out*factor))
-        command = HALVE_COMMAND.format(video_path, "00:00:00", end_time, 'temp.mov') 
-        p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-        p.wait()
-        p.kill()
-        os.remove(video_path)
-        os.rename('temp.mov', video_path)
-    
-    if out > 30:
-        dif = int((float(out)-30)/2)
-        start = str(dif)
-        if len(start) == 1:
-            start = "0" + start
-        start = "00:00:" + start
-        command = HALVE_COMMAND.format(video_path, start, "00:00:30", 'temp.mov') 
-        p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-        p.wait()
-        p.kill()
-        os.remove(video_path)
-        os.rename('temp.mov', video_path)
+    # the speed change and clip_video(new_name, factor) in one pass
+    duration = video_info(video_path)["duration"] / 1000. * factor
+    transform_video(video_path, new_name, factor, head=_clip_head(duration, factor))
+
+def clip_video(video_path, factor, duration=None):
+    """
+    trim a video in place: a sped up one (factor < 1) to its first duration * factor
+    seconds, then anything longer than 30 seconds to its center 30 seconds
+
+    args:
+        video_path : the video to trim
+        factor : the speed factor the video was changed by
+        duration (optional) : the duration of the video in seconds, probed if not given
+    """
+    if duration is None:
+        duration = video_info(video_path, persist=False)["duration"] / 1000.
+    transform_video(video_path, video_path, 1.0, head=_clip_head(duration, factor))
         
 def handle(video_path, factor):
-    command = GET_DURATION_COMMAND.format(video_path)
-    p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-    out, err = p.communicate()
-   
-    if factor == 2: #if the video was slowed down, split it into two 30 second parts and throw out the second part
-        split_name = video_path.split('.')[0]
-        end_time_1 = int(float(out) / 2)
-        end_time_2 = int(float(out))
-        if len(str(end_time_1)) < 2:
-            end_time_1 = int("0" + str(end_time_1))
-        if len(str(end_time_2)) < 2:
-            end_time_2 = int("0" + str(end_time_2))
-        end_time_1 = "00:00:" + str(end_time_1)
-        if end_time_2 > 60:
-            end_time_2 = "00:01:" + '0' + str(end_time_2 - 60)
-        else:
-            end_time_2 = "00:00:" + str(end_time_2)
-        command = SPLIT_COMMAND.format(video_path, 0, end_time_1, split_name + '_first_half.mov') 
-        p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-        p.wait()
-        p.kill()
-        os.remove(video_path)
-        os.rename(split_name + '_first_half.mov', video_path)
-    else: #if the video was sped up, cut it in half and reverse it
-        halved_name = video_path.split('.')[0] + '_halved.mov'
-        end_time = "00:00:" + str(int(float(out)/2))
-        command = HALVE_COMMAND.format(video_path, "00:00:00", end_time, halved_name) 
-        p = subprocess.Popen(command.split(), stdout=subprocess.PIPE)
-        p.wait()
-        p.kill()
-        looped_name = video_path.split('.')[0] + '_looped.mov'
-        command = ['ffmpeg','-i',halved_name,'-filter_complex','[0:v]reverse,fifo[r];[0:v][0:a][r][0:a]concat=n=2:v=1:a=1 [v] [a]', '-map', '[v]', '-map', '[a]', looped_name] 
-        p = subprocess.Popen(command, stdout=subprocess.PIPE)
-        p.wait()
-        p.kill()
-        os.remove(halved_name)
-        os.remove(video_path)
-        os.rename(video_path.split('.')[0] + '_looped.mov', video_path)
+    """
+    in place, keep the first half of a slowed down (factor 2) video, or ping-pong loop
+    the first half of a sped up one
+    """
+    out = video_info(video_path, persist=False)["duration"] / 1000.
+    transform_video(video_path, video_path, 1.0, max_duration=out, loop=(factor != 2), head=out / 2.)
 
 def progressBar(value, endvalue, bar_length=20):
     """
@@ -0,0 +1 @@
+from .workqueue import WorkQueue
@@ -0,0 +1,318 @@
+"""
+workqueue.py is a coordinator free job queue on a shared filesystem, so
+that any number of worker processes on any number of hosts can pull
+preprocessing jobs (one subject/trial each) from the same directory.
+
+    queue_dir/pending/<job>.json            waiting to be claimed
+    queue_dir/leases/<job>@<token>.json     claimed, its mtime changes at every heartbeat
+    queue_dir/done/<job>.json               finished, with the result
+    queue_dir/failed/<job>.json             gave up after max_attempts, with the errors
+
+Every state change is a rename, which is atomic on a POSIX (and NFS)
+filesystem, so exactly one worker wins a claim. Each claim gets a random
+token that is part of its lease's name, so a worker can only renew, complete
+or fail its own claim: once its lease expired and the job was claimed again,
+its lease file is gone and all three do nothing.
+
+A worker touches its lease every heartbeat seconds. Expiry never compares
+clocks across hosts: a worker notes on its own clock when it sees a lease's
+mtime change, and a lease whose mtime has not changed for lease_timeout
+seconds of that clock belongs to a dead worker and is put back in pending/
+by whichever worker notices first. A worker therefore watches a lease for
+at least lease_timeout seconds before it re-queues it.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import traceback
+
+STATES = ("pending", "leases", "done", "failed")
+
+
+def _read(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write(path, data):
+    temp = "%s.%s.%d.tmp" % (path, socket.gethostname(), os.getpid())
+    with open(temp, "w") as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+class WorkQueue():
+    """
+    a job queue in a directory on a shared filesystem
+
+    usage example:
+        # anywhere
+        queue = WorkQueue("/shared/queue")
+        queue.submit("extract-S0001-Trial1", {"stage": "extract", "args": [movie, "frames/"]})
+
+        # on every node, as many times as there are cores
+        WorkQueue("/shared/queue").work(lambda job: run_stage(job))
+
+    args:
+        queue_dir : the queue directory, on a filesystem every worker can see
+        lease_timeout (optional) : seconds without a heartbeat after which a claimed job is re-queued
+        heartbeat (optional) : seconds between heartbeats of a running job
+        max_attempts (optional) : the number of times a job is tried before it is moved to failed/
+    """
+    def __init__(self, queue_dir, lease_timeout=300, heartbeat=30, max_attempts=3):
+        if heartbeat >= lease_timeout:
+            raise ValueError("the heartbeat (%ds) should be well under the lease timeout (%ds)" 
+                             % (heartbeat, lease_timeout))
+
+        self.queue_dir = queue_dir
+        self.lease_timeout = lease_timeout
+        self.heartbeat = heartbeat
+        self.max_attempts = max_attempts
+        self.worker = "%s:%d" % (socket.gethostname(), os.getpid())
+        # lease -> (its last seen mtime, the local time that mtime was first seen)
+        self._seen = {}
+
+        for state in STATES:
+            os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+    def _path(self, state, job_id):
+        return os.path.join(self.queue_dir, state, job_id + ".json")
+
+    def _lease(self, job_id, token):
+        return os.path.join(self.queue_dir, "leases", "%s@%s.json" % (job_id, token))
+
+    def _jobs(self, state):
+        return sorted(f[:-5] for f in os.listdir(os.path.join(self.queue_dir, state)) if f.endswith(".json"))
+
+    def submit(self, job_id, job, force=False):
+        """
+        add a job to the queue, unless it is already queued, running or done
+
+        args:
+            job_id : unique name of the job, used as a file name
+            job : json serializable description of the job
+            force (optional) : queue the job again even if it is done or failed
+
+        returns:
+            True if the job was queued
+        """
+        if "/" in job_id or "@" in job_id or job_id.startswith("."):
+            raise ValueError("job ids are file names without an @, got %s" % job_id)
+
+        if any(lease.split("@")[0] == job_id for lease in self._jobs("leases")):
+            return False
+
+        for state in ("pending", "done", "failed"):
+            if os.path.exists(self._path(state, job_id)):
+                if not force or state == "pending":
+                    return False
+                os.remove(self._path(state, job_id))
+
+        _write(self._path("pending", job_id), {"job": job, "attempts": 0, "errors": []})
+        return True
+
+    def requeue_expired(self):
+        """
+        put the jobs whose lease has not been renewed for lease_timeout seconds back in pending/
+
+        returns:
+            the re-queued job ids
+        """
+        requeued = []
+        leases = self._jobs("leases")
+        for name in set(self._seen) - set(leases):
+            del self._seen[name]
+
+        for name in leases:
+            lease = self._path("leases", name)
+            try:
+                mtime = os.path.getmtime(lease)
+                now = time.time()
+                seen = self._seen.get(name)
+                if seen is None or seen[0] != mtime:
+                    # a heartbeat since the last look, start the timeout over
+                    self._seen[name] = (mtime, now)
+                    continue
+                if now - seen[1] < self.lease_timeout:
+                    continue
+                
+                # claim the expired lease first so only one worker re-queues it
+                expired = "%s.%s.%d.expired" % (lease, socket.gethostname(), os.getpid())
+                os.rename(lease, expired)
+            except OSError:
+                continue
+
+            del self._seen[name]
+            job_id = name.split("@")[0]
+            entry = _read(expired)
+            entry["errors"].append("lease of %s expired" % entry.get("worker", "?"))
+            self._retry(job_id, entry)
+            os.remove(expired)
+            requeued.append(job_id)
+
+        return requeued
+
+    def _retry(self, job_id, entry):
+        entry["attempts"] += 1
+        entry.pop("worker", None)
+        
+        if entry["attempts"] >= self.max_attempts:
+            _write(self._path("failed", job_id), entry)
+        else:
+            _write(self._path("pending", job_id), entry)
+
+    def claim(self):
+        """
+        take the next pending job, re-queueing expired leases first
+
+        returns:
+            (job id, job, token), or None if nothing is pending; the token
+            identifies this claim to renew, complete and fail
+        """
+        self.requeue_expired()
+
+        for job_id in self._jobs("pending"):
+            token = uuid.uuid4().hex
+            lease = self._lease(job_id, token)
+            try:
+                os.rename(self._path("pending", job_id), lease)
+            except OSError:
+                # another worker got it first
+                continue
+
+            entry = _read(lease)
+            entry["worker"] = self.worker
+            entry["claimed"] = time.time()
+            _write(lease, entry)
+            return job_id, entry["job"], token
+
+        return None
+
+    def _release(self, job_id, token):
+        """
+        take a claim's lease out of leases/ so it can no longer expire,
+        None if the claim was lost (it expired and was re-queued)
+        """
+        lease = self._lease(job_id, token)
+        released = "%s.%s.%d.release" % (lease, socket.gethostname(), os.getpid())
+        try:
+            os.rename(lease, released)
+        except OSError:
+            return None
+
+        entry = _read(released)
+        os.remove(released)
+        return entry
+
+    def renew(self, job_id, token):
+        """
+        heartbeat: renew the lease of a running job
+
+        returns:
+            False if the lease was lost (it expired and was re-queued)
+        """
+        try:
+            # touches only this claim's lease, which is gone once it expired
+            os.utime(self._lease(job_id, token))
+            return True
+        except OSError:
+            return False
+
+    def complete(self, job_id, token, result=None):
+        """
+        mark a claimed job as done
+
+        returns:
+            False, and the job is left alone, if the lease was lost
+        """
+        entry = self._release(job_id, token)
+        if entry is None:
+            return False
+
+        entry["result"] = result
+        entry["worker"] = self.worker
+        entry["finished"] = time.time()
+        _write(self._path("done", job_id), entry)
+        return True
+
+    def fail(self, job_id, token, error):
+        """
+        give back a claimed job that raised, to be retried until max_attempts
+
+        returns:
+            False, and the job is left alone, if the lease was lost
+        """
+        entry = self._release(job_id, token)
+        if entry is None:
+            return False
+
+        entry["errors"].append("%s: %s" % (self.worker, error))
+        self._retry(job_id, entry)
+        return True
+
+    def status(self):
+        """
+        the number of jobs in each state
+        """
+        return {state: len(self._jobs(state)) for state in STATES}
+
+    def work(self, handler, poll=5, exit_when_idle=True, suppress=False):
+        """
+        claim and run jobs until the queue is drained
+
+        args:
+            handler : function called with each job, its return value (json
+                      serializable) is stored as the result
+            poll (optional) : seconds to wait before looking again when nothing is pending
+            exit_when_idle (optional) : return once nothing is pending or running anywhere,
+                                        instead of waiting for more jobs to be submitted
+            suppress (optional) : boolean to suppress messages or not
+
+        returns:
+            (done, failed) : the number of jobs this worker finished and failed
+        """
+        done, failed = 0, 0
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                status = self.status()
+                if exit_when_idle and status["pending"] == 0 and status["leases"] == 0:
+                    return done, failed
+                time.sleep(poll)
+                continue
+
+            job_id, job, token = claimed
+            if not suppress:
+                print("[WorkQueue] %s running %s" % (self.worker, job_id))
+
+            stop = threading.Event()
+            def beat():
+                while not stop.wait(self.heartbeat):
+                    if not self.renew(job_id, token):
+                        return
+            heartbeat = threading.Thread(target=beat)
+            heartbeat.daemon = True
+            heartbeat.start()
+
+            try:
+                result = handler(job)
+            except Exception:
+                stop.set()
+                heartbeat.join()
+                self.fail(job_id, token, traceback.format_exc())
+                failed += 1
+                if not suppress:
+                    print("[WorkQueue] %s FAILED %s" % (self.worker, job_id))
+                continue
+
+            stop.set()
+            heartbeat.join()
+            if not self.complete(job_id, token, result):
+                if not suppress:
+                    print("[WorkQueue] %s lost the lease of %s, its result is dropped" % (self.worker, job_id))
+                continue
+            done += 1
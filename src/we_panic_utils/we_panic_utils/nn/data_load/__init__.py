@@ -1,2 +1,2 @@
 from .train_test_split_csv import train_test_split_with_csv_support, data_set_to_csv, data_set_from_csv, ttswcsv2, ttswcvs3, create_train_test_split_dataframes
-from .split_utils import buckets
+from .split_utils import buckets, read_trials
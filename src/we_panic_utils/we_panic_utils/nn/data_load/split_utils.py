@@ -3,6 +3,11 @@ import csv
 import random
 import pandas as pd
 
+from we_panic_utils.basic_utils.video_core.partitions import read_slug_manifest
+from we_panic_utils.basic_utils.catalog import Catalog, HR_BUCKETS, bucket_index
+
+CATALOG_EXTENSIONS = (".db", ".sqlite")
+
 """
 Implementation details
 """
@@ -44,26 +49,50 @@ def get_testing_set(df_in, size):
     return df_in, df_out
 
 def buckets(df, val):
-    if val < 0.1:
-        return (df['Heart Rate'] < 45)
-    if val < 0.2:
-        return (df['Heart Rate'] >= 45) & (df['Heart Rate'] < 60)
-    if val < 0.3:
-        return (df['Heart Rate'] >= 60) & (df['Heart Rate'] < 75)
-    if val < 0.4:
-        return (df['Heart Rate'] >= 75) & (df['Heart Rate'] < 90)
-    if val < 0.5:
-        return (df['Heart Rate'] >= 90) & (df['Heart Rate'] < 105)
-    if val < 0.6:
-        return (df['Heart Rate'] >= 105) & (df['Heart Rate'] < 120)
-    if val < 0.7:
-        return (df['Heart Rate'] >= 120) & (df['Heart Rate'] < 135)
-    if val < 0.8:
-        return (df['Heart Rate'] >= 135) & (df['Heart Rate'] < 150)
-    if val < 0.9:
-        return (df['Heart Rate'] >= 150) & (df['Heart Rate'] < 175)
-    if val <= 1.0:
-        return (df['Heart Rate'] >= 175)
+    k = bucket_index(val)
+    if k is None:
+        return None
+
+    low, high = HR_BUCKETS[k]
+    if low is None:
+        return (df['Heart Rate'] < high)
+    if high is None:
+        return (df['Heart Rate'] >= low)
+    return (df['Heart Rate'] >= low) & (df['Heart Rate'] < high)
+
+
+def trial_path(data_path, subject, trial):
+    return os.path.join(data_path, "S" + str(subject).zfill(4), "Trial%d_frames" % int(trial))
+
+
+def read_trials(metadata, data_path, kind="frames"):
+    """
+    the labelled trials of a label csv (Subject, Trial, Heart Rate, Respiratory Rate)
+    or of a catalog database (.db, see basic_utils.catalog), with their Path
+
+    args:
+        metadata : the label csv or the catalog
+        data_path : the directory of the S%04d/Trial%d_frames trials
+        kind (optional) : with a catalog, the storage location used as the Path of the
+                          trials that have one, the others are looked for in data_path
+
+    returns:
+        a dataframe with the columns Subject, Trial, Heart Rate, Respiratory Rate and Path
+    """
+    if not metadata.endswith(CATALOG_EXTENSIONS):
+        metadf = pd.read_csv(metadata)
+        metadf['Path'] = metadf.apply(lambda row: trial_path(data_path, row["Subject"], row["Trial"]), axis=1)
+        return metadf
+
+    with Catalog(metadata) as catalog:
+        trials = catalog.trials(kind=kind)
+
+    return pd.DataFrame({"Subject": [t["subject"] for t in trials],
+                         "Trial": [t["trial"] for t in trials],
+                         "Heart Rate": [t["heart_rate"] for t in trials],
+                         "Respiratory Rate": [t["resp_rate"] for t in trials],
+                         "Path": [t["path"] or trial_path(data_path, t["subject"], t["trial"]) for t in trials]},
+                        columns=["Subject", "Trial", "Heart Rate", "Respiratory Rate", "Path"])
 
 def filter_path_with_set(filter_set, all_paths, augment_path=None, verbose=True):
     
@@ -74,8 +103,8 @@ def filter_path_with_set(filter_set, all_paths, augment_path=None, verbose=True)
         # ¯\_﹙ツ﹚_/¯
         # filter out only the keys of the dictionary the belong to this subject and trial
         filtered_keys = [key for key in all_paths.keys() 
-                if key.split('/')[1].split('_')[0] == subj_tri.split('_')[0] 
-                and key.split('/')[1].split('_')[1] == subj_tri.split('_')[1]]
+                if path_slug(key).split('_')[0] == subj_tri.split('_')[0] 
+                and path_slug(key).split('_')[1] == subj_tri.split('_')[1]]
         
         for key in filtered_keys:
             # filtered_set_paths[key] = all_paths[key] 
@@ -101,8 +130,20 @@ def filter_path_with_set(filter_set, all_paths, augment_path=None, verbose=True)
     return filtered_set_paths
 
 
+def path_slug(path):
+    """
+    the S%04d_t%d_p%d slug of a sample, whether its path is a consolidated
+    directory (consolidated/S0001_t1_p0) or, through a manifest, the
+    partition itself (rsz/S0001/Trial1_frames/0)
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    if len(parts) >= 3 and parts[-2].endswith("_frames"):
+        return "%s_t%s_p%s" % (parts[-3], parts[-2].split("_")[0][-1], parts[-1])
+    return parts[-1]
+
+
 def fetch_augmented(path, augmented_path):
-    without_dir = path.split('/')[1]
+    without_dir = path_slug(path)
     with_augmented = os.path.join(augmented_path, without_dir)
     if not os.path.exists(with_augmented):
         raise FileNotFoundError("{} augmented path does not exist, skipping...".format(with_augmented))
@@ -125,12 +166,33 @@ def set_to_str(title, data_set):
 
 
 def fetch_paths_with_labels(consolidated_csv, data_path): 
+    """
+    map the path of every sample in consolidated_csv to its (heart rate, respiratory rate)
+
+    args:
+        consolidated_csv : the csv written by consolidated_to_csv.py, samples with a PATH
+                           column are read from there
+        data_path : the consolidated directory, or the manifest written by
+                    consolidate_data.py --manifest
+    """
+    manifest = None
+    if os.path.isfile(data_path):
+        manifest = read_slug_manifest(data_path)
+
     with open(consolidated_csv, 'r') as p_csv:
         reader = csv.reader(p_csv)
-        next(reader)  # skip the header
+        header = next(reader)
+        path_column = header.index("PATH") if "PATH" in header else None
         paths = {}
         for path in reader:
-            full_path = os.path.join(data_path, path[0])
+            if path_column is not None:
+                full_path = path[path_column]
+            elif manifest is not None:
+                if path[0] not in manifest:
+                    raise FileNotFoundError("{} is not in the manifest {}".format(path[0], data_path))
+                full_path = manifest[path[0]]
+            else:
+                full_path = os.path.join(data_path, path[0])
             if not os.path.exists(full_path):
                 raise FileNotFoundError("{} does not exist!".format(full_path))
             paths[full_path] = (path[1], path[2])
@@ -113,9 +113,7 @@ def create_train_test_split_dataframes(data_path, metadata, output_dir,
     Description coming soon!
     """
 
-    metadf = pd.read_csv(metadata)
-    metadf['Path'] = metadf.apply (lambda row: os.path.join(data_path, "S" + str(row["Subject"]).zfill(4), 
-        "Trial%d_frames" % row["Trial"]), axis=1)
+    metadf = util.read_trials(metadata, data_path)
     
     real_subjects_df = metadf[metadf['Subject'].apply(lambda x: x.isdigit())]
     
@@ -151,10 +149,7 @@ def ttswcvs3(data_path, metadata, output_dir,
     This version works with "buckets", which each data point belongs to. This is to ensure that all data
     has roughly the same chance of being seen.
     """
-    metadf = pd.read_csv(metadata)
-    
-    metadf['Path'] = metadf.apply (lambda row: os.path.join(data_path, "S%04d" % row["Subject"], 
-        "Trial%d_frames" % row["Trial"]), axis=1)
+    metadf = util.read_trials(metadata, data_path)
         
     base.check_exists_create_if_not(output_dir)    
     
@@ -284,7 +279,8 @@ def train_test_split_with_csv_support(regular_data_path, filtered_csv, consolida
     'reg_part_out.csv', 'test3', augmented_data_path='aug_consolidated')
     
     args:
-        regular_data_path : path of the directory containing all of the data
+        regular_data_path : path of the directory containing all of the data, or the
+                            manifest written by consolidate_data.py --manifest
         filtered_csv : path to the csv containing the subjects and trials that will be used in the data split
         consolidated_csv : path to the csv containing the path, heart rate, and respiratory rate of each data point
         dir_out : directory that the csv files will be written to
@@ -298,8 +294,8 @@ def train_test_split_with_csv_support(regular_data_path, filtered_csv, consolida
 
     if not os.path.exists(regular_data_path):
         raise FileNotFoundError("Data path {} does not exist".format(regular_data_path))
-    if not os.path.isdir(regular_data_path):
-        raise ValueError("Data path {} is not a directory".format(regular_data_path))
+    if not os.path.isdir(regular_data_path) and not regular_data_path.endswith(".csv"):
+        raise ValueError("Data path {} is not a directory or a manifest".format(regular_data_path))
     if augmented_data_path != None and not os.path.exists(augmented_data_path):
         raise FileNotFoundError("Augmented data path {} does not exist".format(augmented_data_path))
     if augmented_data_path != None and not os.path.isdir(augmented_data_path):
@@ -1,7 +1,10 @@
 from .data_load import train_test_split_with_csv_support, ttswcsv2, ttswcvs3, data_set_to_csv, data_set_from_csv, create_train_test_split_dataframes
+from .data_load import read_trials
+from .data_load.split_utils import CATALOG_EXTENSIONS
 from .models import C3D, CNN_LSTM, CNN_3D, CNN_3D_small, CNN_Stacked_GRU, ResidualLSTM_v01, ResidualLSTM_v02, OpticalFlowCNN
 from .models.cyclic import CyclicLR
 from .processing import FrameProcessor
+from ..basic_utils.catalog import Catalog
 from keras import models
 from keras.callbacks import CSVLogger, ModelCheckpoint, Callback
 from keras import backend as K
@@ -10,6 +13,21 @@ import pandas as pd
 from sklearn.metrics import mean_squared_error
 import numpy as np
 
+def is_augmented(subject):
+    """
+    speed augmented subjects are named with a leading letter (see
+    video_core.augment.augmented_subject), real subjects are numbers
+    """
+    return not str(subject).isdigit()
+
+def drop_augmented(df):
+    """
+    the rows of df that belong to real subjects
+    """
+    if df is None or "Subject" not in df.columns:
+        return df
+    return df[~df["Subject"].apply(is_augmented)].reset_index(drop=True)
+
 class Engine():
     """
     The engine for training/testing a model
@@ -24,9 +42,20 @@ class Engine():
         train - boolean stating whether or not to train
         test - boolean stating whether or not to test
         frameproc - FrameProcessor object for augmentation
-        ignore_augmented - list containing phases of running the model in which to ignore augmented data
+        ignore_augmented - list containing phases of running the model ("train", "validation", "test") in which
+                           to ignore augmented data; ignoring it in "train" also turns off the processor's
+                           on-the-fly playback rate augmentation
         input_shape - shape of the sequence passed, 60 separate 100x100x3 frames
         output_shape - the number of outputs
+        train_shards - directory of record shards (see scripts/write_shards.py) to stream the
+                       training windows from instead of the frame directories, only the
+                       records of the training split are used
+        watch_catalog - pick up the trials appended to filtered_csv (or to catalog, when given)
+                        while training (e.g by ingest_trials.py) at the end of every epoch and
+                        train on them too, not with train_shards
+        catalog - sqlite dataset catalog (see scripts/build_catalog.py) to split the trials
+                  from instead of filtered_csv and to draw the training windows from,
+                  bucket by bucket
     """
     def __init__(self, 
                  data,
@@ -46,7 +75,10 @@ class Engine():
                  cyclic_lr=[], 
                  output_shape=1,
                  alt_opt_flow=False,
-                 opt_flow=False):
+                 opt_flow=False,
+                 train_shards=None,
+                 watch_catalog=False,
+                 catalog=None):
 
         self.data = data
         self.model_type = model_type
@@ -66,9 +98,34 @@ class Engine():
         self.cyclic_lr = cyclic_lr
         self.alt_opt_flow = alt_opt_flow
         self.opt_flow = opt_flow
+        self.train_shards = train_shards
+        self.watch_catalog = watch_catalog
+        self.catalog = catalog
         
         self.optical_flow_models = ["OpticalFlowCNN", "3D-CNN"]
 
+        if self.watch_catalog and self.train_shards is not None:
+            # the shards are written ahead of time, the trials appended to the catalog are not in them
+            raise ValueError("watch_catalog can't be used with train_shards, "
+                             "write the new trials to the shards and restart instead")
+
+        if "train" in self.ignore_augmented and getattr(self.processor, "playback_rate_range", None) is not None:
+            print("[Engine] ignoring augmented data in training, turning off playback rate augmentation")
+            self.processor.playback_rate_range = None
+
+    def __drop_ignored_augmented(self, train_set, test_set, val_set):
+        """
+        drop the augmented subjects from the phases listed in ignore_augmented
+        """
+        if "train" in self.ignore_augmented:
+            train_set = drop_augmented(train_set)
+        if "test" in self.ignore_augmented:
+            test_set = drop_augmented(test_set)
+        if "validation" in self.ignore_augmented:
+            val_set = drop_augmented(val_set)
+
+        return train_set, test_set, val_set
+
         
     def run2(self):
 
@@ -82,9 +139,18 @@ class Engine():
         if self.train and not self.load:
             print("Training the model.")
             #train_set, test_set, val_set = create_train_test_split_dataframes(self.data, self.metadata, self.outputs)
-            train_set, test_set, val_set = ttswcvs3(self.data, self.metadata, self.outputs)
+            train_set, test_set, val_set = ttswcvs3(self.data, self.catalog or self.metadata, self.outputs)
+            train_set, test_set, val_set = self.__drop_ignored_augmented(train_set, test_set, val_set)
             if not (self.model_type in self.optical_flow_models and self.opt_flow):
-                train_generator = self.processor.train_generator_v3(train_set)
+                if self.train_shards is not None:
+                    train_trials = set((str(subject), int(trial)) for subject, trial in zip(train_set["Subject"], train_set["Trial"]))
+                    train_generator = self.processor.shard_generator(self.train_shards,
+                                                                     keep=lambda subject, trial: (subject, trial) in train_trials)
+                elif self.catalog is not None:
+                    train_trials = zip(train_set["Subject"], train_set["Trial"])
+                    train_generator = self.processor.catalog_generator(Catalog(self.catalog), train_trials)
+                else:
+                    train_generator = self.processor.train_generator_v3(train_set)
                 val_generator = self.processor.testing_generator_v3(val_set)
                 test_generator = self.processor.testing_generator_v3(test_set)
                 gen_type = 'regular'
@@ -120,6 +186,11 @@ class Engine():
             if train_callback:
                 callbacks.append(train_callback)
 
+            if self.watch_catalog:
+                known = pd.concat([df for df in (train_set, test_set, val_set) if df is not None])
+                callbacks.append(NewSamplesCallback(self.processor, self.catalog or self.metadata, self.data, known,
+                                                    ignore_augmented="train" in self.ignore_augmented))
+
             if self.cyclic_lr != []:
                 base, mx = self.cyclic_lr
 
@@ -157,6 +228,8 @@ class Engine():
                 test_dir = os.path.join(self.inputs, "test.csv")
                 
                 test_set = pd.read_csv(test_dir)
+                if "test" in self.ignore_augmented:
+                    test_set = drop_augmented(test_set)
 
                 if not (self.model_type in self.optical_flow_models and self.opt_flow):
 
@@ -286,3 +359,70 @@ class TestResultsCallback(Callback):
                     if s == len(subjects):
                         s = 0
 
+
+class NewSamplesCallback(Callback):
+    """
+    at the end of every epoch, look for trials that were appended to the catalog
+    since training started and hand them to the processor's training generators,
+    so that newly ingested subjects are trained on without restarting
+
+    args:
+        processor - the FrameProcessor whose training generators get the new samples
+        catalog - the catalog csv, with at least Subject, Trial and Heart Rate columns,
+                  or the sqlite dataset catalog the trials were split from
+        data_path - the frame directory of trials without a Path column, as in ttswcvs3
+        known - dataframe of the samples already split into train/validation/test
+        ignore_augmented - leave out augmented subjects
+    """
+    def __init__(self, processor, catalog, data_path, known, ignore_augmented=False):
+        super().__init__()
+        self.processor = processor
+        self.catalog = catalog
+        self.data_path = data_path
+        self.known = set(self.__keys(known))
+        self.ignore_augmented = ignore_augmented
+        self.mtime = self.__mtime()
+
+    @staticmethod
+    def __keys(df):
+        return [(str(subject), int(trial)) for subject, trial in zip(df["Subject"], df["Trial"])]
+
+    def __path(self, row):
+        if "Path" in row and isinstance(row["Path"], str):
+            return row["Path"]
+        return os.path.join(self.data_path, "S%04d" % int(row["Subject"]), "Trial%d_frames" % int(row["Trial"]))
+
+    def __mtime(self):
+        # a sqlite catalog in WAL mode commits to its -wal file, not the database itself
+        stamps = tuple(os.path.getmtime(pth) for pth in (self.catalog, self.catalog + "-wal") if os.path.exists(pth))
+        return stamps or None
+
+    def on_epoch_end(self, epoch, logs=None):
+        mtime = self.__mtime()
+        if mtime is None or mtime == self.mtime:
+            return
+        self.mtime = mtime
+
+        if self.catalog.endswith(CATALOG_EXTENSIONS):
+            catalog = read_trials(self.catalog, self.data_path)
+        else:
+            catalog = pd.read_csv(self.catalog)
+        new = catalog[[key not in self.known for key in self.__keys(catalog)]]
+        if self.ignore_augmented:
+            new = drop_augmented(new)
+        if len(new) == 0:
+            return
+
+        new = new.copy()
+        new["Path"] = new.apply(self.__path, axis=1)
+        ready = new["Path"].apply(os.path.isdir)
+        if not ready.all():
+            # look again next epoch for the trials whose frames are not there yet
+            self.mtime = None
+        new = new[ready]
+        if len(new) == 0:
+            return
+
+        self.known.update(self.__keys(new))
+        self.processor.add_samples(new.reset_index(drop=True))
+        print("[NewSamplesCallback] epoch %d: training on %d new trials from %s" % (epoch + 1, len(new), self.catalog))
@@ -3,12 +3,18 @@ A module for processing frames as a sequence
 """
 
 from .data_load import buckets
-from ..basic_utils.video_core import optical_flow_of_first_and_rest
+from ..basic_utils.video_core import optical_flow_of_first_and_rest, read_trial_metadata, partition_frames
+from ..basic_utils.video_core import frame_index
+from ..basic_utils.video_core.augment import UPPER_THRESHOLD, LOWER_THRESHOLD
+from ..basic_utils.video_core.quality import trial_quality, good_frames, good_window_starts
+from ..basic_utils.frame_store import open_frame_source, ShardReader
+from ..basic_utils.catalog import HR_BUCKETS
 import threading 
 import os
 import random
 random.seed(7)
 import numpy as np
+import pandas as pd
 
 from keras.preprocessing.image import load_img, img_to_array
 from keras.preprocessing.image import apply_transform, transform_matrix_offset_center
@@ -199,22 +205,55 @@ def sequence_flip_axis(seq, axis):
     return seq
 
 
-def get_sample_frames(sample):
+def get_sample_frames(sample, frame_store=False):
     """
-    return the sorted list of absolute image paths for this sample
+    return the sorted list of absolute image paths for this sample, either
+    a partition directory or a partition record (see partition_records),
+    or the frames themselves from its frame store (or archive) when
+    frame_store is on and it has one; for a partition directory that is the
+    store itself, indexing and slicing it gives the frames, so an archive only
+    decompresses the chunks that are used
     """
+    if isinstance(sample, dict):
+        store = open_frame_source(sample["path"]) if frame_store else None
+        if store is not None:
+            return store.window(int(sample["start"]), int(sample["length"]), int(sample["stride"]))
+        return partition_frames(sample)
 
-    contents = os.listdir(sample)
-    max_frame = len(contents)
-    
-    filenames = [os.path.join(sample, "frame%d.png" % i) for i in range(max_frame)]
+    store = open_frame_source(sample) if frame_store else None
+    if store is not None:
+        return store
 
-    return filenames
+    return [os.path.join(sample, f) for f in frame_index(sample)]
   
 
+def get_trial_frames(path, frame_store=False):
+    """
+    return the temporally ordered frame paths of a trial directory and their
+    frame rate, read from the trial's metadata sidecar when it has one; with
+    frame_store on, the trial's FrameStore or FrameArchive instead of the paths
+    (indexing and slicing it gives the frames in place of their paths)
+    """
+    store = open_frame_source(path) if frame_store else None
+    if store is not None:
+        return store, store.fps
+
+    metadata = read_trial_metadata(path)
+    
+    if metadata is not None:
+        return [os.path.join(path, f) for f in metadata["frames"]], metadata["fps"]
+
+    frames = frame_index(path)
+    
+    # no sidecar, fall back to guessing the frame rate from the length
+    fps = 60 if len(frames) > 1300 else 30
+    
+    return [os.path.join(path, f) for f in frames], fps
+
+
 def build_image_sequence(frames, input_shape=(32, 32, 3), greyscale_on=False):
     """
-    return a list of images from filenames
+    return a list of images from filenames, or from uint8 frames (see FrameStore)
     """
     return [process_img(frame, input_shape, greyscale_on=greyscale_on) for frame in frames]
 
@@ -229,15 +268,21 @@ def process_img(frame, input_shape, greyscale_on=False):
     load up an image as a numpy array
 
     args:
-        frame : str - image path
+        frame : str - image path, or an h x w x nchannels uint8 RGB frame
         input_shape : tuple (h, w, nchannels)
 
     returns
         x : the loaded image
     """
     h_, w_, _ = input_shape
-    image = load_img(frame, target_size=(h_, w_))
-    img_arr = img_to_array(image)
+    if isinstance(frame, np.ndarray):
+        if frame.shape[:2] != (h_, w_):
+            # the same nearest neighbour resize load_img does
+            frame = np.asarray(pil_image.fromarray(frame).resize((w_, h_), pil_image.NEAREST))
+        img_arr = frame.astype(np.float32)
+    else:
+        image = load_img(frame, target_size=(h_, w_))
+        img_arr = img_to_array(image)
     
     x = (img_arr / 255.).astype(np.float32)
 
@@ -263,6 +308,16 @@ class FrameProcessor:
         horizontal_flip : bool - whether or not to flip horizontall with prob 0.5
         batch_size : int - the batch size
         shear_range: Float. Shear Intensity (Shear angle in counter-clockwise direction in degrees)
+        playback_rate_range : tuple (low, high) - draw a random playback rate in [low, high] for every
+                              training sample and scale its heart rate by it, None to disable
+        interpolate_playback : bool - blend neighbouring frames at fractional positions instead of
+                               taking the nearest frame
+        quality_thresholds : dict - only sample windows whose frames pass these thresholds (see
+                             video_core.quality.good_frames), using the statistics in the trial
+                             sidecars; None samples every window
+        min_good_fraction : float - the fraction of good frames a sampled window needs
+        frame_store : bool - read the trials and partitions that have a frame store or a frame
+                      archive (see scripts/pack_frames.py) from it instead of decoding their PNGs
     """
     def __init__(self,
                  scaler=None,
@@ -275,7 +330,12 @@ class FrameProcessor:
                  vertical_flip=False,
                  batch_size=4,
                  sequence_length=60,
-                 greyscale_on=False):
+                 greyscale_on=False,
+                 playback_rate_range=None,
+                 interpolate_playback=False,
+                 quality_thresholds=None,
+                 min_good_fraction=1.,
+                 frame_store=False):
         self.scaler = scaler
         self.rotation_range = rotation_range
         self.width_shift_range = width_shift_range
@@ -287,6 +347,13 @@ class FrameProcessor:
         self.greyscale_on = greyscale_on 
         self.sequence_length = sequence_length
         self.batch_size = batch_size
+        self.playback_rate_range = playback_rate_range
+        self.interpolate_playback = interpolate_playback
+        self.quality_thresholds = quality_thresholds
+        self.min_good_fraction = min_good_fraction
+        self.frame_store = frame_store
+        self._good_starts = {}
+        self._new_samples = []
         self.test_iter = 0
 
         assert type(self.rotation_range) == int, "rotation_range should be integer valued"
@@ -305,6 +372,125 @@ class FrameProcessor:
         assert type(self.sequence_length) == int, "sequence_length should be an integer"
         assert self.sequence_length > 0, "sequence_length should be > 0"
 
+        if self.playback_rate_range is not None:
+            low, high = self.playback_rate_range
+            assert 0 < low <= high, "playback_rate_range should be (low, high) with 0 < low <= high, got %s" % str(self.playback_rate_range)
+
+    def add_samples(self, samples_df):
+        """
+        queue new training samples (rows like the ones of train_df) for the
+        running training generators, which take them in before their next batch
+        """
+        if samples_df is not None and len(samples_df) > 0:
+            self._new_samples.append(samples_df)
+
+    def take_new_samples(self, train_df, seen):
+        """
+        train_df with the samples queued by add_samples since the first seen were taken in
+
+        returns:
+            (train_df, seen)
+        """
+        queued = len(self._new_samples)
+        if queued == seen:
+            return train_df, seen
+
+        return pd.concat([train_df] + self._new_samples[seen:queued], ignore_index=True, sort=False), queued
+
+    def good_frames(self, trial_dir, num_frames):
+        """
+        the boolean mask of the trial's frames passing self.quality_thresholds,
+        or None if there are no thresholds or no statistics for the trial
+        """
+        if self.quality_thresholds is None:
+            return None
+
+        quality = trial_quality(trial_dir)
+        if quality is None or len(quality["mean"]) != num_frames:
+            return None
+
+        return good_frames(quality, self.quality_thresholds)
+
+    def window_start(self, trial_dir, num_frames, length, stride=1):
+        """
+        a random start for a window of length frames taking every stride'th frame,
+        among the windows that pass the quality thresholds when there are any
+        """
+        key = (trial_dir, num_frames, length, stride)
+        if key not in self._good_starts:
+            good = self.good_frames(trial_dir, num_frames)
+            starts = None
+            if good is not None:
+                starts = good_window_starts(good, length, stride, self.min_good_fraction)
+            
+            # a trial without a single good window is sampled anywhere rather than dropped
+            self._good_starts[key] = starts if starts is not None and len(starts) > 0 else None
+
+        starts = self._good_starts[key]
+        if starts is None:
+            return random.randint(0, num_frames - (length - 1) * stride - 1)
+
+        return int(starts[random.randint(0, len(starts) - 1)])
+
+    def draw_playback_rate(self, heart_rate, num_frames, step=1):
+        """
+        draw a playback rate from playback_rate_range, clamped so that the scaled
+        heart rate stays within the thresholds of the offline speed augmentation
+        and the window still fits in the trial
+        """
+        low, high = self.playback_rate_range
+        if heart_rate > 0:
+            low = max(low, LOWER_THRESHOLD / heart_rate)
+            high = min(high, UPPER_THRESHOLD / heart_rate)
+
+        high = min(high, (num_frames - 1) / float(step * max(1, self.sequence_length - 1)))
+        
+        if high < low:
+            return 1.
+        
+        return random.uniform(low, high)
+
+    def playback_window(self, frames, heart_rate, step=1):
+        """
+        select a random window of self.sequence_length frames played back at a random
+        rate (see draw_playback_rate), striding through the trial by step * rate frames
+
+        args:
+            frames : the temporally ordered frame paths of the trial
+            heart_rate : the heart rate of the trial
+            step : the stride at a playback rate of 1, e.g 2 for 60 fps trials
+
+        returns:
+            the loaded sequence, the rate and the heart rate scaled by the rate
+        """
+        rate = self.draw_playback_rate(heart_rate, len(frames), step=step)
+        stride = step * rate
+        trial_dir = getattr(frames, "source", None) or os.path.dirname(frames[0])
+        good = self.good_frames(trial_dir, len(frames))
+
+        # redraw windows that fail the quality thresholds a few times before settling
+        for _ in range(10):
+            start = random.uniform(0, max(0, len(frames) - 1 - stride * (self.sequence_length - 1)))
+            positions = [min(start + j * stride, len(frames) - 1) for j in range(self.sequence_length)]
+            if good is None or good[[int(round(p)) for p in positions]].mean() >= self.min_good_fraction:
+                break
+
+        if not self.interpolate_playback:
+            selected = [frames[int(round(p))] for p in positions]
+            return build_image_sequence(selected, greyscale_on=self.greyscale_on), rate, heart_rate * rate
+
+        # load every frame the window touches once, then blend at the fractional positions
+        needed = sorted(set(int(p) for p in positions) | set(min(int(p) + 1, len(frames) - 1) for p in positions))
+        loaded = dict(zip(needed, build_image_sequence([frames[i] for i in needed], greyscale_on=self.greyscale_on)))
+
+        sequence = []
+        for p in positions:
+            first, weight = int(p), p - int(p)
+            second = min(first + 1, len(frames) - 1)
+            sequence.append((1 - weight) * loaded[first] + weight * loaded[second])
+        
+        return sequence, rate, heart_rate * rate
+
 
     @threadsafe_generator
     def testing_generator(self, paths2labels, generator_type):
@@ -318,7 +504,7 @@ class FrameProcessor:
 
             y = [y]
             #y = [paths2labels[pth] for pth in selected_paths]
-            frames = get_sample_frames(selected_path)
+            frames = get_sample_frames(selected_path, self.frame_store)
             sequence = build_image_sequence(frames, greyscale_on=self.greyscale_on)
             X.append(sequence)
             print(selected_path)
@@ -332,6 +518,157 @@ class FrameProcessor:
             yield np.array(X), np.array(y)
 
     
+    @threadsafe_generator
+    def partition_generator(self, records_df):
+        """
+        generate batches of partitions from a dataframe of partition records
+        (PATH, START, LENGTH, STRIDE, HEART RATE) without augmenting them,
+        cycling through the records in order
+        """
+        records = [{"path": row["PATH"], "start": row["START"], "length": row["LENGTH"], "stride": row["STRIDE"]}
+                   for _, row in records_df.iterrows()]
+        hr = list(records_df["HEART RATE"])
+        print("[partition_generator] %d partition records" % len(records))
+        
+        i = 0
+        while True:
+            X, y = [], []
+            for _ in range(self.batch_size):
+                frames = get_sample_frames(records[i], self.frame_store)[:self.sequence_length]
+                current_hr = hr[i]
+                
+                if self.scaler:
+                    current_hr = self.scaler.transform(current_hr)[0][0]
+
+                X.append(build_image_sequence(frames, greyscale_on=self.greyscale_on))
+                y.append(current_hr)
+                
+                i += 1
+                if i == len(records):
+                    i = 0
+
+            yield np.array(X), np.array(y)
+
+    def augment_sequence(self, sequence):
+        """
+        apply the random rotation, shift, shear, zoom and flips of this processor to a sequence
+        """
+        if self.rotation_range > 0.0:
+            sequence = random_sequence_rotation(sequence, self.rotation_range)
+
+        if self.width_shift_range > 0.0 or self.height_shift_range > 0.0:
+            sequence = random_sequence_shift(sequence, self.width_shift_range, self.height_shift_range)
+        
+        if self.shear_range > 0.0:
+            sequence = random_sequence_shear(sequence, self.shear_range)
+
+        if self.zoom_range > 0.0:
+            sequence = random_sequence_zoom(sequence, self.zoom_range)
+        
+        # with probability 0.5, flip the row axis, then the column axis
+        if self.vertical_flip and np.random.random_sample() > 0.5:
+            sequence = sequence_flip_axis(sequence, 1)
+        
+        if self.horizontal_flip and np.random.random_sample() > 0.5:
+            sequence = sequence_flip_axis(sequence, 2)
+
+        return sequence
+
+    @threadsafe_generator
+    def shard_generator(self, shard_dir, keep=None, interleave=4, shuffle_buffer=1024, augment=True):
+        """
+        generate batches of windows streamed from the record shards written by
+        scripts/write_shards.py, so that training only does large sequential reads
+
+        args:
+            shard_dir : the directory of the shards
+            keep : function of (subject, trial), train only on the records it is true for,
+                   e.g the trials of the training split
+            interleave : the number of shards read at once
+            shuffle_buffer : the number of records shuffled in memory
+            augment : apply this processor's augmentation to the windows
+        """
+        records = iter(ShardReader(shard_dir, interleave=interleave, shuffle_buffer=shuffle_buffer, keep=keep))
+
+        while True:
+            X, y = [], []
+            for _ in range(self.batch_size):
+                record = next(records)
+                hr = record["heart_rate"]
+                
+                if self.scaler:
+                    hr = self.scaler.transform(hr)[0][0]
+
+                sequence = build_image_sequence(record["frames"][:self.sequence_length], greyscale_on=self.greyscale_on)
+                if augment:
+                    sequence = self.augment_sequence(sequence)
+
+                X.append(sequence)
+                y.append(hr)
+
+            yield np.array(X), np.array(y)
+
+    @threadsafe_generator
+    def catalog_generator(self, catalog, trials, bucket_list=None, augment=True):
+        """
+        generate batches of windows drawn from a dataset catalog: first a heart
+        rate bucket, then one of the windows of trials in that bucket, so every
+        bucket is trained on as often regardless of its size
+
+        args:
+            catalog : the basic_utils.catalog Catalog holding the windows
+            trials : the (subject, trial) pairs to train on, e.g the training split
+            bucket_list : the HR_BUCKETS indices to draw from, all by default;
+                          the buckets without windows are left out
+            augment : apply this processor's augmentation to the windows
+
+        the windows of the trials queued by add_samples are looked up and
+        drawn from too, from the next batch on
+        """
+        trials = list(trials)
+        bucket_list = range(len(HR_BUCKETS)) if bucket_list is None else bucket_list
+        by_bucket = {}
+
+        def look_up(trials):
+            for k in bucket_list:
+                windows = catalog.windows(trials=trials, bucket=k)
+                if windows:
+                    by_bucket.setdefault(k, []).extend(windows)
+            return sorted(by_bucket)
+
+        drawn = look_up(trials)
+        if not drawn:
+            raise ValueError("%s has no windows for the %d trials" % (catalog.path, len(trials)))
+
+        seen = len(self._new_samples)
+        while True:
+            queued = len(self._new_samples)
+            if queued > seen:
+                new = [(str(subject), int(trial)) for samples in self._new_samples[seen:queued]
+                       for subject, trial in zip(samples["Subject"], samples["Trial"])]
+                drawn, seen = look_up(new), queued
+
+            X, y = [], []
+            for _ in range(self.batch_size):
+                windows = by_bucket[drawn[random.randint(0, len(drawn)-1)]]
+                window = windows[random.randint(0, len(windows)-1)]
+                hr = window["heart_rate"]
+
+                if self.scaler:
+                    hr = self.scaler.transform(hr)[0][0]
+
+                # a partition directory, or a record over the frames of its trial
+                sample = window["path"] if window["start"] is None else window
+                frames = get_sample_frames(sample, self.frame_store)
+                sequence = build_image_sequence(frames[:self.sequence_length], greyscale_on=self.greyscale_on)
+                if augment:
+                    sequence = self.augment_sequence(sequence)
+
+                X.append(sequence)
+                y.append(hr)
+
+            yield np.array(X), np.array(y)
+
     @threadsafe_generator
     def testing_generator_v2(self, paths2labels):
         """
@@ -344,23 +681,13 @@ class FrameProcessor:
             X, y = [], []
             
             selected_paths = random.sample(sequence_paths, self.batch_size)
-            content_sizes = [len(os.listdir(p)) for p in selected_paths]
-            fps = []
-
-            for sz in content_sizes:
-                if sz > 1300:
-                    fps.append(60)
-
-                else:
-                    fps.append(30)
             
-            for path, sz, fps_ in zip(selected_paths, content_sizes, fps):
+            for path in selected_paths:
                 
                 heart_rate, resp_rate = paths2labels[path]
                 
-                frames = os.listdir(path)
-                frames = sorted(frames)
-                frames = [os.path.join(path, frame) for frame in frames]
+                frames, fps_ = get_trial_frames(path, self.frame_store)
+                sz = len(frames)
                 
                 selected_frames = None
 
@@ -391,12 +718,11 @@ class FrameProcessor:
             if self.scaler:
                 current_hr = self.scaler.transform(current_hr)[0][0]
             
-            frame_dir = sorted(os.listdir(current_path))
+            frame_dir, _ = get_trial_frames(current_path, self.frame_store)
             #hard-code to 2 for now, because there are a lot of samples
             for _ in range(2):
-                start = random.randint(0, len(frame_dir)-self.sequence_length)
+                start = self.window_start(current_path, len(frame_dir), self.sequence_length)
                 frames = frame_dir[start:start+self.sequence_length]
-                frames = [os.path.join(current_path, frame) for frame in frames]
                 X.append(build_image_sequence(frames, greyscale_on=self.greyscale_on))
                 y.append(current_hr)
 
@@ -423,10 +749,9 @@ class FrameProcessor:
             #hard-code to 2 for now, because there are a lot of samples
             for _ in range(2):
 
-                all_frames = sorted(os.listdir(current_path))
+                all_frames, _ = get_trial_frames(current_path, self.frame_store)
                 start = random.randint(0, len(all_frames)-self.sequence_length-1)
                 frames = all_frames[start:start+self.sequence_length+1]
-                frames = [os.path.join(current_path, frame) for frame in frames]
                 
                 flows_x, flows_y = optical_flow_of_first_and_rest(frames)
                 sequence_hor = np.array(flows_x)
@@ -450,7 +775,9 @@ class FrameProcessor:
     def train_generator_alt_optical_flow(self, train_df):
         bucket_list = [0, .1, .2, .3, .4, .5, .6, .7, .8, .9]
 
+        seen = len(self._new_samples)
         while True:
+            train_df, seen = self.take_new_samples(train_df, seen)
             X, y = [], []
             for _ in range(self.batch_size):
                 
@@ -465,10 +792,9 @@ class FrameProcessor:
                 if self.scaler:
                     hr = self.scaler.transform(hr)[0][0]
                 
-                all_frames = sorted(os.listdir(path))
+                all_frames, _ = get_trial_frames(path, self.frame_store)
                 start = random.randint(0, len(all_frames)-self.sequence_length-1)
                 frames = all_frames[start:start+self.sequence_length+1]
-                frames = [os.path.join(path, frame) for frame in frames]
                 flows_x, flows_y = optical_flow_of_first_and_rest(frames)
                 sequence_hor = np.expand_dims(np.array(flows_x), axis=3)
                 sequence_ver = np.expand_dims(np.array(flows_y), axis=3)
@@ -526,8 +852,8 @@ class FrameProcessor:
             if self.scaler:
                 current_hr = self.scaler.transform(current_hr)[0][0]
 
-            frame_hor_dir = sorted(os.listdir(os.path.join(current_path, 'flow_h')))
-            frame_ver_dir = sorted(os.listdir(os.path.join(current_path, 'flow_v')))
+            frame_hor_dir = frame_index(os.path.join(current_path, 'flow_h'))
+            frame_ver_dir = frame_index(os.path.join(current_path, 'flow_v'))
 
             #frame_hor_dir = [path for path in frame_hor_dir if path != 'flow_h' and path != 'flow_v']
             #frame_ver_dir = [path for path in frame_ver_dir if path != 'flow_h' and path != 'flow_v']
@@ -559,7 +885,9 @@ class FrameProcessor:
     def train_generator_optical_flow(self, train_df):
         bucket_list = [.1, .2, .3, .4, .5, .6]
 
+        seen = len(self._new_samples)
         while True:
+            train_df, seen = self.take_new_samples(train_df, seen)
             X, y = [], []
             for _ in range(self.batch_size):
                 
@@ -578,8 +906,8 @@ class FrameProcessor:
                 if self.scaler:
                     hr = self.scaler.transform(hr)[0][0]
                 
-                frame_hor_dir = sorted(os.listdir(os.path.join(path,'flow_h')))
-                frame_ver_dir = sorted(os.listdir(os.path.join(path,'flow_v')))
+                frame_hor_dir = frame_index(os.path.join(path,'flow_h'))
+                frame_ver_dir = frame_index(os.path.join(path,'flow_v'))
                 
                 #frame_hor_dir = [path for path in frame_hor_dir if path != 'flow_h' and path != 'flow_v']
                 #frame_ver_dir = [path for path in frame_ver_dir if path != 'flow_h' and path != 'flow_v']
@@ -634,7 +962,9 @@ class FrameProcessor:
     def train_generator_v3(self, train_df):
         #bucket_list = [0, .1, .2, .3, .4, .5, .6, .7, .8, .9]
         bucket_list = [.1, .2, .3, .4, .5, .6]
+        seen = len(self._new_samples)
         while True:
+            train_df, seen = self.take_new_samples(train_df, seen)
             X, y = [], []
 
             for _ in range(self.batch_size):
@@ -650,15 +980,17 @@ class FrameProcessor:
                 path = list(train_df['Path'])[random_index]
                 hr = list(train_df['Heart Rate'])[random_index]
 
+                frame_dir, _ = get_trial_frames(path, self.frame_store)
+
+                if self.playback_rate_range is not None:
+                    sequence, _, hr = self.playback_window(frame_dir, hr)
+                else:
+                    start = self.window_start(path, len(frame_dir), self.sequence_length)
+                    frames = frame_dir[start:start+self.sequence_length]
+                    sequence = build_image_sequence(frames, greyscale_on=self.greyscale_on)
+                
                 if self.scaler:
                     hr = self.scaler.transform(hr)[0][0]
-               
-                frame_dir = sorted(os.listdir(path))
-                start = random.randint(0, len(frame_dir)-self.sequence_length)
-                frames = frame_dir[start:start+self.sequence_length]
-                frames = [os.path.join(path, frame) for frame in frames]
-
-                sequence = build_image_sequence(frames, greyscale_on=self.greyscale_on)
                 
                 # now we want to apply the augmentation
                 if self.rotation_range > 0.0:
@@ -703,35 +1035,30 @@ class FrameProcessor:
             X, y = [], []
             
             selected_paths = random.sample(sequence_paths, self.batch_size)
-            content_sizes = [len(os.listdir(p)) for p in selected_paths]
-            fps = []
-
-            for sz in content_sizes:
-                if sz > 1300:
-                    fps.append(60)
-
-                else:
-                    fps.append(30)
             
-            for path, sz, fps_ in zip(selected_paths, content_sizes, fps):
+            for path in selected_paths:
                 
                 heart_rate, resp_rate = paths2labels[path]
                 
-                frames = os.listdir(path)
-                frames = sorted(frames)
-                frames = [os.path.join(path, frame) for frame in frames]
+                frames, fps_ = get_trial_frames(path, self.frame_store)
+                sz = len(frames)
                 
                 selected_frames = None
 
-                if fps_ > 30:
-                    seq_begin = random.randint(0, sz - 2 * self.sequence_length)
-                    selected_frames = frames[seq_begin:seq_begin + self.sequence_length:2]
+                if self.playback_rate_range is not None:
+                    sequence, rate, heart_rate = self.playback_window(frames, heart_rate, step=2 if fps_ > 30 else 1)
+                    resp_rate = resp_rate * rate
 
                 else:
-                    seq_begin = random.randint(0, sz - self.sequence_length) 
-                    selected_frames = frames[seq_begin:seq_begin + self.sequence_length]
-                
-                sequence = build_image_sequence(selected_frames, greyscale_on=self.greyscale_on)
+                    if fps_ > 30:
+                        seq_begin = random.randint(0, sz - 2 * self.sequence_length)
+                        selected_frames = frames[seq_begin:seq_begin + self.sequence_length:2]
+
+                    else:
+                        seq_begin = random.randint(0, sz - self.sequence_length) 
+                        selected_frames = frames[seq_begin:seq_begin + self.sequence_length]
+                    
+                    sequence = build_image_sequence(selected_frames, greyscale_on=self.greyscale_on)
 
                 # now we want to apply the augmentation
                 if self.rotation_range > 0.0:
@@ -786,7 +1113,7 @@ class FrameProcessor:
             
             for pth in selected_paths:
                
-                frames = get_sample_frames(pth)
+                frames = get_sample_frames(pth, self.frame_store)
                 sequence = build_image_sequence(frames, greyscale_on=self.greyscale_on)
                 
                 # now we want to apply the augmentation